@@ -13,12 +13,15 @@ Arguments:
     gens_file           Explicit genotypes file generated by get_chr_tables.sh
     cas                 Types of cas, comma-separated.
     pams_dir            Directory where pam locations in ref_genome are located. 
-    ref_genome_fasta    Fasta file for reference genome.
+    ref_genome_fasta    Fasta file for reference genome, or a genome packed by packed_genome.py.
     out                 Prefix for output files.
 Options:
     -C --cas-list       List available cas types and exits.
     -v                  Verbose mode.
-    --guide_len=<S>     Guide length, commonly 20 bp, for annotating guides near a PAM [default: 20].
+    --guide_len=<S>     Guide length, commonly 20 bp, for annotating guides near a PAM [default: 20]. Comma-separated
+                        if different for different cas types, '/'-separated for several lengths of one cas type,
+                        e.g. 20,21/22. var_near_<cas> uses the longest; with several lengths, var_near_<cas>_<length>
+                        is added for each.
 """
 
 import pandas as pd
@@ -26,7 +29,6 @@ import numpy as np
 from docopt import docopt
 import os, sys, logging
 from collections import Counter
-from pyfaidx import Fasta
 import regex
 
 __version__ = "0.0.4"
@@ -42,6 +44,7 @@ metadata_path = ef_path.replace("annotate_variants", "")
 sys.path.append(metadata_path)
 # Import cas_object
 import cas_object as cas_obj
+from packed_genome import open_reference
 from get_metadata import add_metadata
 
 
@@ -58,24 +61,48 @@ def norm_chr(chrom_str, gens_chrom):
         return chrom_str
 
 
-def get_range_upstream(pam_pos, guide_len):
+def nearest_pam_distances(positions, pams):
     """
-    Get positions N bp upstream, i.e. for forward 3' PAMs or reverse 5' PAMs
-    :param pam_pos: position of PAM, int.
-    :return: sgRNA seed region positions, set of ints.
+    Get the distance from each position to the nearest PAM on either side.
+    :param positions: variant positions, np array of ints.
+    :param pams: PAM positions, np array of ints.
+    :return: distance to nearest PAM after each position (pam - pos >= 1) and before it
+    (pos - pam >= 1), np arrays of floats, inf where there is no such PAM.
     """
-    sgrna = set(range(pam_pos - (guide_len + 1), pam_pos))
-    return sgrna
+    pams = np.asarray(pams, dtype=np.int64)
+    if pams.size > 1 and not np.all(pams[1:] >= pams[:-1]):
+        pams = np.sort(pams)
+    positions = np.asarray(positions, dtype=np.int64)
+    padded = np.concatenate(([-np.inf], pams, [np.inf]))
+    after = padded[np.searchsorted(pams, positions, side="right") + 1] - positions
+    before = positions - padded[np.searchsorted(pams, positions, side="left")]
+    return after, before
 
 
-def get_range_downstream(pam_pos, guide_len):
+def get_pam_distances(positions, pam_for_pos, pam_rev_pos, primeness):
     """
-    Get positions N bp downstream, i.e. for forward 5' PAMs or reverse 3' PAMs
-    :param pam_pos: position of PAM, int.
-    :return: sgRNA seed region positions, set of ints.
+    Get, for each variant, the distance to the nearest PAM whose sgRNA lies downstream of the
+    variant (forward 3' PAMs or reverse 5' PAMs) and upstream of it (forward 5' PAMs or reverse 3' PAMs).
+    :param positions: variant positions, np array of ints.
+    :param pam_for_pos: PAM positions on the + strand, np array of ints.
+    :param pam_rev_pos: PAM positions on the - strand, np array of ints.
+    :param primeness: primeness of the Cas PAM, 3' or 5'.
+    :return: upstream-guide and downstream-guide PAM distances, np arrays of floats.
     """
-    sgrna = set(range(pam_pos + 1, pam_pos + (guide_len + 1)))
-    return sgrna
+    for_after, for_before = nearest_pam_distances(positions, pam_for_pos)
+    rev_after, rev_before = nearest_pam_distances(positions, pam_rev_pos)
+    if primeness == "3'":
+        return for_after, rev_before
+    return rev_after, for_before
+
+
+def near_pam(dist_upstream, dist_downstream, guide_len):
+    """
+    Whether each variant falls in the sgRNA of some PAM, for guides of length guide_len, i.e. within
+    guide_len + 1 bp before a PAM whose sgRNA is upstream of it or guide_len bp after one whose sgRNA is downstream.
+    :return: np array of bools.
+    """
+    return (dist_upstream <= guide_len + 1) | (dist_downstream <= guide_len)
 
 
 def find_spec_pams(cas_obj, python_string, orient="3prime"):
@@ -219,11 +246,15 @@ def main(args):
     out = args["<out>"]
     pams_dir = args["<pams_dir>"]
     gens = args["<gens_file>"]
-    guide_len = int(args["--guide_len"])
-    ref_genome = Fasta(args["<ref_genome_fasta>"], as_raw=True)
+    ref_genome = open_reference(args["<ref_genome_fasta>"])
 
     global cas_list
     cas_list = list(args["<cas>"].split(","))
+    try:
+        guide_lens = cas_obj.get_guide_lengths(cas_list, args["--guide_len"])
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
 
     # Read in gens and chroms file, and see if gens file needs to be split.
     gens = pd.read_hdf(gens, "all")
@@ -242,9 +273,6 @@ def main(args):
     #     logging.error(f"{args['<gens_file>']} chromosomes/notations differ from {args['<ref_genome_fasta>']}: {chroms} and {list(ref_genome.keys())}.")
     #     exit(1)
 
-    # save locations of PAM proximal variants to dictionary
-    pam_prox_vars = {}
-    # get variants within sgRNA region for 3 prime PAMs (20 bp upstream of for pos and vice versa)
     FULL_CAS_LIST = cas_obj.get_cas_list(os.path.join(cas_obj_path, "CAS_LIST.txt"))
     for cas in cas_list:
         if cas not in FULL_CAS_LIST:
@@ -253,50 +281,38 @@ def main(args):
 
     combined_df = []
     for i, chrom in enumerate(chroms):
-        chr_variants = set(gens[i]["pos"].tolist())
+        chr_variants = gens[i]["pos"].values
+        # distances from each variant to its nearest PAMs, computed once per Cas with the
+        # longest guide window and then thresholded for every guide length
+        pam_prox_vars = {}
         for cas in cas_list:
             current_cas = cas_obj.get_cas_enzyme(
                 cas, os.path.join(cas_obj_path, "CAS_LIST.txt")
             )
 
             logging.info(f"Evaluating {current_cas.name} at {chrom}.")
-            cas_prox_vars = []
-            pam_dict = {}
             pam_for_pos = np.load(
                 os.path.join(pams_dir, f"{chrom}_{cas}_pam_sites_for.npy")
-            ).tolist()
+            )
             pam_rev_pos = np.load(
                 os.path.join(pams_dir, f"{chrom}_{cas}_pam_sites_rev.npy")
-            ).tolist()
-
-            if current_cas.primeness == "3'":
-                for pos in pam_for_pos:
-                    prox_vars = set(get_range_upstream(pos, guide_len)) & chr_variants
-                    cas_prox_vars.extend(prox_vars)
-                    pam_dict[pos] = prox_vars
-                for pos in pam_rev_pos:
-                    prox_vars = set(get_range_downstream(pos, guide_len)) & chr_variants
-                    cas_prox_vars.extend(prox_vars)
-                    pam_dict[pos] = prox_vars
-
-            elif current_cas.primeness == "5'":
-                for pos in pam_for_pos:
-                    prox_vars = set(get_range_downstream(pos, guide_len)) & chr_variants
-                    cas_prox_vars.extend(prox_vars)
-                    pam_dict[pos] = prox_vars
-                for pos in pam_rev_pos:
-                    prox_vars = set(get_range_upstream(pos, guide_len)) & chr_variants
-                    cas_prox_vars.extend(prox_vars)
-                    pam_dict[pos] = prox_vars
-
-            pam_prox_vars[cas] = cas_prox_vars
+            )
+            dist_upstream, dist_downstream = get_pam_distances(
+                chr_variants, pam_for_pos, pam_rev_pos, current_cas.primeness
+            )
+            pam_prox_vars[cas] = {
+                length: near_pam(dist_upstream, dist_downstream, length)
+                for length in guide_lens[cas]
+            }
 
         chrdf = get_made_broke_pams(gens[i], chrom, ref_genome)
 
         for cas in cas_list:
-            # print(cas)
-            spec_pam_prox_vars = pam_prox_vars[cas]
-            chrdf[f"var_near_{cas}"] = chrdf["pos"].isin(spec_pam_prox_vars)
+            # var_near_{cas} uses the longest guide; with several lengths, each also gets its own column
+            chrdf[f"var_near_{cas}"] = pam_prox_vars[cas][max(guide_lens[cas])]
+            if len(guide_lens[cas]) > 1:
+                for length in guide_lens[cas]:
+                    chrdf[f"var_near_{cas}_{length}"] = pam_prox_vars[cas][length]
 
         cas_cols = []
         for cas in cas_list:
@@ -305,6 +321,8 @@ def main(args):
                 for w in ["makes_cas", "breaks_cas", "var_near_cas"]
             ]
             cas_cols.extend(prelim_cols)
+            if len(guide_lens[cas]) > 1:
+                cas_cols.extend([f"var_near_{cas}_{length}" for length in guide_lens[cas]])
         keepcols = ["chrom", "pos", "ref", "alt"] + cas_cols
         chrdf = chrdf[keepcols]
         combined_df.append(chrdf)
@@ -10,7 +10,7 @@ Usage:
 
 Arguments:
     chrom             Chromosome being analyzed.
-    fasta             Fasta file for genome being analyzed.
+    fasta             Fasta file for genome being analyzed, or a genome packed by packed_genome.py.
     cas_list          Comma separated (no spaces!) list of Cas varieties to evaluate, options below.
     out               Out prefix for returned files.
 
@@ -19,7 +19,6 @@ Available Cas types = cpf1,SpCas9,SpCas9_VRER,SpCas9_EQR,SpCas9_VQR_1,SpCas9_VQR
 
 import numpy as np
 import sys, os
-from pyfaidx import Fasta
 import pandas as pd
 import regex
 import re
@@ -39,6 +38,7 @@ metadata_path = ef_path.replace('find_pams_in_reference','')
 sys.path.append(metadata_path)
 # Import cas_object
 import cas_object as cas_obj
+from packed_genome import open_reference
 from get_metadata import add_metadata
 
 # get rid of annoying false positive Pandas error
@@ -161,7 +161,7 @@ def main(args):
 
     # make Fasta object for genome of choice, e.g. hg19
 
-    genome = Fasta(args['<fasta>'],as_raw=True)
+    genome = open_reference(args['<fasta>'])
 
     cas_list = args['<cas_list>'].split(',')
 
@@ -172,8 +172,9 @@ def main(args):
         for_starts, rev_starts = find_spec_pams(current_cas,str(genome[str(chrom)]), orient=current_cas.primeness)
         savestr_for = f'{outprefix}'+str(chrom)+'_'+str(cas) + '_pam_sites_for.npy'
         savestr_rev = f'{outprefix}'+str(chrom)+'_'+str(cas) + '_pam_sites_rev.npy'
-        np.save(savestr_for,list(for_starts))
-        np.save(savestr_rev,list(rev_starts))
+        # save sorted so that gen_sgRNAs.py can memory-map and binary search the sites
+        np.save(savestr_for,np.array(sorted(for_starts), dtype=np.int64))
+        np.save(savestr_rev,np.array(sorted(rev_starts), dtype=np.int64))
 
 
 if __name__ == '__main__':
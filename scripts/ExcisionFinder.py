@@ -6,12 +6,15 @@ ExcisionFinder identifies allele-specific excision sites. Written in Python vers
 Kathleen Keough et al 2017-2018.
 
 Usage: 
-        ExcisionFinder.py [-vsgc] <gene_dat> <gene> <annots_file> <maxcut> <cas_list> <bcf> <out> [--window=<window_in_bp>] [--not_phased] [--guides=<guides>] [--exhaustive]
+        ExcisionFinder.py [-vsgc] <gene_dat> <gene> <annots_file> <maxcut> <cas_list> <bcf> <out> [--window=<window_in_bp>] [--not_phased] [--guides=<guides>] [--exhaustive] [--out_format=<f>]
+        ExcisionFinder.py [-vsc] --batch <gene_dat> <gene> <annots_file> <maxcut> <cas_list> <bcf> <out> [--window=<window_in_bp>] [--not_phased] [--exhaustive] [--out_format=<f>] [--processes=<n>] [--resume] [--sweep]
         ExcisionFinder.py -h
 
 Arguments:
-    gene_dat                         Gene annotations file (gene_gene_dat_wsize) filepath.
-    gene                             Gene you would like to analyze.
+    gene_dat                         Gene annotations file (gene_gene_dat_wsize) filepath, or a gene catalog
+                                     made from it by gene_catalog.py.
+    gene                             Gene you would like to analyze. With --batch, a file listing genes, one
+                                     per line, or a BED file with gene names in column 4.
     var_annots                       Variant annotation HDF5 file.
     maxcut                           Maximum distance between cut position pairs.
     cas_list                         Comma separated (no spaces!) list of Cas varieties to evaluate, options below.
@@ -30,6 +33,19 @@ Options:
                                      on same haplotype.
     --guides=<guides>                Guides file for locus if '-g' specified.
     --exhaustive                     Run exhaustive style analysis (e.g. for set cover analysis)
+    --batch                          Analyze all genes listed in <gene> in one run, in position order. The
+                                     targetability of all genes goes to <out>.h5 (and <out>_exh), with a
+                                     gene column.
+    --processes=<n>                  Number of processes evaluating genes with --batch [default: 1].
+    --resume                         Resume an interrupted --batch run from <out>manifest.jsonl, skipping the
+                                     genes it lists as done. The status of every gene is written to
+                                     <out>status.tsv and the gene lists (e.g. <out>not_enough_hets.txt).
+    --sweep                          With --batch, walk each chromosome once in position order (in 20 Mb
+                                     segments shared out between processes), keeping the genotypes, PAM flags
+                                     and variant pairs of a sliding stretch of it in memory for the genes in
+                                     it, instead of reading each gene's variants.
+    --out_format=<f>                 Format of the exhaustive and paired guide tables: tsv, parquet (needs
+                                     pyarrow) or hdf [default: tsv].
 
 Available Cas types = cpf1,SpCas9,SpCas9_VRER,SpCas9_EQR,SpCas9_VQR_1,SpCas9_VQR_2,StCas9,StCas9_2,SaCas9,SaCas9_KKH,nmCas9,cjCas9
 """
@@ -39,14 +55,26 @@ from pandas import HDFStore
 import numpy as np
 from functools import reduce
 from docopt import docopt
-import itertools
 import regex as re
 import logging
 import subprocess
 from io import StringIO
 import os, sys
 import time
+from multiprocessing import Pool
 import cas_object as cas_obj
+from gene_catalog import GeneCatalog, is_gene_catalog, parse_positions, read_gene_dat
+from gene_scheduler import CHUNK_GENES, Manifest, Progress, gene_size, schedule_chunks
+from table_writer import TableWriter, check_out_format, read_table
+from targetability import (
+    PairTargetability,
+    flag_bits,
+    genotype_matrices,
+    merge_records,
+    parse_genotypes,
+    unpack_bits,
+    variant_flags,
+)
 
 # Get absolute path for ExcisionFinder.py, and edit it for cas_object.py
 ef_path = os.path.dirname(os.path.realpath(__file__))
@@ -56,31 +84,49 @@ from get_metadata import add_metadata
 
 __version__ = "0.0.0"
 
+# bp of annotations read at a time in batch mode, shared by the genes in them
+ANNOTS_SPAN = 5000000
+
+# bp of genotypes read at a time by a --sweep buffer
+SWEEP_SPAN = 1000000
+
+# bp of a chromosome swept by one process, so chromosomes are shared between processes
+SWEEP_SEGMENT = 20000000
+
+# state of a batch process, set up by init_batch_worker
+batch_state = {}
+
 
 def load_gene_gene_dat(gene_dat_path):
     """
     Load gene annotation data (transcript data).
-    :param gene_dat_path: str, filepath for gene_gene_dat_wsize (Part of ExcisionFinder package).
-    :return: Refseq gene annotations file.
-    """
-    gene_gene_dat = pd.read_csv(
-        gene_dat_path,
-        sep="\t",
-        header=0,
-        names=[
-            "name",
-            "chrom",
-            "txStart",
-            "txEnd",
-            "cdsStart",
-            "cdsEnd",
-            "exonCount",
-            "exonStarts",
-            "exonEnds",
-            "size",
-        ],
-    )
-    return gene_gene_dat
+    :param gene_dat_path: str, filepath for gene_gene_dat_wsize (Part of ExcisionFinder package),
+        or a gene catalog directory made from it by gene_catalog.py.
+    :return: Refseq gene annotations file, or GeneCatalog.
+    """
+    if is_gene_catalog(gene_dat_path):
+        return GeneCatalog(gene_dat_path)
+    return read_gene_dat(gene_dat_path)
+
+
+def gene_dat_record(gene_dat, official_gene_symbol):
+    """
+    Annotations of a gene in gene annotation data, in the form GeneCatalog.record gives them.
+    Raises ValueError if the gene is not listed exactly once.
+    """
+    info = gene_dat.loc[gene_dat.index == official_gene_symbol]
+    if info.shape[0] != 1:
+        raise ValueError(
+            f"{official_gene_symbol} is listed {info.shape[0]} times in gene annotations, not once."
+        )
+    record = {
+        field: int(info[field].item())
+        for field in ["txStart", "txEnd", "cdsStart", "cdsEnd", "exonCount"]
+    }
+    record["chrom"] = info["chrom"].item()
+    record["exonStarts"] = np.array(parse_positions(info["exonStarts"].item()), dtype=np.int64)
+    record["exonEnds"] = np.array(parse_positions(info["exonEnds"].item()), dtype=np.int64)
+    return record
 
 
 def het(genotype):
@@ -95,37 +141,68 @@ def het(genotype):
     return hap1 != hap2
 
 
-def next_exon(variant_position, coding_exon_starts):
+def in_exons(positions, exon_starts, exon_ends):
     """
-    get location of next coding exon after variant
-    :param coding_exon_starts: coding exon start positions, Pandas Series.
-    :param variant_position: chromosomal position, int
-    :return: chromosomal position of start of next coding exon, int
+    Determine which positions fall in a coding exon (start and end inclusive).
+    :param positions: chromosomal positions, numpy array of int.
+    :param exon_starts: coding exon start positions, sorted numpy array of int.
+    :param exon_ends: coding exon end positions, in the order of exon_starts, numpy array of int.
+    :return: whether each position is coding, numpy array of bool.
     """
-    greater_than_var = [x for x in coding_exon_starts if x > variant_position]
-    if not greater_than_var:
-        return False
-    else:
-        next_coding_exon_pos = min(greater_than_var)
-        return next_coding_exon_pos
+    if len(exon_starts) == 0:
+        return np.zeros(len(positions), dtype=bool)
+    # the exon starting last at or before each position; exons may overlap, so compare
+    # against the furthest end of all exons starting at or before it
+    last_start = np.searchsorted(exon_starts, positions, side="right") - 1
+    furthest_end = np.maximum.accumulate(exon_ends)
+    return (last_start >= 0) & (positions <= furthest_end[np.maximum(last_start, 0)])
 
 
-def targ_pair(variant1, variant2, coding_positions, coding_exon_starts):
+def targ_pairs(variant1, variant2, exon_starts, exon_ends):
     """
-    Determine whether a pair of variants positions is targetable based on whether they might
-    disrupt an exon.
-    :param variant1: position of variant 1, int.
-    :param variant2: position of variant 2, int.
-    :param coding_positions: coding positions, set.
-    :param coding_exon_starts: Start positions of coding exons, Pandas Series.
-    :return: whether targetable or not, bool.
+    Determine whether pairs of variant positions are targetable based on whether they might
+    disrupt a coding exon, i.e. either variant is in a coding exon or the pair spans the start
+    of one.
+    :param variant1: positions of variant 1 of each pair, numpy array of int.
+    :param variant2: positions of variant 2 of each pair, numpy array of int.
+    :param exon_starts: coding exon start positions, sorted numpy array of int.
+    :param exon_ends: coding exon end positions, in the order of exon_starts, numpy array of int.
+    :return: whether each pair is targetable, numpy array of bool.
     """
-    low_var, high_var = sorted([variant1, variant2])
-    if low_var in coding_positions or high_var in coding_positions:
-        return True
-    else:
-        # checks whether larger variant position occurs in or after next exon
-        return bool(high_var >= next_exon(low_var, coding_exon_starts))
+    low_var = np.minimum(variant1, variant2)
+    high_var = np.maximum(variant1, variant2)
+    if len(exon_starts) == 0:
+        return np.zeros(len(low_var), dtype=bool)
+    # checks whether larger variant position occurs in or after next exon
+    next_exon = np.searchsorted(exon_starts, low_var, side="right")
+    has_next_exon = next_exon < len(exon_starts)
+    spans_exon = has_next_exon & (
+        high_var >= exon_starts[np.minimum(next_exon, len(exon_starts) - 1)]
+    )
+    return (
+        in_exons(low_var, exon_starts, exon_ends)
+        | in_exons(high_var, exon_starts, exon_ends)
+        | spans_exon
+    )
+
+
+def variant_pairs_within(variants, max_dist):
+    """
+    Get all pairs of variant positions var1 < var2 with var2 - var1 <= max_dist.
+    :param variants: variant positions, list-like of int.
+    :param max_dist: maximum distance between the variants of a pair, int.
+    :return: var1 and var2 positions of each pair, ordered by var1 then var2, numpy arrays.
+    """
+    variants = np.sort(np.asarray(variants, dtype=np.int64))
+    # for each variant, the pairs it starts are with the variants in [first, last)
+    first = np.searchsorted(variants, variants, side="right")
+    last = np.searchsorted(variants, variants + max_dist, side="right")
+    n_pairs = last - first
+    pair_starts = np.cumsum(n_pairs) - n_pairs
+    offsets = np.arange(n_pairs.sum()) - np.repeat(pair_starts, n_pairs)
+    var1 = np.repeat(variants, n_pairs)
+    var2 = variants[np.repeat(first, n_pairs) + offsets]
+    return var1, var2
 
 
 def translate_gene_name(gene_name):
@@ -143,34 +220,31 @@ class Gene:
 
     def __init__(self, official_gene_symbol, gene_dat, window):
         self.official_gene_symbol = official_gene_symbol
-        self.info = gene_dat.query("index == @self.official_gene_symbol")
-        self.n_exons = self.info["exonCount"].item()
-        self.coding_start = self.info["cdsStart"].item()
-        self.coding_end = self.info["cdsEnd"].item()
-        self.coding_exons = [
-            x
-            for x in list(
-                zip(
-                    list(map(int, self.info["exonStarts"].item().split(",")[:-1])),
-                    list(map(int, self.info["exonEnds"].item().split(",")[:-1])),
-                )
-            )
-            if x[0] >= self.coding_start and x[1] <= self.coding_end
-        ]
+        if isinstance(gene_dat, GeneCatalog):
+            info = gene_dat.record(official_gene_symbol)
+        else:
+            info = gene_dat_record(gene_dat, official_gene_symbol)
+        self.n_exons = info["exonCount"]
+        self.coding_start = info["cdsStart"]
+        self.coding_end = info["cdsEnd"]
+        exon_starts, exon_ends = info["exonStarts"], info["exonEnds"]
+        is_coding = (exon_starts >= self.coding_start) & (exon_ends <= self.coding_end)
+        self.coding_exons = list(
+            zip(exon_starts[is_coding].tolist(), exon_ends[is_coding].tolist())
+        )
         self.n_coding_exons = len(self.coding_exons)
-        self.start = self.info["txStart"].item() - window
-        self.end = self.info["txEnd"].item() + window
-        self.chrom = gene_dat.query("index == @self.official_gene_symbol")[
-            "chrom"
-        ].item()
+        self.start = info["txStart"] - window
+        self.end = info["txEnd"] + window
+        self.chrom = info["chrom"]
 
-    def get_coding_positions_and_starts(self):
-        coding_positions = []
-        coding_exon_starts = []
-        for start, stop in self.coding_exons:
-            coding_positions.extend(list(range(start, stop + 1)))
-            coding_exon_starts.append(start)
-        return coding_positions, coding_exon_starts
+    def get_coding_intervals(self):
+        """
+        Coding exons as start and end position arrays, sorted by start.
+        """
+        coding_exons = sorted(self.coding_exons)
+        exon_starts = np.array([start for start, stop in coding_exons], dtype=np.int64)
+        exon_ends = np.array([stop for start, stop in coding_exons], dtype=np.int64)
+        return exon_starts, exon_ends
 
 
 def check_bcftools():
@@ -193,7 +267,7 @@ def check_bcftools():
 
 
 def pair_guides(guides_df, variant1, variant2):
-    guides_df = pd.read_csv(guides_df, sep="\t")
+    guides_df = read_table(guides_df)
     guide_pairs_out = pd.DataFrame()
     guide_pairs_out["variant1"] = variant1
     guide_pairs_out["variant2"] = variant2
@@ -285,35 +359,323 @@ def norm_chr(chrom_str, gens_chrom):
         return chrom_str
 
 
-def main(args):
+class GeneSkipped(Exception):
+    """
+    Raised when a gene cannot be evaluated. skip_list names the list ({out}<skip_list>.txt)
+    the gene is recorded in.
+    """
 
-    gene_dat = load_gene_gene_dat(args["<gene_dat>"])
-    gene = args["<gene>"]
-    global annots_file
-    annots_file = args["<annots_file>"]
-    out_prefix = args["<out>"]
-    maxcut = int(args["<maxcut>"])
-    cas_list_append = args["<cas_list>"].split(",")
-    bcf = args["<bcf>"]
-    window = int(args["--window"])
+    def __init__(self, message, skip_list):
+        super().__init__(message)
+        self.skip_list = skip_list
 
-    cas_list = ["all"] + cas_list_append
 
-    # define strictness level, which is whether or not variants near PAMs are considered
-    # along with those that are in PAMs
+class GenotypeSource(object):
+    """
+    Genotypes of an individual or cohort in a BCF/VCF, read with bcftools. The samples and
+    chromosome naming are read once, and genotypes one region at a time.
+    """
 
-    if args["-s"]:
-        logging.info("Running as strict.")
-        strict_level = "strict"
-    else:
-        strict_level = "relaxed"
-        logging.info("Running as relaxed.")
+    def __init__(self, bcf):
+        self.bcf = bcf
+        vcf_chrom = str(
+            subprocess.Popen(
+                f"bcftools view -H {bcf} | cut -f1 | head -1",
+                shell=True,
+                stdout=subprocess.PIPE,
+            ).communicate()[0].decode("utf-8")
+        )
+        # See if chrom contains chr
+        self.chrstart = vcf_chrom.startswith("chr")
+        samples_cmd = f"bcftools query -l {bcf}"
+        bcl_samps = subprocess.Popen(samples_cmd, shell=True, stdout=subprocess.PIPE)
+        self.samples = bcl_samps.communicate()[0].decode("utf-8").split("\n")[:-1]
+
+    def region(self, chrom, start, end):
+        """
+        Records with at least one het sample in chrom:start-end.
+        :return: chrom, pos, ref, alt and one genotype column per sample, DataFrame.
+        """
+        chrom = norm_chr(chrom, self.chrstart)
+        bcl_v = f'bcftools view -g "het" -r {chrom}:{start}-{end} -H {self.bcf}'
+        col_names = [
+            "chrom",
+            "pos",
+            "rsid",
+            "ref",
+            "alt",
+            "score",
+            "random",
+            "info",
+            "gt",
+        ] + self.samples
+        bcl_view = subprocess.Popen(bcl_v, shell=True, stdout=subprocess.PIPE)
+        return pd.read_csv(
+            StringIO(bcl_view.communicate()[0].decode("utf-8")),
+            sep="\t",
+            header=None,
+            names=col_names,
+            usecols=["chrom", "pos", "ref", "alt"] + self.samples,
+        )
 
-    logging.info("Now running ExcisionFinder on " + gene + ".")
 
-    # grab info about relevant gene w/ class
+class AnnotationStore(object):
+    """
+    Variant annotation HDF5 file (from annot_variants.py), kept open. Annotations are read for
+    a span of a chromosome at a time and sliced in memory for each gene in it, so genes
+    visited in position order share reads.
+    """
 
-    MyGene = Gene(gene, gene_dat, window)
+    def __init__(self, fname, chrstart):
+        self.store = HDFStore(fname, "r")
+        self.chrstart = chrstart
+        self.span = None
+        self.annots = None
+        self.positions = None
+
+    def load(self, chrom, start, end):
+        """
+        Read the annotations of chrom:start-end, replacing those read before.
+        """
+        chrom = norm_chr(chrom, self.chrstart)
+        annots = self.store.select("all", where=f"pos >= {start} and pos <= {end}")
+        # annotation files may hold several chromosomes
+        if "chrom" in annots.columns:
+            annots_chrom = annots["chrom"].astype(str).map(
+                lambda c: norm_chr(c, self.chrstart)
+            )
+            annots = annots[(annots_chrom == chrom).values]
+        self.annots = annots.sort_values("pos", kind="mergesort")
+        self.positions = self.annots["pos"].values
+        self.span = (chrom, start, end)
+
+    def region(self, chrom, start, end, span_end=None):
+        """
+        Annotations of chrom:start-end. If they are not in the span loaded, chrom:start-span_end
+        (default: end) is loaded first.
+        """
+        chrom = norm_chr(chrom, self.chrstart)
+        if not (
+            self.span is not None
+            and self.span[0] == chrom
+            and self.span[1] <= start
+            and end <= self.span[2]
+        ):
+            self.load(chrom, start, max(end, span_end or end))
+        first = np.searchsorted(self.positions, start, side="left")
+        last = np.searchsorted(self.positions, end, side="right")
+        return self.annots.iloc[first:last]
+
+    def close(self):
+        self.store.close()
+
+
+class SweepBuffer(object):
+    """
+    Genotype matrices, PAM flags and candidate pairs of a stretch of a chromosome, for
+    evaluating the genes in it one after another in position order (--sweep). As the sweep
+    moves on, the part of the stretch at or after the next gene's start is kept and only the
+    variants after its end are read and parsed, so each variant is processed about once per
+    chromosome however many genes (or windows) it falls in.
+
+    Like bcftools -r for a single gene, a gene's variants include records starting before it
+    whose REF allele overlaps its start (e.g. deletions). Their genotypes are kept per record,
+    as only those overlapping the gene count, and they get no PAM flags, as annotations are
+    only read within the gene.
+    """
+
+    def __init__(self, annots_store, genotypes, maxcut, cas_list):
+        self.annots_store = annots_store
+        self.genotypes = genotypes
+        self.maxcut = maxcut
+        self.cas_list = cas_list[1:]
+        self.chrom = None
+        self.start = None
+        self.end = None
+
+    def covers(self, chrom, start, end):
+        return self.chrom == chrom and self.start <= start and end <= self.end
+
+    def advance(self, chrom, start, end):
+        """
+        Make the buffer hold chrom:start-end, reading up to SWEEP_SPAN bp past start at once.
+        Genes must be visited in order of start on each chromosome.
+        """
+        chrom = norm_chr(chrom, self.genotypes.chrstart)
+        if self.covers(chrom, start, end):
+            return
+        new_end = max(end, start + SWEEP_SPAN)
+        continued = self.chrom == chrom and self.start <= start <= self.end
+        read_start = self.end + 1 if continued else start
+
+        gens = self.genotypes.region(chrom, read_start, new_end)
+        if continued:
+            # records overlapping the new stretch from before its start are already held
+            gens = gens[gens["pos"] >= read_start]
+        allele1, allele2, phased = parse_genotypes(gens, self.genotypes.samples)
+        rec_pos = gens["pos"].values.astype(np.int64)
+        rec_end = rec_pos + gens["ref"].astype(str).str.len().values - 1
+
+        # records that can overlap the start of a later gene without starting in it
+        spans = rec_end > rec_pos
+        new_spans = (
+            rec_pos[spans],
+            rec_end[spans],
+            allele1[spans],
+            allele2[spans],
+            phased[spans],
+        )
+        in_stretch = rec_pos >= start
+        positions, het, hap = merge_records(
+            rec_pos[in_stretch], allele1[in_stretch], allele2[in_stretch], phased[in_stretch]
+        )
+        annots = self.annots_store.region(
+            chrom, read_start, new_end, read_start + ANNOTS_SPAN
+        )
+        flags = variant_flags(annots, positions, self.cas_list)
+        annot_positions = annots["pos"].values
+
+        if continued:
+            keep = self.positions >= start
+            keep_annots = self.annot_positions >= start
+            keep_spans = self.spans[1] >= start
+            positions = np.concatenate([self.positions[keep], positions])
+            het = np.concatenate([self.het[keep], het])
+            hap = np.concatenate([self.hap[keep], hap])
+            flags = {
+                cas: tuple(
+                    np.concatenate([old[keep], new])
+                    for old, new in zip(self.flags[cas], flags[cas])
+                )
+                for cas in self.cas_list
+            }
+            annot_positions = np.concatenate(
+                [self.annot_positions[keep_annots], annot_positions]
+            )
+            new_spans = tuple(
+                np.concatenate([old[keep_spans], new])
+                for old, new in zip(self.spans, new_spans)
+            )
+
+        self.chrom, self.start, self.end = chrom, start, new_end
+        self.positions, self.het, self.hap, self.flags = positions, het, hap, flags
+        self.annot_positions = annot_positions
+        self.spans = new_spans
+        self.var1, self.var2 = variant_pairs_within(positions, self.maxcut)
+        logging.info(
+            f"Sweep buffer at {chrom}:{start}-{new_end}, {len(positions)} variants, "
+            f"{len(self.var1)} pairs within {self.maxcut} bp."
+        )
+
+    def n_annotated(self, start, end):
+        """
+        Annotation records in start-end.
+        """
+        return int(
+            np.searchsorted(self.annot_positions, end, side="right")
+            - np.searchsorted(self.annot_positions, start, side="left")
+        )
+
+    def gene_state(self, start, end):
+        """
+        Variants and pairs of variants in start-end.
+        :return: positions, het status, haplotype codes (see genotype_matrices); flags of each
+            Cas (see variant_flags); var1 and var2 positions of the pairs at most maxcut apart,
+            ordered by var1 then var2. Arrays are views of the buffer where possible.
+        """
+        first = np.searchsorted(self.positions, start, side="left")
+        last = np.searchsorted(self.positions, end, side="right")
+        rows = slice(first, last)
+        positions = self.positions[rows]
+        het = self.het[rows]
+        hap = self.hap[rows]
+        flags = {
+            cas: tuple(flag[rows] for flag in self.flags[cas]) for cas in self.cas_list
+        }
+
+        span_pos, span_end, allele1, allele2, phased = self.spans
+        overlapping = (span_pos < start) & (span_end >= start)
+        if not overlapping.any():
+            first_pair = np.searchsorted(self.var1, start, side="left")
+            last_pair = np.searchsorted(self.var1, end, side="right")
+            var1 = self.var1[first_pair:last_pair]
+            var2 = self.var2[first_pair:last_pair]
+            in_gene = var2 <= end
+            return positions, het, hap, flags, var1[in_gene], var2[in_gene]
+
+        # records from before the gene overlapping its start come first, without PAM flags
+        edge_positions, edge_het, edge_hap = merge_records(
+            span_pos[overlapping],
+            allele1[overlapping],
+            allele2[overlapping],
+            phased[overlapping],
+        )
+        no_flag = np.zeros(len(edge_positions), dtype=bool)
+        flags = {
+            cas: tuple(np.concatenate([no_flag, flag]) for flag in flags[cas])
+            for cas in self.cas_list
+        }
+        positions = np.concatenate([edge_positions, positions])
+        var1, var2 = variant_pairs_within(positions, self.maxcut)
+        return (
+            positions,
+            np.concatenate([edge_het, het]),
+            np.concatenate([edge_hap, hap]),
+            flags,
+            var1,
+            var2,
+        )
+
+
+def read_gene_list(fname):
+    """
+    Read the genes of a batch: one gene per line, or a BED file with gene names in column 4.
+    :param fname: gene list or BED filepath, str.
+    :return: gene names, in file order without duplicates, list.
+    """
+    genes = []
+    with open(fname) as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            genes.append(fields[3].strip() if len(fields) >= 4 else fields[0].strip())
+    return list(dict.fromkeys(genes))
+
+
+def batch_genes(gene_names, gene_dat, window):
+    """
+    Look up the genes of a batch and put them in position order.
+    :return: Genes sorted by chromosome and start, list; names missing from gene_dat, list.
+    """
+    genes = []
+    missing = []
+    for gene in gene_names:
+        try:
+            genes.append(Gene(gene, gene_dat, window))
+        except ValueError:  # not in gene_dat, or in it more than once
+            missing.append(gene)
+    genes.sort(key=lambda g: (str(g.chrom), g.start, g.end))
+    return genes, missing
+
+
+def evaluate_gene(MyGene, annots_store, genotypes, maxcut, cas_list, args, sweep=None):
+    """
+    Determine which individuals have targetable pairs of heterozygous variants in a gene, for
+    each Cas.
+    :param MyGene: gene to evaluate, Gene.
+    :param annots_store: variant annotations, AnnotationStore.
+    :param genotypes: individual or cohort genotypes, GenotypeSource.
+    :param maxcut: maximum distance between cut position pairs, int.
+    :param cas_list: "all" followed by the Cas types to evaluate, list.
+    :param args: docopt arguments (-s, --not_phased and --exhaustive are used).
+    :param sweep: if given, variants, flags and pairs are taken from this SweepBuffer (--sweep)
+        rather than read for the gene.
+    :return: targetability of each individual with a targetable pair, DataFrame; targetable pairs
+        of each individual if --exhaustive, DataFrame, else None; var1 and var2 positions of the
+        targetable pairs, numpy arrays. Raises GeneSkipped if the gene cannot be evaluated.
+    """
+    gene = MyGene.official_gene_symbol
 
     # get number of coding exons in gene, must have at least 1 to continue
 
@@ -325,9 +687,7 @@ def main(args):
             f"{n_exons} total exons in this gene, {n_coding_exons} of which are coding.\
             No coding exons in gene {gene}, exiting."
         )
-        with open(f"{out_prefix}no_coding_exons.txt", "a+") as f:
-            f.write(gene + "\n")
-        exit()
+        raise GeneSkipped(f"No coding exons in gene {gene}.", "no_coding_exons")
     else:
         logging.info(
             f"{n_exons} total exons in this gene, {n_coding_exons} of which are coding."
@@ -335,159 +695,95 @@ def main(args):
 
     # load targetability information for each variant
 
-    annots_file = pd.read_hdf(
-        annots_file, "all", where=f"pos >= {MyGene.start} and pos <= {MyGene.end}"
-    )
+    if sweep is None:
+        annots = annots_store.region(MyGene.chrom, MyGene.start, MyGene.end)
+        n_annotated = annots.shape[0]
+    else:
+        sweep.advance(MyGene.chrom, MyGene.start, MyGene.end)
+        n_annotated = sweep.n_annotated(MyGene.start, MyGene.end)
 
     # check whether there are annotated variants for this gene, abort otherwise
 
-    if annots_file.empty:
+    if n_annotated == 0:
         logging.error(f"No variants in 1KGP for gene {gene}")
-        with open(f"{out_prefix}not_enough_hets.txt", "a+") as fout:
-            fout.write(gene + "\n")
-        exit()
+        raise GeneSkipped(f"No annotated variants in gene {gene}.", "not_enough_hets")
     else:
         logging.info(
-            f"Targetability data loaded, {annots_file.shape[0]} variants annotated in 1KGP for {gene}."
+            f"Targetability data loaded, {n_annotated} variants annotated in 1KGP for {gene}."
         )
 
     # import region of interest genotypes
 
-    bcf = f"{bcf}"
-
-    vcf_chrom = str(
-        subprocess.Popen(
-            f"bcftools view -H {bcf} | cut -f1 | head -1",
-            shell=True,
-            stdout=subprocess.PIPE,
-        ).communicate()[0].decode("utf-8")
-    )
-    # See if chrom contains chr
-    chrstart = vcf_chrom.startswith("chr")
-
-    chrom = norm_chr(MyGene.chrom, chrstart)
+    samples = genotypes.samples
+    if sweep is None:
+        gens = genotypes.region(MyGene.chrom, MyGene.start, MyGene.end)
 
-    bcl_v = f'bcftools view -g "het" -r {chrom}:{MyGene.start}-{MyGene.end} -H {bcf}'
+        logging.info("Genotypes loaded.")
 
-    samples_cmd = f"bcftools query -l {bcf}"
-    bcl_samps = subprocess.Popen(samples_cmd, shell=True, stdout=subprocess.PIPE)
-    samples = bcl_samps.communicate()[0].decode("utf-8").split("\n")[:-1]
-
-    # check that user specified cohort if the VCF contains >1 samples
-
-    # if len(samples) > 1 and not args['-c']:
-    #     logging.error('Must specify "-c" if conducting cohort analysis.')
-    #     sys.exit()
-
-    col_names = [
-        "chrom",
-        "pos",
-        "rsid",
-        "ref",
-        "alt",
-        "score",
-        "random",
-        "info",
-        "gt",
-    ] + samples
-    bcl_view = subprocess.Popen(bcl_v, shell=True, stdout=subprocess.PIPE)
-    gens = pd.read_csv(
-        StringIO(bcl_view.communicate()[0].decode("utf-8")),
-        sep="\t",
-        header=None,
-        names=col_names,
-        usecols=["chrom", "pos", "ref", "alt"] + samples,
-    )
-
-    logging.info("Genotypes loaded.")
-
-    het_gens = gens[samples].applymap(het).copy()
-
-    enough_hets = list(het_gens.sum(axis=0).loc[lambda s: s >= 2].index)
+        # het status of every sample at every variant position
+        positions, het_matrix_gens, hap_matrix_gens = genotype_matrices(gens, samples)
+    else:
+        (
+            positions,
+            het_matrix_gens,
+            hap_matrix_gens,
+            cas_flags,
+            var1s,
+            var2s,
+        ) = sweep.gene_state(MyGene.start, MyGene.end)
+
+    enough_hets = [
+        sample for sample, n_hets in zip(samples, het_matrix_gens.sum(axis=0)) if n_hets >= 2
+    ]
 
     logging.info(str(len(enough_hets)) + " individuals have >= 2 het positions.")
 
     if len(enough_hets) < 1:
         logging.info("No individuals have at least 2 het sites, aborting analysis.")
-        with open(f"{out_prefix}not_enough_hets.txt", "a+") as fout:
-            fout.write(gene + "\n")
-        exit()
+        raise GeneSkipped(f"No individuals have at least 2 het sites in {gene}.", "not_enough_hets")
 
     logging.info(
         "Checking targetability of individuals with sufficient number of hets."
     )
 
-    # get variants in region
-
-    variants = sorted(gens.pos)
-
-    # set up targetability analyses
-
-    het_vars_per_ind = {}  # get heterozygous variant positions for each individual
-
-    for ind in enough_hets:
-        het_vars_per_ind[ind] = gens.pos[het_gens[ind]].tolist()
-
     # get variant combinations and extract targetable pairs
 
     logging.info("Getting variant combos.")
 
-    variant1 = []
-    variant2 = []
+    exon_starts, exon_ends = MyGene.get_coding_intervals()
 
-    coding_positions, coding_exon_starts = MyGene.get_coding_positions_and_starts()
+    # only pairs of variants at most maxcut apart can be cut together
+    if sweep is None:
+        var1s, var2s = variant_pairs_within(positions, maxcut)
+    is_targ_pair = targ_pairs(var1s, var2s, exon_starts, exon_ends)
+    n_candidates = len(var1s)
+    var1s, var2s = var1s[is_targ_pair], var2s[is_targ_pair]
 
-    for var1, var2 in itertools.product(variants, repeat=2):
-        if (
-            (var1 != var2)
-            and (max([var1, var2]) <= min([var1, var2]) + 10000)
-            and (targ_pair(var1, var2, coding_positions, coding_exon_starts))
-        ):
-            variant1.append(var1)
-            variant2.append(var2)
-        else:
-            continue
-
-    logging.info("Combos obtained.")
-
-    # get rid of dups and make df
+    logging.info(f"Combos obtained, {len(var1s)} of {n_candidates} pairs within {maxcut} bp are targetable.")
 
-    targ_pairs_df = pd.DataFrame({"var1": variant1, "var2": variant2}).query(
-        "var1 < var2"
+    pair_targ = PairTargetability(
+        positions, het_matrix_gens, var1s, var2s, hap_matrix_gens
     )
+    sample_idx = {sample: j for j, sample in enumerate(samples)}
 
     # check that each individual that has enough hets also has at least one of these pairs
-    # and specify which pairs they have
 
-    inds_w_targ_pair = {}
-
-    for ind in het_vars_per_ind.keys():
-        ind_vars = het_vars_per_ind[ind]
-        ind_targ_pairs = (
-            targ_pairs_df.loc[targ_pairs_df.isin(ind_vars).all(axis=1)]
-            .reset_index(drop=True)
-            .copy()
-        )
-        if ind_targ_pairs.empty:
-            continue
-        else:
-            inds_w_targ_pair[ind] = ind_targ_pairs
+    has_targ_pair = pair_targ.samples_with_pair()
+    inds_w_targ_pair = [ind for ind in enough_hets if has_targ_pair[sample_idx[ind]]]
 
     logging.info(
-        f"{len(inds_w_targ_pair.keys())} individuals have at least one targetable pair of variants."
+        f"{len(inds_w_targ_pair)} individuals have at least one targetable pair of variants."
     )
 
     if not inds_w_targ_pair:
         logging.info(
             f"No individuals in 1KGP have at least 1 targetable variant pair for {gene}."
         )
-        with open(f"{out_prefix}no_targetable_inds.txt", "a+") as fout:
-            fout.write(gene + "\n")
-        exit()
+        raise GeneSkipped(f"No individuals have a targetable pair in {gene}.", "no_targetable_inds")
 
     # check targetability for each type of Cas
 
-    final_targ = pd.DataFrame({"sample": list(inds_w_targ_pair.keys())})
+    final_targ = pd.DataFrame({"sample": inds_w_targ_pair})
 
     finaltargcols = []  # keeps track of columns for all cas types for later evaluating "all" condition
 
@@ -499,433 +795,98 @@ def main(args):
         #                           'pos': list(itertools.chain.from_iterable(het_vars_per_ind.values()))})
         overall_exh_list = []
 
-    for cas in cas_list[1:]:  # skip all because is handled below faster
-        logging.info(f"Evaluating gene targetability for {cas}")
-        if args["-s"]:
-            targ_vars_cas = annots_file.query(
-                f"(makes_{cas}) or (breaks_{cas})"
-            ).pos.tolist()
-        else:
-            targ_vars_cas = annots_file.query(
-                f"(var_near_{cas}) or (makes_{cas}) or (breaks_{cas})"
-            ).pos.tolist()
-        targ_pairs_cas = (
-            targ_pairs_df.loc[targ_pairs_df.isin(targ_vars_cas).all(axis=1)]
-            .reset_index(drop=True)
-            .copy()
+    # makes/breaks/near PAM flags of every variant for every Cas, aligned with positions
+    if sweep is None:
+        cas_flags = variant_flags(annots, positions, cas_list[1:])
+
+    # individuals with exhaustive output are listed in this order
+    ind_order = np.full(len(samples), len(samples))
+    ind_order[[sample_idx[ind] for ind in inds_w_targ_pair]] = np.arange(len(inds_w_targ_pair))
+    sample_names = np.array(samples, dtype=object)
+
+    if not args["--exhaustive"]:
+        # every Cas in one pass over the pairs and individuals, Cas k in bit k of the flags
+        logging.info(f"Evaluating gene targetability for {', '.join(cas_list[1:])}")
+        # don't need to check that pairs are on same haplotype if genotypes are not phased
+        has_targ_bits = pair_targ.evaluate_bits(
+            *flag_bits(cas_flags, cas_list[1:]), args["-s"], phased=not args["--not_phased"]
         )
-        if args["--exhaustive"]:
-            exh_df_list = []
-        # eliminate individuals that do not have at least one targetable pair for this specific cas
-        ind_targ_cas = []
-        for ind in list(inds_w_targ_pair.keys()):
-            ind_cas_targ_pairs = (
-                inds_w_targ_pair[ind]
-                .merge(targ_pairs_cas, how="inner")
-                .drop_duplicates()
-            )
-            if args["--exhaustive"]:
-                ind_targ_out = []
-                # check whether pairs of allele-specific cut sites is on the same haplotype in individual
-                if args["-s"]:
-                    ind_cas_targ_pairs["var1_make_pam"] = ind_cas_targ_pairs[
-                        "var1"
-                    ].isin(annots_file.query(f"makes_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var2_make_pam"] = ind_cas_targ_pairs[
-                        ["var2"]
-                    ].isin(annots_file.query(f"makes_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var1_break_pam"] = ind_cas_targ_pairs[
-                        ["var1"]
-                    ].isin(annots_file.query(f"breaks_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var2_break_pam"] = ind_cas_targ_pairs[
-                        ["var2"]
-                    ].isin(annots_file.query(f"breaks_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["both_make"] = ind_cas_targ_pairs[
-                        ["var1_make_pam", "var2_make_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["both_break"] = ind_cas_targ_pairs[
-                        ["var1_break_pam", "var2_break_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["one_make_one_break_1"] = ind_cas_targ_pairs[
-                        ["var1_make_pam", "var2_break_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["one_make_one_break_2"] = ind_cas_targ_pairs[
-                        ["var2_make_pam", "var1_break_pam"]
-                    ].all(axis=1)
-                    gens_replace = {
-                        "0|1": "hap2",
-                        "0|2": "hap2",
-                        "0|3": "hap2",
-                        "1|0": "hap1",
-                        "2|0": "hap1",
-                        "3|0": "hap1",
-                        "0|0": "not_het",
-                        "1|1": "not_het",
-                    }
-                    ind_gens = gens[["pos", ind]].replace(gens_replace).copy()
-                    ind_cas_targ_pairs["var1_hap"] = pd.merge(
-                        ind_cas_targ_pairs.copy(),
-                        ind_gens.copy(),
-                        left_on="var1",
-                        right_on="pos",
-                        how="left",
-                    )[ind]
-                    ind_cas_targ_pairs["var2_hap"] = pd.merge(
-                        ind_cas_targ_pairs.copy(),
-                        ind_gens.copy(),
-                        left_on="var2",
-                        right_on="pos",
-                        how="left",
-                    )[ind]
-                    ind_cas_targ_pairs["same_hap"] = np.where(
-                        ind_cas_targ_pairs["var1_hap"]
-                        == ind_cas_targ_pairs["var2_hap"],
-                        True,
-                        False,
-                    )
-                    ind_cas_targ_pairs["not_same_hap"] = ~ind_cas_targ_pairs["same_hap"]
-
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query("both_make and same_hap")[
-                            ["var1", "var2"]
-                        ]
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query("both_break and same_hap")[
-                            ["var1", "var2"]
-                        ]
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query(
-                            "one_make_one_break_1 and not_same_hap"
-                        )[["var1", "var2"]]
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query(
-                            "one_make_one_break_2 and not_same_hap"
-                        )[["var1", "var2"]]
-                    )
-                    ind_targ_out_df = pd.concat(ind_targ_out).dropna().drop_duplicates()
-                    ind_targ_out_df["ind"] = ind
-                    exh_df_list.append(ind_targ_out_df)
-                else:
-                    # if both near PAM, haplotype doesn't have to be the same because both are allele-specific sgRNA sites
-                    ind_cas_targ_pairs["both_near_pam"] = (
-                        ind_cas_targ_pairs[["var1", "var2"]]
-                        .isin(annots_file.query(f"var_near_{cas}").pos.tolist())
-                        .all(axis=1)
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query("both_near_pam")[["var1", "var2"]]
-                    )
-                    #   when both make or break, need to be same hap
-                    ind_cas_targ_pairs["var1_make_pam"] = ind_cas_targ_pairs[
-                        "var1"
-                    ].isin(annots_file.query(f"makes_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var2_make_pam"] = ind_cas_targ_pairs[
-                        "var2"
-                    ].isin(annots_file.query(f"makes_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var1_near_pam"] = ind_cas_targ_pairs[
-                        "var1"
-                    ].isin(annots_file.query(f"var_near_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var2_near_pam"] = ind_cas_targ_pairs[
-                        "var2"
-                    ].isin(annots_file.query(f"var_near_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var1_break_pam"] = ind_cas_targ_pairs[
-                        "var1"
-                    ].isin(annots_file.query(f"breaks_{cas}").pos.tolist())
-                    ind_cas_targ_pairs["var2_break_pam"] = ind_cas_targ_pairs[
-                        "var2"
-                    ].isin(annots_file.query(f"breaks_{cas}").pos.tolist())
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query(
-                            "(var1_near_pam and var2_make_pam) or (var1_near_pam and var2_break_pam) or (var2_near_pam and var1_make_pam) or (var2_near_pam and var1_break_pam)"
-                        )[["var1", "var2"]]
-                    )
-                    ind_cas_targ_pairs["both_make"] = ind_cas_targ_pairs[
-                        ["var1_make_pam", "var2_make_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["both_break"] = ind_cas_targ_pairs[
-                        ["var1_break_pam", "var2_break_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["one_make_one_break_1"] = ind_cas_targ_pairs[
-                        ["var1_make_pam", "var2_break_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["one_make_one_break_2"] = ind_cas_targ_pairs[
-                        ["var2_make_pam", "var1_break_pam"]
-                    ].all(axis=1)
-                    gens_replace = {
-                        "0|1": "hap2",
-                        "0|2": "hap2",
-                        "0|3": "hap2",
-                        "1|0": "hap1",
-                        "2|0": "hap1",
-                        "3|0": "hap1",
-                        "0|0": "not_het",
-                        "1|1": "not_het",
-                    }
-                    ind_gens = gens[["pos", ind]].replace(gens_replace).copy()
-                    ind_cas_targ_pairs["var1_hap"] = pd.merge(
-                        ind_cas_targ_pairs.copy(),
-                        ind_gens.copy(),
-                        left_on="var1",
-                        right_on="pos",
-                        how="left",
-                    )[ind]
-                    ind_cas_targ_pairs["var2_hap"] = pd.merge(
-                        ind_cas_targ_pairs.copy(),
-                        ind_gens.copy(),
-                        left_on="var2",
-                        right_on="pos",
-                        how="left",
-                    )[ind]
-                    ind_cas_targ_pairs["same_hap"] = np.where(
-                        ind_cas_targ_pairs["var1_hap"]
-                        == ind_cas_targ_pairs["var2_hap"],
-                        True,
-                        False,
-                    )
-                    ind_cas_targ_pairs["not_same_hap"] = ~ind_cas_targ_pairs["same_hap"]
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query("both_make and same_hap")[
-                            ["var1", "var2"]
-                        ]
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query("both_break and same_hap")[
-                            ["var1", "var2"]
-                        ]
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query(
-                            "one_make_one_break_1 and not_same_hap"
-                        )[["var1", "var2"]]
-                    )
-                    ind_targ_out.append(
-                        ind_cas_targ_pairs.query(
-                            "one_make_one_break_2 and not_same_hap"
-                        )[["var1", "var2"]]
-                    )
-                    ind_targ_out_df = pd.concat(ind_targ_out).dropna().drop_duplicates()
-                    ind_targ_out_df["ind"] = ind
-                    exh_df_list.append(ind_targ_out_df)
-                exh_df = pd.concat(exh_df_list)
-                exh_df[f"targ_{cas}"] = cas
-                overall_exh_list.append(exh_df)
-            if ind_cas_targ_pairs.empty:
-                ind_targ_cas.append(False)
-                continue
-            # don't need to check that pairs are on same haplotype if genotypes are not phased, unless if outputting hap_targs
-            elif args["--not_phased"] and not args["--exhaustive"]:
-                ind_targ_cas.append(True)
-                continue
+        ind_targ = unpack_bits(has_targ_bits, len(cas_list) - 1)[
+            [sample_idx[ind] for ind in inds_w_targ_pair]
+        ]
+        for k, cas in enumerate(cas_list[1:]):
+            finaltargcols.append(f"targ_{cas}")
+            final_targ[f"targ_{cas}"] = ind_targ[:, k]
+    else:
+        # exhaustive output lists the targetable pairs of each individual for each Cas
+        for cas in cas_list[1:]:
+            logging.info(f"Evaluating gene targetability for {cas}")
+            makes, breaks, near = cas_flags[cas]
+            if args["-s"]:
+                cas_pair_mask = pair_targ.pair_mask(makes | breaks)
             else:
-                # check that at least one pair of allele-specific cut sites is on the same haplotype in individual
-                if args["-s"]:
-                    ind_cas_targ_pairs["both_make"] = ind_cas_targ_pairs[
-                        ["var1_make_pam", "var2_make_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["both_break"] = ind_cas_targ_pairs[
-                        ["var1_break_pam", "var2_break_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["one_make_one_break_1"] = ind_cas_targ_pairs[
-                        ["var1_make_pam", "var2_break_pam"]
-                    ].all(axis=1)
-                    ind_cas_targ_pairs["one_make_one_break_2"] = ind_cas_targ_pairs[
-                        ["var2_make_pam", "var1_break_pam"]
-                    ].all(axis=1)
-                    gens_replace = {
-                        "0|1": "hap2",
-                        "0|2": "hap2",
-                        "0|3": "hap2",
-                        "1|0": "hap1",
-                        "2|0": "hap1",
-                        "3|0": "hap1",
-                        "0|0": "not_het",
-                        "1|1": "not_het",
-                    }
-                    ind_gens = gens[["pos", ind]].replace(gens_replace).copy()
-                    ind_cas_targ_pairs["var1_hap"] = pd.merge(
-                        ind_cas_targ_pairs.copy(),
-                        ind_gens.copy(),
-                        left_on="var1",
-                        right_on="pos",
-                        how="left",
-                    )[ind]
-                    ind_cas_targ_pairs["var2_hap"] = pd.merge(
-                        ind_cas_targ_pairs.copy(),
-                        ind_gens.copy(),
-                        left_on="var2",
-                        right_on="pos",
-                        how="left",
-                    )[ind]
-                    ind_cas_targ_pairs["same_hap"] = np.where(
-                        ind_cas_targ_pairs["var1_hap"]
-                        == ind_cas_targ_pairs["var2_hap"],
-                        True,
-                        False,
-                    )
-                    ind_cas_targ_pairs["not_same_hap"] = ~ind_cas_targ_pairs["same_hap"]
-                    if (
-                        ind_cas_targ_pairs[["both_make", "same_hap"]].all(axis=1).any()
-                        or ind_cas_targ_pairs[["both_break", "same_hap"]]
-                        .all(axis=1)
-                        .any()
-                    ):
-                        ind_targ_cas.append(True)
-                        continue
-                    # check if pair where one makes, one breaks a PAM, and on different haplotypes
-                    elif (
-                        ind_cas_targ_pairs[["one_make_one_break_1", "not_same_hap"]]
-                        .all(axis=1)
-                        .any()
-                        or ind_cas_targ_pairs[["one_make_one_break_2", "not_same_hap"]]
-                        .all(axis=1)
-                        .any()
-                    ):
-                        ind_targ_cas.append(True)
-                        continue
-                    # all possibilities exhausted, this person just isn't targetable at this gene
-                    else:
-                        ind_targ_cas.append(False)
-                        continue
-                else:
-                    # if both near PAM, haplotype doesn't have to be the same because both are allele-specific sgRNA sites
-                    ind_cas_targ_pairs["both_near_pam"] = (
-                        ind_cas_targ_pairs[["var1", "var2"]]
-                        .isin(annots_file.query(f"var_near_{cas}").pos.tolist())
-                        .all(axis=1)
-                    )
-                    if ind_cas_targ_pairs[
-                        "both_near_pam"
-                    ].any():  # this doesn't work for "strict" mode
-                        ind_targ_cas.append(True)
-                        continue
-                    else:
-                        # if none have both near a PAM, when both make or break, need to be same hap
-                        ind_cas_targ_pairs["var1_make_pam"] = ind_cas_targ_pairs[
-                            "var1"
-                        ].isin(annots_file.query(f"makes_{cas}").pos.tolist())
-                        ind_cas_targ_pairs["var2_make_pam"] = ind_cas_targ_pairs[
-                            ["var2"]
-                        ].isin(annots_file.query(f"makes_{cas}").pos.tolist())
-                        ind_cas_targ_pairs["var1_near_pam"] = ind_cas_targ_pairs[
-                            "var1"
-                        ].isin(annots_file.query(f"var_near_{cas}").pos.tolist())
-                        ind_cas_targ_pairs["var2_near_pam"] = ind_cas_targ_pairs[
-                            "var2"
-                        ].isin(annots_file.query(f"var_near_{cas}").pos.tolist())
-                        ind_cas_targ_pairs["var1_break_pam"] = ind_cas_targ_pairs[
-                            ["var1"]
-                        ].isin(annots_file.query(f"breaks_{cas}").pos.tolist())
-                        ind_cas_targ_pairs["var2_break_pam"] = ind_cas_targ_pairs[
-                            ["var2"]
-                        ].isin(annots_file.query(f"breaks_{cas}").pos.tolist())
-                        # if one var is near a pam and the other makes/breaks, haplotype doesn't matter
-                        if not ind_cas_targ_pairs.query(
-                            "(var1_near_pam and var2_make_pam) or (var1_near_pam and var2_break_pam) or (var2_near_pam and var1_make_pam) or (var2_near_pam and var1_break_pam)"
-                        ).empty:
-                            ind_targ_cas.append(True)
-                            continue
-                        else:
-                            ind_cas_targ_pairs["both_make"] = ind_cas_targ_pairs[
-                                ["var1_make_pam", "var2_make_pam"]
-                            ].all(axis=1)
-                            ind_cas_targ_pairs["both_break"] = ind_cas_targ_pairs[
-                                ["var1_break_pam", "var2_break_pam"]
-                            ].all(axis=1)
-                            ind_cas_targ_pairs[
-                                "one_make_one_break_1"
-                            ] = ind_cas_targ_pairs[
-                                ["var1_make_pam", "var2_break_pam"]
-                            ].all(
-                                axis=1
-                            )
-                            ind_cas_targ_pairs[
-                                "one_make_one_break_2"
-                            ] = ind_cas_targ_pairs[
-                                ["var2_make_pam", "var1_break_pam"]
-                            ].all(
-                                axis=1
-                            )
-                            gens_replace = {
-                                "0|1": "hap2",
-                                "0|2": "hap2",
-                                "0|3": "hap2",
-                                "1|0": "hap1",
-                                "2|0": "hap1",
-                                "3|0": "hap1",
-                                "0|0": "not_het",
-                                "1|1": "not_het",
-                            }
-                            ind_gens = gens[["pos", ind]].replace(gens_replace).copy()
-                            ind_cas_targ_pairs["var1_hap"] = pd.merge(
-                                ind_cas_targ_pairs.copy(),
-                                ind_gens.copy(),
-                                left_on="var1",
-                                right_on="pos",
-                                how="left",
-                            )[ind]
-                            ind_cas_targ_pairs["var2_hap"] = pd.merge(
-                                ind_cas_targ_pairs.copy(),
-                                ind_gens.copy(),
-                                left_on="var2",
-                                right_on="pos",
-                                how="left",
-                            )[ind]
-                            ind_cas_targ_pairs["same_hap"] = np.where(
-                                ind_cas_targ_pairs["var1_hap"]
-                                == ind_cas_targ_pairs["var2_hap"],
-                                True,
-                                False,
-                            )
-                            ind_cas_targ_pairs["not_same_hap"] = ~ind_cas_targ_pairs[
-                                "same_hap"
-                            ]
-                            if (
-                                ind_cas_targ_pairs[["both_make", "same_hap"]]
-                                .all(axis=1)
-                                .any()
-                                or ind_cas_targ_pairs[["both_break", "same_hap"]]
-                                .all(axis=1)
-                                .any()
-                            ):
-                                ind_targ_cas.append(True)
-                                continue
-                            # check if pair where one makes, one breaks a PAM, and on different haplotypes
-                            elif (
-                                ind_cas_targ_pairs[
-                                    ["one_make_one_break_1", "not_same_hap"]
-                                ]
-                                .all(axis=1)
-                                .any()
-                                or ind_cas_targ_pairs[
-                                    ["one_make_one_break_2", "not_same_hap"]
-                                ]
-                                .all(axis=1)
-                                .any()
-                            ):
-                                ind_targ_cas.append(True)
-                                continue
-                            # all possibilities exhausted, this person just isn't targetable at this gene
-                            else:
-                                ind_targ_cas.append(False)
-                                continue
-
-        finaltargcols.append(f"targ_{cas}")
-        final_targ[f"targ_{cas}"] = ind_targ_cas
+                cas_pair_mask = pair_targ.pair_mask(makes | breaks | near)
+            has_targ, pair_ids, sample_ids, rules = pair_targ.evaluate_rules(
+                cas_pair_mask, makes, breaks, near, args["-s"], cells=True
+            )
+            # targetable pairs of each individual, by the first rule they meet
+            order = np.lexsort((pair_ids, rules, ind_order[sample_ids]))
+            exh_df = pd.DataFrame(
+                {
+                    "var1": var1s[pair_ids[order]],
+                    "var2": var2s[pair_ids[order]],
+                    "ind": sample_names[sample_ids[order]],
+                }
+            )
+            exh_df[f"targ_{cas}"] = cas
+            overall_exh_list.append(exh_df)
+            ind_targ_cas = [bool(has_targ[sample_idx[ind]]) for ind in inds_w_targ_pair]
+
+            finaltargcols.append(f"targ_{cas}")
+            final_targ[f"targ_{cas}"] = ind_targ_cas
 
     # add column summarizing targetability across assessed Cas varieties
 
     final_targ["targ_all"] = final_targ[finaltargcols].any(axis=1)
 
+    exh_df = None
+    if args["--exhaustive"]:
+        exh_df = pd.concat(overall_exh_list).drop_duplicates()
+
+    return final_targ, exh_df, var1s, var2s
+
+
+def run_gene(gene, gene_dat, annots_store, genotypes, maxcut, cas_list, args):
+    """
+    Evaluate one gene, writing <out>.h5 and the optional exhaustive and paired guide tables.
+    """
+    out_prefix = args["<out>"]
+    window = int(args["--window"])
+
+    logging.info("Now running ExcisionFinder on " + gene + ".")
+
+    # grab info about relevant gene w/ class
+
+    MyGene = Gene(gene, gene_dat, window)
+
+    final_targ, exh_df, var1s, var2s = evaluate_gene(
+        MyGene, annots_store, genotypes, maxcut, cas_list, args
+    )
+
     # HDF has issues with certain characters
 
     translated_gene_name = translate_gene_name(gene)
 
     if args["--exhaustive"]:
-        exh_df = pd.concat(overall_exh_list).drop_duplicates()
-        exh_df.to_csv(f"{out_prefix}_exh.tsv", sep="\t", index=False)
+        with TableWriter(
+            f"{out_prefix}_exh",
+            args["--out_format"],
+            args,
+            os.path.basename(__file__),
+            __version__,
+            f"ExcisionFinder_exh:{translated_gene_name}",
+        ) as writer:
+            writer.write(exh_df)
 
     if args["-g"]:
         if args["-c"]:
@@ -933,8 +894,21 @@ def main(args):
                 "Cannot generate guides + get targetability simultaneously in cohort-style analysis, only individual-style."
             )
         else:
-            guides_out = pair_guides(args["--guides"], variant1, variant2)
-            guides_out.to_csv(f"{out_prefix}pair_guides.tsv", sep="\t", index=False)
+            # guides are paired in both orders of each pair of variants
+            variant1 = var1s.tolist()
+            variant2 = var2s.tolist()
+            guides_out = pair_guides(
+                args["--guides"], variant1 + variant2, variant2 + variant1
+            )
+            with TableWriter(
+                f"{out_prefix}pair_guides",
+                args["--out_format"],
+                args,
+                os.path.basename(__file__),
+                __version__,
+                f"ExcisionFinder_pair_guides:{translated_gene_name}",
+            ) as writer:
+                writer.write(guides_out)
 
     # make list of genes that actually get written to HDF5
     with open(f"{out_prefix}genes_evaluated.txt", "a+") as f:
@@ -949,6 +923,219 @@ def main(args):
         f"ExcisionFinder:{translated_gene_name}",
     )
 
+
+def init_batch_worker(annots_path, genotypes, maxcut, cas_list, args):
+    """
+    Set up the state a batch process shares across the genes it evaluates.
+    """
+    batch_state["annots_store"] = AnnotationStore(annots_path, genotypes.chrstart)
+    batch_state["genotypes"] = genotypes
+    batch_state["maxcut"] = maxcut
+    batch_state["cas_list"] = cas_list
+    batch_state["args"] = args
+    batch_state["sweep"] = None
+    if args["--sweep"]:
+        batch_state["sweep"] = SweepBuffer(
+            batch_state["annots_store"], genotypes, maxcut, cas_list
+        )
+
+
+def evaluate_chunk(genes):
+    """
+    Evaluate a chunk of neighbouring genes in a batch process.
+    :return: gene name, status, targetability (None if skipped), exhaustive table (None if
+        skipped or not --exhaustive), seconds taken and size of each gene, list.
+    """
+    annots_store = batch_state["annots_store"]
+    results = []
+    for MyGene in genes:
+        gene = MyGene.official_gene_symbol
+        logging.info(f"Now running ExcisionFinder on {gene}.")
+        start_time = time.perf_counter()
+        if batch_state["sweep"] is None:
+            # annotations are read for the rest of the genes nearby along with this one
+            annots_store.region(
+                MyGene.chrom, MyGene.start, MyGene.end, MyGene.start + ANNOTS_SPAN
+            )
+        try:
+            final_targ, exh_df, var1s, var2s = evaluate_gene(
+                MyGene,
+                annots_store,
+                batch_state["genotypes"],
+                batch_state["maxcut"],
+                batch_state["cas_list"],
+                batch_state["args"],
+                sweep=batch_state["sweep"],
+            )
+            status = "evaluated"
+        except GeneSkipped as e:
+            final_targ, exh_df, status = None, None, e.skip_list
+        results.append(
+            (gene, status, final_targ, exh_df, time.perf_counter() - start_time, gene_size(MyGene))
+        )
+    return results
+
+
+def run_batch(gene_dat, annots_path, genotypes, maxcut, cas_list, args):
+    """
+    Evaluate every gene listed in <gene> in a pool of processes, appending the targetability
+    of all genes to <out>.h5 (and the exhaustive tables to <out>_exh) with a gene column.
+    Finished genes are recorded in <out>manifest.jsonl, from which an interrupted run is
+    resumed with --resume, and summarized in <out>status.tsv and the gene lists.
+    """
+    out_prefix = args["<out>"]
+    window = int(args["--window"])
+    processes = int(args["--processes"])
+    if processes < 1:
+        raise ValueError(f"Number of processes must be at least 1, not {processes}.")
+
+    genes, missing = batch_genes(read_gene_list(args["<gene>"]), gene_dat, window)
+    with open(f"{out_prefix}genes_not_found.txt", "w") as f:
+        f.writelines(f"{gene}\n" for gene in missing)
+    if missing:
+        logging.error(f"{len(missing)} genes not found in {args['<gene_dat>']}, skipping them.")
+
+    manifest = Manifest(out_prefix, resume=args["--resume"])
+    todo = [MyGene for MyGene in genes if not manifest.done(MyGene.official_gene_symbol)]
+    logging.info(
+        f"Running ExcisionFinder on {len(todo)} genes ({len(genes) - len(todo)} already done) "
+        f"with {processes} processes."
+    )
+
+    targ_writer = TableWriter(
+        out_prefix,
+        "hdf",
+        args,
+        os.path.basename(__file__),
+        __version__,
+        "ExcisionFinder:batch",
+        resume_rows=manifest.rows("targ"),
+    )
+    exh_writer = None
+    if args["--exhaustive"]:
+        exh_writer = TableWriter(
+            f"{out_prefix}_exh",
+            args["--out_format"],
+            args,
+            os.path.basename(__file__),
+            __version__,
+            "ExcisionFinder_exh:batch",
+            resume_rows=manifest.rows("exh"),
+        )
+
+    progress = Progress(len(todo), sum(gene_size(MyGene) for MyGene in todo))
+    # a sweep walks each segment of a chromosome once, in a single chunk
+    if args["--sweep"]:
+        chunks = schedule_chunks(todo, None, max_span=SWEEP_SEGMENT)
+    else:
+        chunks = schedule_chunks(todo, CHUNK_GENES)
+    worker_args = (annots_path, genotypes, maxcut, cas_list, args)
+    pool = None
+    try:
+        if processes > 1:
+            pool = Pool(processes, initializer=init_batch_worker, initargs=worker_args)
+            results = pool.imap_unordered(evaluate_chunk, chunks)
+        else:
+            init_batch_worker(*worker_args)
+            results = map(evaluate_chunk, chunks)
+        for chunk_results in results:
+            for gene, status, final_targ, exh_df, seconds, size in chunk_results:
+                n_inds = n_targetable = 0
+                if final_targ is not None:
+                    n_inds = final_targ.shape[0]
+                    n_targetable = final_targ["targ_all"].sum()
+                    final_targ.insert(0, "gene", gene)
+                    targ_writer.write(final_targ)
+                    if exh_writer is not None:
+                        exh_df.insert(0, "gene", gene)
+                        exh_writer.write(exh_df)
+                # a gene is done once recorded, after its rows are written
+                manifest.record(
+                    gene,
+                    status,
+                    n_inds,
+                    n_targetable,
+                    seconds,
+                    {
+                        "targ": targ_writer.n_rows,
+                        "exh": exh_writer.n_rows if exh_writer is not None else 0,
+                    },
+                )
+                progress.update(1, size)
+            logging.info(progress.report())
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if "annots_store" in batch_state:
+            batch_state.pop("annots_store").close()
+        targ_writer.close()
+        if exh_writer is not None:
+            exh_writer.close()
+        manifest.write_status(out_prefix)
+
+
+def main(args):
+
+    gene_dat = load_gene_gene_dat(args["<gene_dat>"])
+    gene = args["<gene>"]
+    global annots_file
+    annots_file = args["<annots_file>"]
+    out_prefix = args["<out>"]
+    maxcut = int(args["<maxcut>"])
+    cas_list_append = args["<cas_list>"].split(",")
+    bcf = args["<bcf>"]
+    try:
+        check_out_format(args["--out_format"])
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
+
+    cas_list = ["all"] + cas_list_append
+
+    # define strictness level, which is whether or not variants near PAMs are considered
+    # along with those that are in PAMs
+
+    if args["-s"]:
+        logging.info("Running as strict.")
+        strict_level = "strict"
+    else:
+        strict_level = "relaxed"
+        logging.info("Running as relaxed.")
+
+    # samples and chromosome naming of the genotypes are shared by all genes
+    genotypes = GenotypeSource(bcf)
+
+    # check that user specified cohort if the VCF contains >1 samples
+
+    # if len(samples) > 1 and not args['-c']:
+    #     logging.error('Must specify "-c" if conducting cohort analysis.')
+    #     sys.exit()
+
+    if args["--batch"]:
+        try:
+            run_batch(gene_dat, annots_file, genotypes, maxcut, cas_list, args)
+        except ValueError as e:
+            logging.error(f"Error: {e} Exiting.")
+            exit(1)
+        logging.info("Done!")
+        return
+
+    annots_store = AnnotationStore(annots_file, genotypes.chrstart)
+    try:
+        run_gene(gene, gene_dat, annots_store, genotypes, maxcut, cas_list, args)
+    except GeneSkipped as e:
+        with open(f"{out_prefix}{e.skip_list}.txt", "a+") as fout:
+            fout.write(gene + "\n")
+        exit()
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
+    finally:
+        annots_store.close()
+
     logging.info("Done!")
 
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+build_guide_catalog.py designs every allele-specific sgRNA for the variants in an annotation
+file from annot_variants.py and saves them as an indexed catalog, as part of ExcisionFinder.
+Allele-specific guides depend only on the variant, Cas and guide length, not on who carries
+the variant, so gen_sgRNAs.py --catalog can look them up instead of designing them again.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Usage:
+    build_guide_catalog.py [-vc] <annots_file> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [--chunksize=<N>] [--max_allele_len=<L>]
+    build_guide_catalog.py -C | --cas-list
+
+Arguments:
+    annots_file         Annotated variants from annot_variants.py.
+    pams_dir            Directory where pam locations in the reference genome are located.
+    ref_fasta           Fasta file for reference genome used, e.g. hg38, or a genome packed by packed_genome.py.
+    out                 Prefix for the output catalog, saved as <out>.h5.
+    cas_types           Cas types to include, comma-separated (e.g. SpCas9,SaCas9).
+    guide_length        Guide length, commonly 20 bp, comma-separated if different for different cas types (in the same
+                        order as cas_types). Separate several lengths for one cas type with '/', e.g. 20,21/22.
+Options:
+    -h --help               Show this screen and exit.
+    -c                      Do not take the reverse complement of the guide sequence for '-' stranded guides.
+    -v                      Run in verbose mode.
+    -C --cas-list           List available cas types and exits.
+    --chunksize=<N>         Number of annotated variants to design guides for at a time [default: 100000].
+    --max_allele_len=<L>    Skip variants with REF or ALT alleles longer than this [default: 50].
+"""
+
+import pandas as pd
+import numpy as np
+from docopt import docopt
+import os, sys, logging
+
+import cas_object
+import gen_sgRNAs
+
+metadata_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "preprocessing"
+)
+sys.path.append(metadata_path)
+from get_metadata import add_metadata
+
+__version__ = "0.0.1"
+
+# catalog columns that can be used in HDF5 queries
+INDEX_COLUMNS = ["chrom", "variant_position", "ref", "alt", "cas_type", "guide_length"]
+
+
+def main(args):
+    # assemble list of Cas enzymes that will be evaluated
+    cas_types = args["<cas_types>"].split(",")
+    try:
+        guide_lengths = cas_object.get_guide_lengths(cas_types, args["<guide_length>"])
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
+    cas_list, not_in_both = cas_object.validate_cas_list(cas_types)
+    for c in not_in_both:
+        logging.info(f"{c} not in CAS_LIST.txt, skipping.")
+    gen_sgRNAs.CAS_LIST = cas_list
+
+    max_guide_length = max(max(lengths) for lengths in guide_lengths.values())
+    max_allele_len = int(args["--max_allele_len"])
+    pam_index = gen_sgRNAs.get_pam_index(args["<pams_dir>"])
+    ref_genome = gen_sgRNAs.load_ref_genome(args["<ref_fasta>"])
+    design_args = {"--strict": False, "-c": args["-c"]}
+
+    out_fname = f"{args['<out>']}.h5"
+    if os.path.exists(out_fname):
+        os.remove(out_fname)
+
+    n_guides = 0
+    for annots in pd.read_hdf(
+        args["<annots_file>"], iterator=True, chunksize=int(args["--chunksize"])
+    ):
+        annots = annots[
+            (annots["ref"].str.len() <= max_allele_len)
+            & (annots["alt"].str.len() <= max_allele_len)
+        ]
+        for chrom, chrom_annots in annots.groupby("chrom", sort=False):
+            # keep the annotation file's chromosome notation in the catalog
+            chrstart = str(chrom).startswith("chr")
+            guides = gen_sgRNAs.design_allele_spec_guides(
+                chrom_annots,
+                str(chrom),
+                chrstart,
+                1,
+                np.iinfo(np.int64).max,
+                guide_lengths,
+                pam_index,
+                ref_genome,
+                design_args,
+                with_var_type=True,
+            )
+            if guides.empty:
+                continue
+            guides.to_hdf(
+                out_fname,
+                "all",
+                mode="a",
+                append=True,
+                format="table",
+                data_columns=INDEX_COLUMNS,
+                complib="blosc",
+                min_itemsize={
+                    "chrom": 16,
+                    "ref": max_allele_len,
+                    "alt": max_allele_len,
+                    "gRNA_ref": max_guide_length + max_allele_len,
+                    "gRNA_alt": max_guide_length + max_allele_len,
+                    "strand": 8,
+                    "cas_type": 32,
+                    "var_type": 12,
+                },
+            )
+            n_guides += guides.shape[0]
+            logging.info(f"{chrom}: {n_guides} guides in catalog so far.")
+
+    if n_guides == 0:
+        logging.error("No allele-specific guides found, no catalog saved.")
+        exit(1)
+
+    add_metadata(
+        out_fname, args, os.path.basename(__file__), __version__, "Guide catalog"
+    )
+    # settings that fix which guides are in the catalog and how they are written, checked by
+    # gen_sgRNAs.py --catalog
+    with pd.HDFStore(out_fname) as store:
+        store.get_storer("all").attrs.catalog = {
+            "-c": bool(args["-c"]),
+            "guide_lengths": {cas: list(guide_lengths[cas]) for cas in cas_list},
+            "max_allele_len": max_allele_len,
+        }
+    logging.info("Done.")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__, version=__version__)
+    if arguments["--cas-list"]:
+        cas_object.print_cas_types()
+        exit()
+    if arguments["-v"]:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.ERROR,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    main(arguments)
@@ -131,6 +131,24 @@ def get_cas_enzyme(name, cas_file=CAS_PATH):
     raise ValueError(f"Cas not found in {cas_file}: {name}")
 
 
+def get_cas_enzymes(names, cas_file=CAS_PATH):
+    """
+	Returns a dictionary of name -> Cas object for every requested enzyme, reading
+	the Cas list only once rather than once per enzyme as get_cas_enzyme does.
+	"""
+    names = set(names)
+    enzymes = {}
+    for line in open(cas_file):
+        if not line.startswith("#"):
+            cas = line.rstrip().split("\t")
+            if cas[0] in names:
+                enzymes[cas[0]] = Cas(*cas)
+    missing = names.difference(enzymes)
+    if missing:
+        raise ValueError(f"Cas not found in {cas_file}: {','.join(sorted(missing))}")
+    return enzymes
+
+
 def get_cas_list(cas_file=CAS_PATH):
     """
 	Return list of all Cas9 names.
@@ -152,3 +170,26 @@ def validate_cas_list(in_cas_list):
     in_both = list(set(master).intersection(in_cas_list))
 
     return in_both, list(set(in_cas_list).difference(in_both))
+
+
+def get_guide_lengths(cas_types, guide_lengths):
+    """
+	Parses guide lengths for a list of cas enzymes into a dictionary of name -> list of
+	lengths. guide_lengths is either a single length for every enzyme (e.g. 20) or one entry
+	per enzyme in the same order as cas_types, comma-separated, where an entry may hold several
+	lengths separated by '/' (e.g. 20,21/22,23 for SpCas9,SaCas9,cpf1).
+	"""
+    entries = str(guide_lengths).split(",")
+    if len(entries) == 1:
+        entries = entries * len(cas_types)
+    elif len(entries) != len(cas_types):
+        raise ValueError(
+            f"Got {len(entries)} guide lengths ({guide_lengths}) for {len(cas_types)} cas enzymes."
+        )
+    lengths = {}
+    for cas, entry in zip(cas_types, entries):
+        try:
+            lengths[cas] = sorted(set(int(length) for length in entry.split("/")))
+        except ValueError:
+            raise ValueError(f"Guide length for {cas} is not an integer: {entry}")
+    return lengths
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+crispor_scoring.py scores the specificity of sgRNAs in-process as part of ExcisionFinder.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+This is a Python 3 port of the off-target search and scoring done by the bundled crispor.py
+(Haeussler et al. Genome Biology 2016) with --skipAlign: guides are aligned to the genome with
+the bundled bwa, hits without a PAM are filtered out, and the MIT and CFD specificity scores
+are calculated from the remaining off-targets. Genomes use crispor's layout, with the
+bwa-indexed genome at <genomes_dir>/<genome>/<genome>.fa.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import logging
+import os
+import pickle
+import platform
+import re
+import subprocess
+import tempfile
+
+import numpy as np
+from pyfaidx import Fasta
+
+CRISPOR_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "crispor")
+BWA = os.path.join(CRISPOR_DIR, "bin", platform.system(), "bwa")
+
+# crispor.py defaults
+MAXOCC = 60000  # guides with more hits than this get a score of 0
+MAX_MMS = 4  # maximum number of mismatches of an off-target
+MFAC = 2000000 // MAXOCC  # bwa aln queue size is MFAC * MAXOCC
+ALT_PAM_MIN_SCORE = 1.0  # minimum MIT hit score of off-targets next to an alternative PAM
+
+# everything besides guide, PAM and genome that the scores depend on, part of the score cache key;
+# bump the version when the search or scoring changes
+SCORE_PARAMS = f"v1;maxocc={MAXOCC};mms={MAX_MMS};altpam={ALT_PAM_MIN_SCORE}"
+
+# off-targets next to these PAMs are also counted, if their hit score is high enough
+OFFTARGET_PAMS = {"NGG": ["NAG", "NGA"], "NGA": ["NGG"], "NNGRRT": ["NNGRRN"]}
+
+# crispor.py does not score Cpf1 guides
+CPF1_PAMS = ["TTN", "TTTN", "TYCV", "TATV"]
+
+# MIT off-target hit score weights per guide position, aka matrix "M"
+HIT_SCORE_M = [
+    0, 0, 0.014, 0, 0, 0.395, 0.317, 0, 0.389, 0.079,
+    0.445, 0.508, 0.613, 0.851, 0.732, 0.828, 0.615, 0.804, 0.685, 0.583,
+]
+
+IUPAC = {"N": "ACGT", "M": "AC", "K": "GT", "R": "AG", "Y": "CT", "V": "ACG"}
+
+NON_ACGT = re.compile("[^ACGT]")
+
+XA_HIT = re.compile(r"([^,;]+),([-+]\d+),([^,]+),(\d+);")
+
+
+def rev_comp(seq):
+    """
+    Reverse complement of a DNA (or, for the CFD lookup, RNA) sequence.
+    """
+    return seq[::-1].translate(str.maketrans("ACGTU", "TGCAA"))
+
+
+def get_guide_length(pam):
+    """
+    Length of the guides crispor.py aligns for a PAM.
+    """
+    if pam in CPF1_PAMS:
+        raise ValueError(f"CRISPOR does not score guides for Cpf1 PAM {pam}.")
+    if pam in ("NNGRRT", "NNNRRT"):
+        return 21
+    return 20
+
+
+def pat_match(seq, pat):
+    """
+    Whether seq matches the IUPAC pattern pat, both of the same length.
+    """
+    return all(nuc in IUPAC.get(p, p) for nuc, p in zip(seq, pat))
+
+
+def calc_hit_score(guide, offtarget):
+    """
+    MIT score of a single off-target, see 'Scores of single hits' on http://crispr.mit.edu/about.
+    21 bp guides are scored on their last 20 bp.
+    """
+    if len(guide) == 21 and len(offtarget) == 21:
+        guide = guide[-20:]
+        offtarget = offtarget[-20:]
+
+    dists = []  # distances between mismatches
+    mm_count = 0
+    last_mm_pos = None
+    score1 = 1.0
+    for pos in range(len(guide)):
+        if guide[pos] != offtarget[pos]:
+            mm_count += 1
+            if last_mm_pos is not None:
+                dists.append(pos - last_mm_pos)
+            score1 *= 1 - HIT_SCORE_M[pos]
+            last_mm_pos = pos
+    if mm_count < 2:
+        score2 = 1.0
+    else:
+        # crispor.py runs in Python 2, so the average distance is rounded down
+        avg_dist = sum(dists) // len(dists)
+        score2 = 1.0 / (((19 - avg_dist) / 19.0) * 4 + 1)
+    if mm_count == 0:
+        score3 = 1.0
+    else:
+        score3 = 1.0 / (mm_count ** 2)
+    return score1 * score2 * score3 * 100
+
+
+def calc_mit_guide_score(hit_sum):
+    """
+    Specificity of a guide from the sum of its off-target scores, as defined on http://crispr.mit.edu/about.
+    """
+    return int(round(100 / (100 + hit_sum) * 100))
+
+
+@lru_cache(maxsize=None)
+def load_cfd_scores():
+    """
+    Mismatch and PAM score tables of the CFD score, provided by John Doench.
+    """
+    data_dir = os.path.join(CRISPOR_DIR, "CFD_Scoring")
+    with open(os.path.join(data_dir, "mismatch_score.pkl"), "rb") as f:
+        mm_scores = pickle.load(f, encoding="latin1")
+    with open(os.path.join(data_dir, "pam_scores.pkl"), "rb") as f:
+        pam_scores = pickle.load(f, encoding="latin1")
+    return mm_scores, pam_scores
+
+
+def calc_cfd_score(guide, offtarget):
+    """
+    CFD score of an off-target (with its PAM) for a guide. None if either sequence is not all ACGT.
+    """
+    wt = guide.upper()
+    off = offtarget.upper()
+    if NON_ACGT.search(wt) or NON_ACGT.search(off):
+        return None
+    mm_scores, pam_scores = load_cfd_scores()
+    wt = wt.replace("T", "U")
+    sg = off[:20].replace("T", "U")
+    score = 1
+    for i, base in enumerate(sg):
+        if wt[i] != base:
+            score *= mm_scores[f"r{wt[i]}:d{rev_comp(base)},{i + 1}"]
+    return score * pam_scores[off[-2:]]
+
+
+def passes_pam_filter(guide, hit_seq, x1, pam):
+    """
+    Whether a genomic hit (guide + PAM) is kept as an off-target. Hits over the MAXOCC limit
+    are kept so that the guide can be scored as too repetitive.
+    """
+    if x1 > MAXOCC:
+        return True
+    hit_pam = hit_seq[-len(pam) :]
+    if pat_match(hit_pam, pam):
+        return True
+    return any(
+        pat_match(hit_pam, alt_pam)
+        and calc_hit_score(guide, hit_seq[: -len(pam)]) > ALT_PAM_MIN_SCORE
+        for alt_pam in OFFTARGET_PAMS.get(pam, [])
+    )
+
+
+def wait_for(proc):
+    """
+    Waits for a subprocess. Returns its exit status and CPU time (user + system, in seconds).
+    """
+    _, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, rusage.ru_utime + rusage.ru_stime
+
+
+def iter_bwa_hits(guides, genome_fa, guide_length, workdir, job_stats):
+    """
+    Aligns (guide index, guide) pairs to the genome with up to MAX_MMS mismatches.
+    Yields (guide index, chrom, 0-based start, strand, mismatches, X1) for every hit,
+    including the alternative hits bwa lists in the XA tag. The CPU time and exit status
+    of the bwa steps are added to job_stats.
+    """
+    fa_fname = os.path.join(workdir, "guides.fa")
+    sai_fname = os.path.join(workdir, "guides.sai")
+    log_fname = os.path.join(workdir, "bwa.log")
+    with open(fa_fname, "w") as f:
+        for idx, guide in guides:
+            f.write(f">{idx}\n{guide}\n")
+
+    with open(sai_fname, "wb") as sai, open(log_fname, "w") as log:
+        aln = subprocess.Popen(
+            [
+                BWA, "aln", "-o", "0", "-m", str(MFAC * MAXOCC),
+                "-n", str(MAX_MMS), "-k", str(MAX_MMS), "-N", "-l", str(guide_length),
+                genome_fa, fa_fname,
+            ],
+            stdout=sai,
+            stderr=log,
+        )
+        job_stats["status"], cpu_time = wait_for(aln)
+    job_stats["cpu_time"] += cpu_time
+    if aln.returncode != 0:
+        with open(log_fname) as log:
+            raise RuntimeError(
+                f"bwa aln failed with exit status {aln.returncode}: {log.read()}"
+            )
+
+    with open(log_fname, "w") as log:
+        samse = subprocess.Popen(
+            [BWA, "samse", "-n", str(MAXOCC), genome_fa, sai_fname, fa_fname],
+            stdout=subprocess.PIPE,
+            stderr=log,
+            universal_newlines=True,
+        )
+        for line in samse.stdout:
+            if line.startswith("@"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if fields[5] == "*":  # unmapped
+                continue
+            tags = {t[:2]: t[5:] for t in fields[11:]}
+            strand = "-" if int(fields[1]) & 16 else "+"
+            yield (
+                int(fields[0]),
+                fields[2],
+                int(fields[3]) - 1,
+                strand,
+                int(tags["NM"]),
+                int(tags.get("X1", 0)),
+            )
+            # alternative hits have no X1 of their own
+            for chrom, pos, cigar, mm in XA_HIT.findall(tags.get("XA", "")):
+                yield (
+                    int(fields[0]),
+                    chrom,
+                    abs(int(pos)) - 1,
+                    "-" if pos.startswith("-") else "+",
+                    int(mm),
+                    0,
+                )
+        samse.stdout.close()
+        job_stats["status"], cpu_time = wait_for(samse)
+    job_stats["cpu_time"] += cpu_time
+    if samse.returncode != 0:
+        with open(log_fname) as log:
+            raise RuntimeError(
+                f"bwa samse failed with exit status {samse.returncode}: {log.read()}"
+            )
+
+
+def genome_fname(genomes_dir, genome):
+    return os.path.join(genomes_dir, genome, f"{genome}.fa")
+
+
+def genome_identity(genome_fa):
+    """
+    Identifies a genome for the score cache by the name, size and modification time of its FASTA.
+    """
+    stat = os.stat(genome_fa)
+    return f"{os.path.basename(genome_fa)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def score_key(guide, pam, genome_id):
+    """
+    Score cache key of a guide: a hash of the guide, PAM, scoring parameters and the genome
+    identity from genome_identity.
+    """
+    return hashlib.sha1(
+        "|".join([guide, pam, genome_id, SCORE_PARAMS]).encode("ascii")
+    ).hexdigest()
+
+
+def find_job_offtargets(job, guides, genome_fa, pam):
+    """
+    Finds the hits of one job's (guide index, guide) pairs that pass the PAM filter, in a
+    temporary directory of its own. Returns the hits as a dict of guide index -> set of hits,
+    and the job's stats.
+    """
+    job_stats = {"job": job, "guides": len(guides), "status": None, "cpu_time": 0.0}
+    ref_genome = Fasta(genome_fa, as_raw=True)
+    guide_seqs = dict(guides)
+    pam_len = len(pam)
+
+    hits = {}
+    with tempfile.TemporaryDirectory(prefix="crispor_") as workdir:
+        for idx, chrom, start, strand, mm, x1 in iter_bwa_hits(
+            guides, genome_fa, get_guide_length(pam), workdir, job_stats
+        ):
+            # hg38: alternate haplotypes would make their main chromosome regions look untargetable
+            if mm > MAX_MMS or chrom.endswith("_alt"):
+                continue
+            end = start + len(guide_seqs[idx])
+            if strand == "+":
+                end += pam_len
+            else:
+                start -= pam_len
+            if start < 0 or end > len(ref_genome[chrom]):
+                continue
+            hit_seq = ref_genome[chrom][start:end].upper()
+            if strand == "-":
+                hit_seq = rev_comp(hit_seq)
+            if passes_pam_filter(guide_seqs[idx], hit_seq, x1, pam):
+                hits.setdefault(idx, set()).add((mm, chrom, start, strand, hit_seq, x1))
+    logging.info(
+        f"CRISPOR job {job}: {job_stats['guides']} guides, exit status "
+        f"{job_stats['status']}, {job_stats['cpu_time']:.1f} s CPU time."
+    )
+    return hits, job_stats
+
+
+def find_offtargets(guides, genomes_dir, genome, pam, jobs=1):
+    """
+    Finds the genomic hits of (guide index, guide) pairs that pass the PAM filter, split over
+    up to jobs concurrent bwa jobs. Returns a dict of guide index -> list of
+    (mismatches, hit sequence with PAM, X1), sorted by number of mismatches, and a list of
+    per-job stats. Guides without any hit are left out.
+    """
+    genome_fa = genome_fname(genomes_dir, genome)
+    shards = [guides[job::jobs] for job in range(jobs) if guides[job::jobs]]
+    if len(shards) == 1:
+        results = [find_job_offtargets(0, shards[0], genome_fa, pam)]
+    else:
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(
+                pool.map(
+                    find_job_offtargets,
+                    range(len(shards)),
+                    shards,
+                    [genome_fa] * len(shards),
+                    [pam] * len(shards),
+                )
+            )
+
+    hits = {}
+    for job_hits, _ in results:
+        hits.update(job_hits)
+    return (
+        {
+            idx: [(mm, hit_seq, x1) for mm, _, _, _, hit_seq, x1 in sorted(guide_hits)]
+            for idx, guide_hits in hits.items()
+        },
+        [job_stats for _, job_stats in results],
+    )
+
+
+def score_offtargets(guide, hits, pam):
+    """
+    MIT specificity score, CFD specificity score and number of off-targets of a guide from its
+    hits. As with crispor.py --skipAlign, the first perfect match is taken as the on-target.
+    """
+    mit_scores = []
+    cfd_scores = []
+    n_offtargets = 0
+    max_x1 = 0
+    found_ontarget = False
+    for mm, hit_seq, x1 in hits:
+        if mm == 0 and not found_ontarget and x1 < MAXOCC:
+            found_ontarget = True
+            continue
+        n_offtargets += 1
+        mit_score = calc_hit_score(guide, hit_seq[: -len(pam)])
+        # alternative PAMs represent only ~10% of cleavage events
+        if pam == "NGG" and hit_seq[-2:] != "GG":
+            mit_score *= 0.2
+        mit_scores.append(mit_score)
+        cfd_score = calc_cfd_score(guide, hit_seq)
+        if cfd_score is not None:
+            cfd_scores.append(cfd_score)
+        max_x1 = max(max_x1, x1)
+    if max_x1 > MAXOCC:
+        return 0, 0, 0
+    return (
+        calc_mit_guide_score(sum(mit_scores)),
+        calc_mit_guide_score(sum(cfd_scores)),
+        n_offtargets,
+    )
+
+
+def score_guides(guides, genomes_dir, genome, pam="NGG", cache=None, jobs=1):
+    """
+    Scores a batch of guide sequences (without PAM) against a CRISPOR genome.
+    Returns three arrays in the order of guides: MIT specificity score, CFD specificity score
+    and number of off-targets. Scores are NaN for guides that are not the guide length for the
+    PAM, contain bases other than ACGT, or are not found in the genome.
+    If a score_cache.ScoreCache is given, only guides missing from it are aligned.
+    Alignment is split over up to jobs concurrent bwa jobs, each loading the genome index.
+    """
+    genome_fa = genome_fname(genomes_dir, genome)
+    if not os.path.exists(genome_fa):
+        raise FileNotFoundError(f"CRISPOR genome file {genome_fa} not found.")
+    guides = [str(g).upper() for g in guides]
+    mit_scores = np.full(len(guides), np.nan)
+    cfd_scores = np.full(len(guides), np.nan)
+    offtarget_counts = np.zeros(len(guides), dtype=np.int64)
+
+    guide_length = get_guide_length(pam)
+    to_align = [
+        (idx, guide)
+        for idx, guide in enumerate(guides)
+        if len(guide) == guide_length and not NON_ACGT.search(guide)
+    ]
+    if cache is not None and to_align:
+        genome_id = genome_identity(genome_fa)
+        keys = {guide: score_key(guide, pam, genome_id) for _, guide in to_align}
+        cached = cache.get_many(set(keys.values()))
+        misses = []
+        for idx, guide in to_align:
+            if keys[guide] in cached:
+                mit_scores[idx], cfd_scores[idx], offtarget_counts[idx] = cached[keys[guide]]
+            else:
+                misses.append((idx, guide))
+        to_align = misses
+    if not to_align:
+        return mit_scores, cfd_scores, offtarget_counts
+
+    offtargets, _ = find_offtargets(to_align, genomes_dir, genome, pam, jobs)
+    for idx, hits in offtargets.items():
+        mit_scores[idx], cfd_scores[idx], offtarget_counts[idx] = score_offtargets(
+            guides[idx], hits, pam
+        )
+    if cache is not None:
+        cache.put_many(
+            (keys[guide], mit_scores[idx], cfd_scores[idx], offtarget_counts[idx])
+            for idx, guide in to_align
+        )
+    return mit_scores, cfd_scores, offtarget_counts
@@ -6,8 +6,11 @@ Written in Python v 3.6.1.
 Kathleen Keough et al 2018.
 
 Usage:
-    gen_sgRNAs.py [-chvrd] <bcf> <annots_file> <locus> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--hom] [--bed] [--max_indel=<S>] [--strict]
-    gen_sgRNAs.py [-chvrd] <locus> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--hom] [--bed] [--max_indel=<S>] --ref_guides [--strict]
+    gen_sgRNAs.py [-chvrd] <bcf> <annots_file> <locus> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--score_cache=<db>] [--score_cache_size=<N>] [--crispor_jobs=<J>] [--seed_index=<idx>] [--max_seed_occ=<N>] [--profile] [--cprofile] [--out_format=<f>] [--hom] [--bed] [--max_indel=<S>] [--strict]
+    gen_sgRNAs.py [-chvrd] <locus> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--score_cache=<db>] [--score_cache_size=<N>] [--crispor_jobs=<J>] [--seed_index=<idx>] [--max_seed_occ=<N>] [--profile] [--cprofile] [--out_format=<f>] [--hom] [--bed] [--max_indel=<S>] --ref_guides [--strict]
+    gen_sgRNAs.py [-chvrd] <bcf> <annots_file> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--score_cache=<db>] [--score_cache_size=<N>] [--crispor_jobs=<J>] [--seed_index=<idx>] [--max_seed_occ=<N>] [--profile] [--cprofile] [--max_indel=<S>] [--strict] --genome [--window_size=<W>]
+    gen_sgRNAs.py [-chvrd] <bcf> <annots_file> <locus> <pams_dir> <ref_fasta> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--score_cache=<db>] [--score_cache_size=<N>] [--crispor_jobs=<J>] [--seed_index=<idx>] [--max_seed_occ=<N>] [--profile] [--cprofile] [--out_format=<f>] [--bed] [--max_indel=<S>] [--strict] --cohort
+    gen_sgRNAs.py [-chvrd] <bcf> <locus> <out> <cas_types> <guide_length> [<gene_vars>] [--crispor=<ref_gen>] [--score_cache=<db>] [--score_cache_size=<N>] [--crispor_jobs=<J>] [--seed_index=<idx>] [--max_seed_occ=<N>] [--profile] [--cprofile] [--out_format=<f>] [--bed] [--strict] --catalog=<catalog>
     gen_sgRNAs.py -C | --cas-list
 
 Arguments:
@@ -15,10 +18,11 @@ Arguments:
     annots_file         Annotated variant for whether each generates an allele-specific sgRNA site.
     locus               Locus of interest in format chrom:start-stop. Put filepath to BED file here if '--bed'.
     pams_dir            Directory where pam locations in the reference genome are located. 
-    ref_genome_fasta    Fasta file for reference genome used, e.g. hg38.
+    ref_genome_fasta    Fasta file for reference genome used, e.g. hg38, or a genome packed by packed_genome.py.
     out                 Directory in which to save the output files.
     cas_types           Cas types you would like to analyze, comma-separated (e.g. SpCas9,SaCas9).
-    guide_length        Guide length, commonly 20 bp, comma-separated if different for different cas types. 
+    guide_length        Guide length, commonly 20 bp, comma-separated if different for different cas types (in the same
+                        order as cas_types). Separate several lengths for one cas type with '/', e.g. 20,21/22.
 Options:
     gene_vars              Optional. 1KGP originating file to add rsID and allele frequency (AF) data to variants.
     -h --help              Show this screen and exit.
@@ -27,6 +31,17 @@ Options:
     --hom                  Use 'homozygous' mode, personalized sgRNA design. Do not use if ref_guides is specified, they are redundant and non-compatible.
     --crispor=<ref_gen>    Add CRISPOR specificity scores to outputted guides. From Haeussler et al. Genome Biology 2016. 
                            Equals directory name of reference genome (complete).
+    --score_cache=<db>     Keep CRISPOR scores in this sqlite database, so guides scored before are not aligned again.
+    --score_cache_size=<N>  Maximum number of guides kept in the score cache, least recently used are dropped [default: 1000000].
+    --crispor_jobs=<J>     Number of concurrent CRISPOR alignment jobs. Each job loads the bwa index of the genome [default: 1].
+    --seed_index=<idx>     Seed count index of the reference genome from seed_index.py. Guides whose PAM-proximal seed occurs
+                           more than --max_seed_occ times are dropped before CRISPOR scoring.
+    --max_seed_occ=<N>     Maximum occurrences of a guide's seed in the reference genome with --seed_index [default: 5000].
+    --out_format=<f>       Format of the output guide table: tsv, parquet (needs pyarrow) or hdf. Not used with --genome,
+                           which always appends to <out>.tsv [default: tsv].
+    --profile              Record wall and CPU time, calls and peak memory of each stage (bcftools, HDF5 reads, PAM loading,
+                           guide design, CRISPOR, ...) per locus and overall, saved to <out>_profile.json.
+    --cprofile             With --profile, also save cProfile stats of the run to <out>_profile.prof.
     --bed                  Design sgRNAs for multiple regions specified in a BED file.
     --max_indel=<S>        Maximum size for INDELS. Must be smaller than guide_length [default: 5].
     -r                     Return guides as RNA sequences rather than DNA sequences.
@@ -34,6 +49,13 @@ Options:
     -C --cas-list          List available cas types and exits.
     --ref_guides           Design guides for reference genome, ignoring variants in region.
     --strict               Only design allele-specific guides where the variant makes or breaks a PAM site. 
+    --genome               Design allele-specific guides for every heterozygous variant in the BCF/VCF, one window at a time.
+                           Output is appended to <out>.tsv, with progress in <out>.checkpoint so interrupted runs resume.
+    --window_size=<W>      Window size (bp) for --genome [default: 1000000].
+    --cohort               Design allele-specific guides for every sample in the BCF/VCF at once. Guides are designed
+                           once per unique heterozygous variant and saved per sample to <out>_<sample>.tsv (or --out_format).
+    --catalog=<catalog>    Look up allele-specific guides in a catalog made by build_guide_catalog.py instead of designing them.
+                           Must be built with the same -c and include the requested cas types and guide lengths.
 """
 
 import pandas as pd
@@ -41,7 +63,6 @@ import numpy as np
 from docopt import docopt
 import os
 import cas_object
-from pyfaidx import Fasta
 from collections import Counter
 import regex
 import re
@@ -49,11 +70,25 @@ from Bio import SeqIO
 import subprocess
 from io import StringIO
 import logging
+import itertools
+from functools import lru_cache
+from pam_index import PamIndex
+from ref_guide_library import RefGuideLibrary
+import seq_pack
+from packed_genome import PackedGenome, open_reference
+import crispor_scoring
+from seed_index import SeedIndex
+from score_cache import ScoreCache
+from table_writer import TableWriter, check_out_format
+from stage_profiler import PROFILER
 
 __version__ = "0.0.1"
 
 REQUIRED_BCFTOOLS_VER = "1.5"
 
+# guides of a multi-locus run that are filtered, scored and written at a time
+OUTPUT_CHUNK_GUIDES = 100000
+
 # COLUMN_ORDER=['chrom','variant_position','ref','alt','gRNA_ref','gRNA_alt',
 # 'variant_position_in_guide','start','stop','strand','cas_type','guide_id','rsID','AF']
 # get rid of annoying false positive Pandas error
@@ -107,6 +142,7 @@ def het(genotype):
     return gen1 != gen2
 
 
+@PROFILER.profiled("bcftools")
 def check_bcftools():
     """ 
     Checks bcftools version, and exits the program if the version is incorrect
@@ -220,92 +256,77 @@ def get_alt_seq(
         exit(1)
 
 
+REV_COMP_TABLE = str.maketrans("ACGT", "TGCA")
+
+
 def make_rev_comp(s):
     """
     Generates reverse comp sequences from an input sequence.
     """
-    return s[::-1].translate(s[::-1].maketrans("ACGT", "TGCA"))
-
-
-def get_crispor_scores(out_df, outdir, ref_gen):
-    guide_seqs_ref = [">ref_guide_seqs\n"]
-    guide_seqs_alt = [">alt_guide_seqs\n"]
-    for index, row in out_df.iterrows():
-        guide_seqs_ref.append(
-            row["gRNA_ref"] + "GGGNN\n"
-        )  # the NN splits things up for CRISPOR
-        guide_seqs_alt.append(row["gRNA_alt"] + "GGGNN\n")
-    with open("ref_seqs_nosave.fa", "w") as f:
-        for seq in guide_seqs_ref:
-            f.write(seq)
-    with open("alt_seqs_nosave.fa", "w") as f:
-        for seq in guide_seqs_alt:
-            f.write(seq)
-    # get script dir
-    scriptsdir = os.path.join(os.path.dirname(__file__), "crispor")
-    run_name = os.path.join(
-        scriptsdir, f"crispor.py --skipAlign --noEffScores -g {ref_gen} {ref_gen}"
-    )
-    print("Running crispor.")
-    # error_out = os.path.join(outdir, 'crispor_error.txt')
-    error_out = os.path.join(os.path.dirname(outdir), "crispor_error.txt")
-    command = f"source activate crispor; \
-    python2 {run_name} ref_seqs_nosave.fa nosave_ref_scores.tsv &> {error_out};\
-    python2 {run_name} alt_seqs_nosave.fa nosave_alt_scores.tsv &> {error_out};\
-    source deactivate crispor"
-    subprocess.run(command, shell=True)
-    print("crispor done")
-    # subprocess.run('source deactivate crispor', shell=True)
-    # remove seq files
-    os.remove("ref_seqs_nosave.fa")
-    os.remove("alt_seqs_nosave.fa")
-    # grab scores from files outputted from CRISPOR
-    score_dir_ref = pd.read_csv(
-        "nosave_ref_scores.tsv",
-        sep="\t",
-        header=None,
-        names=[
-            "seqId",
-            "guideId",
-            "targetSeq",
-            "mitSpecScore",
-            "offtargetCount",
-            "targetGenomeGeneLocus",
-        ],
-    )
-    score_dir_alt = pd.read_csv(
-        "nosave_alt_scores.tsv",
-        sep="\t",
-        header=None,
-        names=[
-            "seqId",
-            "guideId",
-            "targetSeq",
-            "mitSpecScore",
-            "offtargetCount",
-            "targetGenomeGeneLocus",
-        ],
+    return s[::-1].translate(REV_COMP_TABLE)
+
+
+def rev_comp_guides(seqs):
+    """
+    Reverse complements a list of guide sequences.
+    """
+    return [make_rev_comp(seq) for seq in seqs]
+
+
+@lru_cache(maxsize=None)
+def get_score_cache(db_fname, max_entries):
+    return ScoreCache(db_fname, max_entries)
+
+
+def open_score_cache(args):
+    """
+    Returns the score cache given with --score_cache, shared by all loci of a run, or None.
+    """
+    if not args.get("--score_cache"):
+        return None
+    return get_score_cache(args["--score_cache"], int(args["--score_cache_size"]))
+
+
+def is_placeholder_guide(guide):
+    """
+    Whether a guide is an all-G, all-C or all-dash placeholder for an allele without a guide.
+    """
+    return len(set(guide)) == 1 and guide[0] in "GC-"
+
+
+def get_crispor_scores(out_df, outdir, ref_gen, score_cache=None, jobs=1):
+    """
+    Adds CRISPOR MIT specificity scores and off-target counts for the ref and alt guides.
+    ref_gen is the CRISPOR genome directory, <ref_gen>/<genome>/<genome>.fa, named after its basename.
+    The ref and alt guides of all rows are scored as one batch: every unique guide is aligned
+    once, placeholder guides are not aligned, and the scores are mapped back onto the rows.
+    """
+    out_df = out_df.copy()
+    genome = os.path.basename(os.path.normpath(ref_gen))
+    guides = pd.unique(
+        pd.concat([out_df["gRNA_ref"], out_df["gRNA_alt"]]).astype(str)
     )
-    # remove original score files
-    os.remove("nosave_ref_scores.tsv")
-    os.remove("nosave_alt_scores.tsv")
-    # merge score info with original out_df
-    merge_df_ref = pd.DataFrame()
-    merge_df_ref["scores_ref"] = score_dir_ref["mitSpecScore"]
-    merge_df_ref["offtargcount_ref"] = score_dir_ref["offtargetCount"]
-    merge_df_ref["gRNA_ref"] = score_dir_ref["targetSeq"].str[
-        :-3
-    ]  # get rid of added on PAM site
-    merge_df_alt = pd.DataFrame()
-    merge_df_alt["scores_alt"] = score_dir_alt["mitSpecScore"]
-    merge_df_alt["offtargcount_alt"] = score_dir_alt["offtargetCount"]
-    merge_df_alt["gRNA_alt"] = score_dir_alt["targetSeq"].str[
-        :-3
-    ]  # get rid of added on PAM site
-    # output outdir with its new score columns
-    outdf = out_df.merge(merge_df_ref, how="left", on="gRNA_ref")
-    outdf = outdf.merge(merge_df_alt, how="left", on="gRNA_alt")
-    return outdf
+    guides = [guide for guide in guides if not is_placeholder_guide(guide)]
+    logging.info(f"Running crispor on {len(guides)} unique guides.")
+    try:
+        mit_scores, _, offtarget_counts = crispor_scoring.score_guides(
+            guides, ref_gen, genome, cache=score_cache, jobs=jobs
+        )
+    except (OSError, RuntimeError) as e:
+        logging.error(f"CRISPOR scoring failed: {e} Exiting.")
+        exit(1)
+    mit_scores = dict(zip(guides, mit_scores))
+    offtarget_counts = dict(zip(guides, offtarget_counts))
+    for allele in ("ref", "alt"):
+        allele_guides = out_df[f"gRNA_{allele}"].astype(str)
+        out_df[f"scores_{allele}"] = allele_guides.map(mit_scores)
+        out_df[f"offtargcount_{allele}"] = allele_guides.map(offtarget_counts).where(
+            out_df[f"scores_{allele}"].notnull()
+        )
+    logging.info("crispor done")
+    if score_cache is not None:
+        logging.info(score_cache.summary())
+    return out_df
 
 
 def verify_hdf_files(gen_file, annots_file, chrom, start, stop, max_indel):
@@ -324,180 +345,224 @@ def verify_hdf_files(gen_file, annots_file, chrom, start, stop, max_indel):
         return gen_file[indel_too_large], annots_file[indel_too_large]
 
 
-def filter_out_N_in_PAM(outdf, cas_ins):
+def get_pam_position_lookup(cas_ins, n_positions=True):
     """
-    Using the given cas list, find N indexes and remove rows with N's.
+    Build a (number of Cas types x longest PAM) boolean lookup, where entry [i, j] is True
+    if position j of the PAM for cas_ins[i] (oriented as variant_position_in_guide counts it)
+    is an N (or, if n_positions is False, a non-N).
     """
-    filt = []
-    for cas in cas_ins:
-        current_cas = cas_object.get_cas_enzyme(cas)
+    enzymes = cas_object.get_cas_enzymes(cas_ins)
+    max_pam_len = max(len(enzymes[cas].forwardPam) for cas in cas_ins)
+    lookup = np.zeros((len(cas_ins), max_pam_len), dtype=bool)
+    for i, cas in enumerate(cas_ins):
+        current_cas = enzymes[cas]
         if current_cas.primeness == "5'":
             PAM_sequence = current_cas.forwardPam
         else:
             PAM_sequence = current_cas.forwardPam[::-1]
-        n_index = [i for i, l in enumerate(PAM_sequence) if l == "N"]
-        filt += [
-            i
-            for i, row in outdf.iterrows()
-            if row["variant_position_in_guide"] in n_index and row["cas_type"] == cas
-        ]
-    outdf = outdf.drop(filt)
-    return outdf
+        is_n = np.array([l == "N" for l in PAM_sequence], dtype=bool)
+        lookup[i, : len(PAM_sequence)] = is_n if n_positions else ~is_n
+    return lookup
 
 
-def filter_out_non_N_in_PAM(outdf, cas_ins):
+def filter_pam_positions(outdf, cas_ins, n_positions=True):
     """
-    Using the given cas list, find N indexes and remove rows with N's.
+    Remove rows whose variant falls on an N (or non-N) PAM position for their cas_type,
+    using a single vectorized mask over variant_position_in_guide and cas_type.
     """
-    filt = []
-    for cas in cas_ins:
-        current_cas = cas_object.get_cas_enzyme(cas)
-        if current_cas.primeness == "5'":
-            PAM_sequence = current_cas.forwardPam
-        else:
-            PAM_sequence = current_cas.forwardPam[::-1]
-        n_index = [i for i, l in enumerate(PAM_sequence) if l != "N"]
-        filt += [
-            i
-            for i, row in outdf.iterrows()
-            if row["variant_position_in_guide"] in n_index and row["cas_type"] == cas
-        ]
-    outdf = outdf.drop(filt)
-    return outdf
+    if outdf.empty:
+        return outdf
+    cas_ins = list(cas_ins)
+    lookup = get_pam_position_lookup(cas_ins, n_positions)
+    cas_codes = pd.Categorical(outdf["cas_type"], categories=cas_ins).codes
+    var_pos = pd.to_numeric(outdf["variant_position_in_guide"], errors="coerce").values
+    # only integral positions inside the PAM of a requested Cas can match the lookup
+    in_pam = (
+        (cas_codes >= 0)
+        & ~np.isnan(var_pos)
+        & (var_pos >= 0)
+        & (var_pos < lookup.shape[1])
+        & (np.mod(var_pos, 1) == 0)
+    )
+    drop = np.zeros(len(outdf), dtype=bool)
+    drop[in_pam] = lookup[cas_codes[in_pam], var_pos[in_pam].astype(int)]
+    return outdf[~drop]
 
 
-def get_allele_spec_guides(args, locus="ignore"):
-    """ 
-    Outputs dataframe with allele-specific guides.
+@PROFILER.profiled("filter_pams")
+def filter_out_N_in_PAM(outdf, cas_ins):
     """
+    Using the given cas list, find N indexes and remove rows with N's.
+    """
+    return filter_pam_positions(outdf, cas_ins, n_positions=True)
 
-    # load genotypes
-    bcf = args["<bcf>"]
 
-    # parse locus
-    if locus == "ignore":
-        chrom, start, stop = parse_locus(args["<locus>"])
-    else:
-        chrom, start, stop = parse_locus(locus)
+def filter_out_non_N_in_PAM(outdf, cas_ins):
+    """
+    Using the given cas list, find non-N indexes and remove rows with non-N's.
+    """
+    return filter_pam_positions(outdf, cas_ins, n_positions=False)
+
+
+GUIDE_COLUMNS = [
+    "chrom",
+    "start",
+    "stop",
+    "ref",
+    "alt",
+    "variant_position_in_guide",
+    "gRNA_ref",
+    "gRNA_alt",
+    "variant_position",
+    "strand",
+    "cas_type",
+    "guide_length",
+]
+
+
+@PROFILER.profiled("bcftools")
+def get_vcf_chrstart(bcf):
+    """
+    Determine whether chromosomes in the VCF/BCF are annotated with a leading 'chr'.
+    """
+    vcf_chrom = str(
+        subprocess.Popen(
+            f"bcftools view -H {bcf} | cut -f1 | head -1",
+            shell=True,
+            stdout=subprocess.PIPE,
+        )
+        .communicate()[0]
+        .decode("utf-8")
+        .strip()
+    )
+    return vcf_chrom.startswith("chr")
 
-    # get location of pams directory with stored locations of PAMs in reference genome
-    pams_dir = args["<pams_dir>"]
 
-    # get guide length
-    guide_length = int(args["<guide_length>"])
+@lru_cache(maxsize=None)
+@PROFILER.profiled("load_pams")
+def get_pam_index(pams_dir):
+    """
+    Returns the memory-mapped PAM index for pams_dir, shared by every locus in this run.
+    """
+    return PamIndex(pams_dir)
 
-    # get ref_genome
-    ref_genome = Fasta(args["<ref_fasta>"], as_raw=True)
 
-    # figure out annotation of VCF/BCF chromosome (i.e. starts with 'chr' or not)
-    vcf_chrom = str(
-            subprocess.Popen(
-                f'bcftools view -H {args["<bcf>"]} | cut -f1 | head -1',
-                shell=True,
-                stdout=subprocess.PIPE,
-            ).communicate()[0].decode('utf-8')
-        )
+@lru_cache(maxsize=None)
+@PROFILER.profiled("load_pams")
+def get_ref_guide_library(pams_dir, guide_length):
+    """
+    Returns the prebuilt reference guide library next to the PAM files in pams_dir.
+    """
+    return RefGuideLibrary(get_pam_index(pams_dir), guide_length)
 
-    # See if chrom contains chr
-    if vcf_chrom.startswith("chr"):
-        chrstart = True
-    else:
-        chrstart = False
 
-    chrom = norm_chr(chrom, chrstart)
-    # eliminates rows with missing genotypes and gets those where heterozygous
-    # bcl_v = f"bcftools view -g ^miss -g het -r {chrom}:{start}-{stop} -H {bcf}"
-    bcl_view = subprocess.Popen(f'bcftools view -g ^miss -g het -r {chrom}:{start}-{stop} {bcf} -Ou | bcftools query -f"%CHROM\t%POS\t%REF\t[%TGT]\n"', 
-        shell=True, stdout=subprocess.PIPE)
-    # bcl_v = f'bcftools query -f"%CHROM\t%POS\t%REF\t[%TGT]\n"'
-    col_names = ["chrom","pos","ref","translated_genotype"]
-    # bcl_view = subprocess.Popen(f'bcftools query -f"%CHROM\t%POS\t%REF\t[%TGT]\n"', shell=True, stdin=bcf_orig.stdout, stdout=subprocess.PIPE)
-    bcl_view.wait()
+@lru_cache(maxsize=None)
+@PROFILER.profiled("load_ref_genome")
+def load_ref_genome(ref_fasta):
+    """
+    Returns the reference genome (FASTA or packed), opened once per run.
+    """
+    return open_reference(ref_fasta)
 
-    try:
-        gens = pd.read_csv(
-        StringIO(bcl_view.communicate()[0].decode("utf-8")),
-        sep="\t",
-        header=None)
-    except pd.io.common.EmptyDataError:
-        gens = pd.DataFrame()
 
-    # load variant annotations
-    var_annots = pd.read_hdf(args["<annots_file>"]).query('(chrom == @chrom) and (pos >= @start) and (pos <= @stop)')
+def het_alts(gens):
+    """
+    Get the alternate allele of each heterozygous site from its translated genotype, e.g. A|G.
+    """
+    alleles = gens["translated_genotype"].str.split("/|\|", n=1, expand=True)
+    gens["alt"] = np.where(alleles[0] == gens["ref"], alleles[1], alleles[0])
+    return gens[["chrom", "pos", "ref", "alt"]]
 
-    # if gens is empty, annots should be too, double check this
-    if gens.empty and not var_annots.empty:
-        logging.info(
-            "Check that you used the same coordinates for generating the annots file \
-            as are being used here."
-        )
-        exit(1)
 
-    # if no variants annotated, no allele-specific guides possilbe
-    if gens.empty:
-        logging.info(
-            "No hetorozygous variants, thus no allele-specific guides for this locus."
-        )
-        return None
+@PROFILER.profiled("read_hdf")
+def load_var_annots(annots_file, chrom, start, stop):
+    """
+    Load variant annotations for chrom:start-stop, letting HDF5 select the rows by position.
+    """
+    var_annots = pd.read_hdf(annots_file, where=f"pos >= {start} & pos <= {stop}")
+    return var_annots[var_annots["chrom"].astype(str) == str(chrom)]
 
-    n_cols = len(gens.columns)
-    col_names = col_names + (['blah'] * (n_cols - len(col_names)))
-    gens.columns = col_names
-    gens['gen_1'], gens['gen_2'] = gens['translated_genotype'].str.split('/|\|', 1).str
-    gens['alt'] = np.where(gens['gen_1'] == gens['ref'], gens['gen_2'], gens['gen_1'])
-    gens = gens[['chrom','pos','ref','alt']]
 
-    # remove big indels
-    # gens, var_annots = verify_hdf_files(
-    #     gens, var_annots, chrom, start, stop, int(args["--max_indel"])
-    # )
+@PROFILER.profiled("read_hdf")
+def load_gene_vars(gene_vars_file, chrstart, start=None, stop=None):
+    """
+    Load rsID and AF info, restricted to a position range when the file is in table format.
+    """
+    if start is None:
+        gene_vars = pd.read_hdf(gene_vars_file)
+    else:
+        try:
+            gene_vars = pd.read_hdf(
+                gene_vars_file, where=f"pos >= {start} & pos <= {stop}"
+            )
+        except TypeError:  # fixed-format stores cannot be queried
+            gene_vars = pd.read_hdf(gene_vars_file).query(
+                "(pos >= @start) and (pos <= @stop)"
+            )
+    gene_vars["chrom"] = [
+        norm_chr(chrom, chrstart) for chrom in gene_vars["chrom"].tolist()
+    ]
+    return gene_vars
 
-    # if gens is empty, annots should be too, double check this
-    if gens.empty and not var_annots.empty:
-        logging.info(
-            "Check that you used the same coordinates for generating the annots file \
-            as are being used here."
-        )
-        exit(1)
 
-    # if no variants annotated, no allele-specific guides possilbe
-    if gens.empty:
-        logging.info(
-            "No hetorozygous variants, thus no allele-specific guides for this locus."
+@PROFILER.profiled("guide_info")
+def add_guide_info(out, args, chrstart, start=None, stop=None):
+    """
+    Add rsID/AF info (if requested) to designed allele-specific guides.
+    CRISPOR scores are added separately by add_crispor_scores, in one batch for many loci.
+    """
+    # get rsID and AF info if provided
+    if args["<gene_vars>"]:
+        gene_vars = load_gene_vars(args["<gene_vars>"], chrstart, start, stop)
+        gene_vars = gene_vars.rename(index=str, columns={"pos": "variant_position"})
+        out = out.merge(
+            gene_vars, how="left", on=["chrom", "variant_position", "ref", "alt"]
         )
-        return None
 
-    # output number of heterozygous variants in locus
-    variants = set(gens.pos.tolist())
-    logging.info(
-        "There are "
-        + str(len(variants))
-        + " heterozygous variants in this locus in this genome."
-    )
+    out = out.drop_duplicates()
+    return out
+
 
-    # set up what will become the output dataframe
+@PROFILER.profiled("design_guides")
+def design_allele_spec_guides(
+    var_annots,
+    chrom,
+    chrstart,
+    start,
+    stop,
+    guide_lengths,
+    pam_index,
+    ref_genome,
+    args,
+    with_var_type=False,
+):
+    """
+    Design allele-specific guides for the annotated variants in var_annots, all of which
+    are on chrom. PAM sites are restricted to start-stop. guide_lengths maps each Cas to the
+    guide lengths to design. If with_var_type, a var_type column records whether each
+    guide's variant is near_pam, destroys_pam or makes_pam.
+    """
     grna_dicts = []
-    # pd.DataFrame(columns=['chrom','start','stop','ref','alt','variant_position_in_guide','gRNA_ref','gRNA_alt',
-    # 'variant_position','strand','cas_type'])
+    # guides to reverse complement, done for all of them at once at the end
+    rev_comp = []
+
+    def add_guide(var_type, to_rev_comp, *values):
+        grna_dict = dict(zip(GUIDE_COLUMNS, values))
+        grna_dict["var_type"] = var_type
+        grna_dicts.append(grna_dict)
+        rev_comp.append(to_rev_comp)
+
+    out_chrom = str(norm_chr(chrom, chrstart))
+    enzymes = cas_object.get_cas_enzymes(CAS_LIST)
 
     # make guides for variants within sgRNA region for 3 prime PAMs (guide_length bp upstream of for pos and vice versa)
     for cas in CAS_LIST:
 
         # get Cas information
-        cas_obj = cas_object.get_cas_enzyme(cas)
+        cas_obj = enzymes[cas]
         pam_length = len(cas_obj.forwardPam)
-
-        # get positions of PAMs annotated in reference genome
-        if not chrom.startswith("chr"):
-            chrom = "chr" + chrom
-        pam_for_pos = np.load(
-            os.path.join(pams_dir, f"{chrom}_{cas}_pam_sites_for.npy")
-        ).tolist()
-        pam_for_pos = list(filter(lambda x: x >= start and x <= stop, pam_for_pos))
-        pam_rev_pos = np.load(
-            os.path.join(pams_dir, f"{chrom}_{cas}_pam_sites_rev.npy")
-        ).tolist()
-        pam_rev_pos = list(filter(lambda x: x >= start and x <= stop, pam_rev_pos))
+        lengths = guide_lengths[cas]
+        max_length = max(lengths)
 
         logging.info(f"Currently evaluating {cas}.")
 
@@ -509,12 +574,15 @@ def get_allele_spec_guides(args, locus="ignore"):
         # design guides for variants near PAMs
         if not args["--strict"]:
             for index, row in vars_near_pams.iterrows():
-                var = row["pos"]
-                proximal_sites_for = list(
-                    range(row["pos"], row["pos"] + guide_length + 1)
-                )
-                nearby_for_pams = list(set(proximal_sites_for) & set(pam_for_pos))
-                for pam_site in nearby_for_pams:
+                var = int(row["pos"])
+                # PAMs annotated in the reference genome within the longest guide of the variant,
+                # shared by every guide length
+                nearby_for_pams = pam_index.in_range(
+                    chrom, cas, "for", max(var, start), min(var + max_length, stop)
+                ).tolist()
+                for pam_site, guide_length in itertools.product(nearby_for_pams, lengths):
+                    if pam_site > var + guide_length:
+                        continue
 
                     grna_ref_seq, grna_alt_seq = get_alt_seq(
                         chrom,
@@ -527,43 +595,29 @@ def get_allele_spec_guides(args, locus="ignore"):
                         var_type="near_pam",
                     )
 
-                    chrom = norm_chr(chrom, chrstart)
-                    grna_dicts.append(
-                        dict(
-                            zip(
-                                [
-                                    "chrom",
-                                    "start",
-                                    "stop",
-                                    "ref",
-                                    "alt",
-                                    "variant_position_in_guide",
-                                    "gRNA_ref",
-                                    "gRNA_alt",
-                                    "variant_position",
-                                    "strand",
-                                    "cas_type",
-                                ],
-                                [
-                                    str(chrom),
-                                    (pam_site - guide_length - 1),
-                                    (pam_site - 1),
-                                    row["ref"],
-                                    row["alt"],
-                                    (pam_site - var - 1 + pam_length),
-                                    grna_ref_seq,
-                                    grna_alt_seq,
-                                    var,
-                                    "positive",
-                                    cas,
-                                ],
-                            )
-                        )
+                    add_guide(
+                        "near_pam",
+                        False,
+                        out_chrom,
+                        (pam_site - guide_length - 1),
+                        (pam_site - 1),
+                        row["ref"],
+                        row["alt"],
+                        (pam_site - var - 1 + pam_length),
+                        grna_ref_seq,
+                        grna_alt_seq,
+                        var,
+                        "positive",
+                        cas,
+                        guide_length,
                     )
 
-                proximal_sites_rev = list(range(row["pos"] - guide_length, row["pos"]))
-                nearby_rev_pams = list(set(proximal_sites_rev) & set(pam_rev_pos))
-                for pam_site in nearby_rev_pams:
+                nearby_rev_pams = pam_index.in_range(
+                    chrom, cas, "rev", max(var - max_length, start), min(var - 1, stop)
+                ).tolist()
+                for pam_site, guide_length in itertools.product(nearby_rev_pams, lengths):
+                    if pam_site < var - guide_length:
+                        continue
 
                     grna_ref_seq, grna_alt_seq = get_alt_seq(
                         chrom,
@@ -571,369 +625,649 @@ def get_allele_spec_guides(args, locus="ignore"):
                         int(row["pos"]),
                         row["ref"],
                         row["alt"],
-                        int(guide_length),
+                        guide_length,
                         ref_genome,
                         strand="negative",
                         var_type="near_pam",
                     )
-                    if not args["-c"]:
-                        grna_ref_seq, grna_alt_seq = (
-                            make_rev_comp(grna_ref_seq),
-                            make_rev_comp(grna_alt_seq),
-                        )
-
-                    chrom = norm_chr(chrom, chrstart)
-                    grna_dicts.append(
-                        dict(
-                            zip(
-                                [
-                                    "chrom",
-                                    "start",
-                                    "stop",
-                                    "ref",
-                                    "alt",
-                                    "variant_position_in_guide",
-                                    "gRNA_ref",
-                                    "gRNA_alt",
-                                    "variant_position",
-                                    "strand",
-                                    "cas_type",
-                                ],
-                                [
-                                    str(chrom),
-                                    pam_site,
-                                    pam_site + guide_length,
-                                    row["ref"],
-                                    row["alt"],
-                                    var - pam_site + pam_length - 1,
-                                    grna_ref_seq,
-                                    grna_alt_seq,
-                                    var,
-                                    "negative",
-                                    cas,
-                                ],
-                            )
-                        )
-                    )
-            # else:
-            #     continue
-        # design guides for heterozygous variants that destroy PAMs
-        for index, row in vars_destroy_pam.iterrows():
-            var = row["pos"]
-            ref = row["ref"]
-            alt = row["alt"]
 
-            chrom = chrom.replace("chr", "")
+                    add_guide(
+                        "near_pam",
+                        not args["-c"],
+                        out_chrom,
+                        pam_site,
+                        pam_site + guide_length,
+                        row["ref"],
+                        row["alt"],
+                        var - pam_site + pam_length - 1,
+                        grna_ref_seq,
+                        grna_alt_seq,
+                        var,
+                        "negative",
+                        cas,
+                        guide_length,
+                    )
 
-            ref_seq = ref_genome["chr" + str(chrom)][var - 11 : var + 10]
+        # design guides for heterozygous variants that destroy or make PAMs
+        for var_type, pam_vars in (
+            ("destroys_pam", vars_destroy_pam),
+            ("makes_pam", vars_make_pam),
+        ):
+            for index, row in pam_vars.iterrows():
+                var = int(row["pos"])
+                ref = row["ref"]
+                alt = row["alt"]
+
+                fasta_chrom = "chr" + str(chrom).replace("chr", "")
+
+                ref_seq = ref_genome[fasta_chrom][var - 11 : var + 10]
+
+                if len(ref) > len(alt):  # handles deletions
+                    alt_seq = (
+                        ref_genome[fasta_chrom][var - 11 : var - 1]
+                        + alt
+                        + ref_genome[fasta_chrom][
+                            var
+                            + len(ref)
+                            + len(alt)
+                            - 2 : var
+                            + len(ref)
+                            + len(alt)
+                            - 2
+                            + 10
+                        ]
+                    )
+                else:
+                    alt_seq = (
+                        ref_genome[fasta_chrom][var - 11 : var - 1]
+                        + alt
+                        + ref_genome[fasta_chrom][
+                            var + len(alt) - 1 : var + len(alt) - 1 + 10
+                        ]
+                    )
 
-            if len(ref) > len(alt):  # handles deletions
-                alt_seq = (
-                    ref_genome["chr" + str(chrom)][var - 11 : var - 1]
-                    + alt
-                    + ref_genome["chr" + str(chrom)][
-                        var
-                        + len(ref)
-                        + len(alt)
-                        - 2 : var
-                        + len(ref)
-                        + len(alt)
-                        - 2
-                        + 10
-                    ]
+                ref_pams_for, ref_pams_rev = find_spec_pams(
+                    cas_obj, ref_seq, orient=cas_obj.primeness
                 )
-            else:
-                alt_seq = (
-                    ref_genome["chr" + str(chrom)][var - 11 : var - 1]
-                    + alt
-                    + ref_genome["chr" + str(chrom)][
-                        var + len(alt) - 1 : var + len(alt) - 1 + 10
-                    ]
+                alt_pams_for, alt_pams_rev = find_spec_pams(
+                    cas_obj, alt_seq, orient=cas_obj.primeness
                 )
 
-            ref_pams_for, ref_pams_rev = find_spec_pams(
-                cas_obj, ref_seq, orient=cas_obj.primeness
-            )
-            alt_pams_for, alt_pams_rev = find_spec_pams(
-                cas_obj, alt_seq, orient=cas_obj.primeness
-            )
+                if var_type == "destroys_pam":
+                    # PAMs only present in the reference allele
+                    pams_for = list(set(ref_pams_for).difference(set(alt_pams_for)))
+                    pams_rev = list(set(ref_pams_rev).difference(set(alt_pams_rev)))
+                else:
+                    # PAMs only present in the alternate allele
+                    pams_for = list(set(alt_pams_for).difference(set(ref_pams_for)))
+                    pams_rev = list(set(alt_pams_rev).difference(set(ref_pams_rev)))
+
+                for pam, guide_length in itertools.product(pams_for, lengths):
+                    pam_site = pam + var - 11
+                    grna_ref_seq, grna_alt_seq = get_alt_seq(
+                        chrom,
+                        pam_site,
+                        var,
+                        ref,
+                        alt,
+                        guide_length,
+                        ref_genome,
+                        var_type=var_type,
+                    )
+
+                    add_guide(
+                        var_type,
+                        False,
+                        out_chrom,
+                        (pam_site - guide_length),
+                        (pam_site),
+                        ref,
+                        alt,
+                        (pam_site + pam_length - var),
+                        grna_ref_seq,
+                        grna_alt_seq,
+                        var,
+                        "positive",
+                        cas,
+                        guide_length,
+                    )
+
+                for pam, guide_length in itertools.product(pams_rev, lengths):
+                    pam_site = pam + var - 11
+                    grna_ref_seq, grna_alt_seq = get_alt_seq(
+                        chrom,
+                        pam_site,
+                        var,
+                        ref,
+                        alt,
+                        guide_length,
+                        ref_genome,
+                        strand="negative",
+                        var_type=var_type,
+                    )
+
+                    # reverse complement guides on the negative strand (made PAMs never were)
+                    add_guide(
+                        var_type,
+                        var_type == "destroys_pam" and not args["-c"],
+                        out_chrom,
+                        (pam_site),
+                        (pam_site + guide_length),
+                        ref,
+                        alt,
+                        (var - pam_site + pam_length - 1),
+                        grna_ref_seq,
+                        grna_alt_seq,
+                        var,
+                        "negative",
+                        cas,
+                        guide_length,
+                    )
+
+    columns = GUIDE_COLUMNS + (["var_type"] if with_var_type else [])
+    out = pd.DataFrame(grna_dicts, columns=columns)
+    rev_comp = np.array(rev_comp, dtype=bool)
+    if rev_comp.any():
+        for col in ["gRNA_ref", "gRNA_alt"]:
+            out.loc[rev_comp, col] = rev_comp_guides(out.loc[rev_comp, col].tolist())
+    return out
+
+
+@PROFILER.profiled("bcftools")
+def get_locus_hets(bcf, chrom, start, stop):
+    """
+    Get heterozygous variants (chrom, pos, ref, alt) in chrom:start-stop for a single genome.
+    """
+    # eliminates rows with missing genotypes and gets those where heterozygous
+    bcl_view = subprocess.Popen(f'bcftools view -g ^miss -g het -r {chrom}:{start}-{stop} {bcf} -Ou | bcftools query -f"%CHROM\t%POS\t%REF\t[%TGT]\n"',
+        shell=True, stdout=subprocess.PIPE)
+    col_names = ["chrom","pos","ref","translated_genotype"]
+
+    try:
+        gens = pd.read_csv(
+        StringIO(bcl_view.communicate()[0].decode("utf-8")),
+        sep="\t",
+        header=None)
+    except pd.io.common.EmptyDataError:
+        return pd.DataFrame()
+
+    n_cols = len(gens.columns)
+    col_names = col_names + (['blah'] * (n_cols - len(col_names)))
+    gens.columns = col_names
+    return het_alts(gens)
+
 
-            lost_pams_for = list(set(ref_pams_for).difference(set(alt_pams_for)))
-            lost_pams_rev = list(set(ref_pams_rev).difference(set(alt_pams_rev)))
+def get_allele_spec_guides(args, locus="ignore"):
+    """
+    Outputs dataframe with allele-specific guides, or None if there are none.
+    """
+
+    # load genotypes
+    bcf = args["<bcf>"]
+
+    # parse locus
+    if locus == "ignore":
+        chrom, start, stop = parse_locus(args["<locus>"])
+    else:
+        chrom, start, stop = parse_locus(locus)
+
+    # get ref_genome
+    ref_genome = load_ref_genome(args["<ref_fasta>"])
+
+    # figure out annotation of VCF/BCF chromosome (i.e. starts with 'chr' or not)
+    chrstart = get_vcf_chrstart(bcf)
+
+    chrom = norm_chr(chrom, chrstart)
+    gens = get_locus_hets(bcf, chrom, start, stop)
+
+    # load variant annotations
+    var_annots = load_var_annots(args["<annots_file>"], chrom, start, stop)
+
+    # if gens is empty, annots should be too, double check this
+    if gens.empty and not var_annots.empty:
+        logging.info(
+            "Check that you used the same coordinates for generating the annots file \
+            as are being used here."
+        )
+        exit(1)
+
+    # if no variants annotated, no allele-specific guides possilbe
+    if gens.empty:
+        logging.info(
+            "No hetorozygous variants, thus no allele-specific guides for this locus."
+        )
+        return None
+
+    # output number of heterozygous variants in locus
+    variants = set(gens.pos.tolist())
+    logging.info(
+        "There are "
+        + str(len(variants))
+        + " heterozygous variants in this locus in this genome."
+    )
+
+    grna_df = design_allele_spec_guides(
+        var_annots,
+        chrom,
+        chrstart,
+        start,
+        stop,
+        GUIDE_LENGTHS,
+        get_pam_index(args["<pams_dir>"]),
+        ref_genome,
+        args,
+    )
+    if grna_df.empty:
+        logging.info("No sgRNAs meet the criteria for this locus.")
+        return None
+
+    return add_guide_info(grna_df, args, chrstart)
+
+
+@lru_cache(maxsize=None)
+def read_catalog_info(catalog):
+    """
+    Settings a guide catalog was built with: -c, the guide lengths of each Cas and
+    max_allele_len. Raises ValueError for catalogs without them.
+    """
+    with pd.HDFStore(catalog, mode="r") as store:
+        info = getattr(store.get_storer("all").attrs, "catalog", None)
+    if info is None:
+        raise ValueError(
+            f"{catalog} does not record its build settings, rebuild it with build_guide_catalog.py."
+        )
+    return info
+
+
+def check_catalog(catalog, args):
+    """
+    Raises ValueError if a guide catalog was built with a different -c than args, or lacks
+    any of the requested Cas types and guide lengths.
+    """
+    info = read_catalog_info(catalog)
+    if info["-c"] != bool(args["-c"]):
+        built = "with" if info["-c"] else "without"
+        raise ValueError(
+            f"{catalog} was built {built} -c, so its '-' stranded guides are in the other "
+            "orientation. Run with the same -c or rebuild the catalog."
+        )
+    missing = [
+        f"{cas} {length} bp"
+        for cas in CAS_LIST
+        for length in GUIDE_LENGTHS[cas]
+        if length not in info["guide_lengths"].get(cas, [])
+    ]
+    if missing:
+        raise ValueError(f"{catalog} has no guides for {', '.join(missing)}.")
+
+
+def catalog_guides(args, locus="ignore"):
+    """
+    Look up allele-specific guides for the heterozygous variants in a locus in a guide
+    catalog made by build_guide_catalog.py. Returns None if there are none.
+    """
+    bcf = args["<bcf>"]
+
+    # parse locus
+    if locus == "ignore":
+        chrom, start, stop = parse_locus(args["<locus>"])
+    else:
+        chrom, start, stop = parse_locus(locus)
+
+    chrstart = get_vcf_chrstart(bcf)
+    chrom = norm_chr(chrom, chrstart)
+    gens = get_locus_hets(bcf, chrom, start, stop)
+    if gens.empty:
+        logging.info(
+            "No hetorozygous variants, thus no allele-specific guides for this locus."
+        )
+        return None
+
+    # the catalog keeps the chromosome notation of the annotation file it was built from
+    chrom_names = [chrom.replace("chr", ""), "chr" + chrom.replace("chr", "")]
+    with PROFILER.stage("read_hdf"):
+        catalog = pd.read_hdf(
+            args["--catalog"],
+            where=f"chrom in {chrom_names} & variant_position >= {start} & variant_position <= {stop} "
+            f"& cas_type in {CAS_LIST}",
+        )
+    # keep only the guide lengths requested for each Cas
+    requested = pd.DataFrame(
+        [(cas, length) for cas in CAS_LIST for length in GUIDE_LENGTHS[cas]],
+        columns=["cas_type", "guide_length"],
+    )
+    catalog = catalog.merge(requested, on=["cas_type", "guide_length"])
+    if args["--strict"]:
+        catalog = catalog[catalog["var_type"] != "near_pam"]
+    # design mode only uses PAMs within the locus for guides near a PAM
+    near_pam = catalog["var_type"] == "near_pam"
+    pam_site = np.where(
+        catalog["strand"] == "positive", catalog["stop"] + 1, catalog["start"]
+    )
+    catalog = catalog[~near_pam | ((pam_site >= start) & (pam_site <= stop))]
+    catalog["chrom"] = chrom
+
+    # variants with alleles longer than the catalog's max_allele_len were left out of it
+    max_allele_len = read_catalog_info(args["--catalog"])["max_allele_len"]
+    n_long = (
+        (gens["ref"].str.len() > max_allele_len) | (gens["alt"].str.len() > max_allele_len)
+    ).sum()
+    if n_long:
+        logging.error(
+            f"{n_long} heterozygous variants have alleles longer than the catalog's "
+            f"max_allele_len of {max_allele_len} and get no guides, design without "
+            "--catalog to include them."
+        )
 
-            for pam in lost_pams_for:
-                chrom = chrom.replace("chr", "")
-                pam_site = pam + var - 11
-                ref_allele = ref
-                alt_allele = alt
-                grna_ref_seq, grna_alt_seq = get_alt_seq(
-                    chrom,
-                    pam_site,
-                    var,
-                    ref_allele,
-                    alt_allele,
-                    guide_length,
-                    ref_genome,
-                    var_type="destroys_pam",
-                )
+    gens = gens.rename(index=str, columns={"pos": "variant_position"})
+    out = catalog.merge(
+        gens[["variant_position", "ref", "alt"]],
+        on=["variant_position", "ref", "alt"],
+    )[GUIDE_COLUMNS]
+    logging.info(
+        f"{out.shape[0]} catalog guides for {gens.shape[0]} heterozygous variants."
+    )
+    if out.empty:
+        logging.info("No sgRNAs meet the criteria for this locus.")
+        return None
 
-                chrom = norm_chr(chrom, chrstart)
-                grna_dicts.append(
-                    dict(
-                        zip(
-                            [
-                                "chrom",
-                                "start",
-                                "stop",
-                                "ref",
-                                "alt",
-                                "variant_position_in_guide",
-                                "gRNA_ref",
-                                "gRNA_alt",
-                                "variant_position",
-                                "strand",
-                                "cas_type",
-                            ],
-                            [
-                                str(chrom),
-                                (pam_site - guide_length),
-                                (pam_site),
-                                row["ref"],
-                                row["alt"],
-                                (pam_site + pam_length - var),
-                                grna_ref_seq,
-                                grna_alt_seq,
-                                var,
-                                "positive",
-                                cas,
-                            ],
-                        )
-                    )
-                )
+    return add_guide_info(out, args, chrstart)
 
-            for pam in lost_pams_rev:
-                chrom = chrom.replace("chr", "")
-                pam_site = pam + var - 11
-                ref_allele = ref
-                alt_allele = alt
-                grna_ref_seq, grna_alt_seq = get_alt_seq(
-                    chrom,
-                    pam_site,
-                    var,
-                    ref_allele,
-                    alt_allele,
-                    guide_length,
-                    ref_genome,
-                    strand="negative",
-                    var_type="destroys_pam",
-                )
-                if not args["-c"]:
-                    grna_ref_seq, grna_alt_seq = (
-                        make_rev_comp(grna_ref_seq),
-                        make_rev_comp(grna_alt_seq),
-                    )
 
-                chrom = norm_chr(chrom, chrstart)
-                grna_dicts.append(
-                    dict(
-                        zip(
-                            [
-                                "chrom",
-                                "start",
-                                "stop",
-                                "ref",
-                                "alt",
-                                "variant_position_in_guide",
-                                "gRNA_ref",
-                                "gRNA_alt",
-                                "variant_position",
-                                "strand",
-                                "cas_type",
-                            ],
-                            [
-                                str(chrom),
-                                (pam_site),
-                                (pam_site + guide_length),
-                                ref_allele,
-                                alt_allele,
-                                (var - pam_site + pam_length - 1),
-                                grna_ref_seq,
-                                grna_alt_seq,
-                                var,
-                                "negative",
-                                cas,
-                            ],
-                        )
-                    )
-                )
+@PROFILER.profiled("bcftools")
+def list_bcf_chroms(bcf):
+    """
+    List the chromosomes with records in an indexed VCF/BCF, in index order.
+    """
+    index_stats = subprocess.Popen(
+        f"bcftools index -s {bcf}", shell=True, stdout=subprocess.PIPE
+    ).communicate()[0].decode("utf-8")
+    return [line.split("\t")[0] for line in index_stats.splitlines() if line.strip()]
 
-        # design guides for heterozygous variants that make PAMs
-        for index, row in vars_make_pam.iterrows():
-            var = row["pos"]
-            ref = row["ref"]
-            alt = row["alt"]
 
-            chrom = chrom.replace("chr", "")
-            ref_seq = ref_genome["chr" + str(chrom)][var - 11 : var + 10]
+# windows are read ahead of the window being designed, so reads are not attributed to a locus
+@PROFILER.profiled("read_windows", per_locus=False)
+def iter_het_windows(bcf, chrom, window_size, chunksize=100000):
+    """
+    Stream heterozygous genotypes for one chromosome from bcftools and yield them one
+    window at a time as ((window_start, window_end), genotypes), so that only a single
+    window of genotypes is held in memory.
+    """
+    bcl_query = subprocess.Popen(
+        f'bcftools view -g ^miss -g het -r {chrom} {bcf} -Ou | bcftools query -f"%CHROM\t%POS\t%REF\t[%TGT\t]\n"',
+        shell=True,
+        stdout=subprocess.PIPE,
+    )
 
-            if len(ref) > len(alt):  # handles deletions
-                alt_seq = (
-                    ref_genome["chr" + str(chrom)][var - 11 : var - 1]
-                    + alt
-                    + ref_genome["chr" + str(chrom)][
-                        var
-                        + len(ref)
-                        + len(alt)
-                        - 2 : var
-                        + len(ref)
-                        + len(alt)
-                        - 2
-                        + 10
-                    ]
-                )
-            else:
-                alt_seq = (
-                    ref_genome["chr" + str(chrom)][var - 11 : var - 1]
-                    + alt
-                    + ref_genome["chr" + str(chrom)][
-                        var + len(alt) - 1 : var + len(alt) - 1 + 10
-                    ]
-                )
+    def window_bounds(window):
+        return window * window_size + 1, (window + 1) * window_size
 
-            ref_pams_for, ref_pams_rev = find_spec_pams(
-                cas_obj, ref_seq, orient=cas_obj.primeness
-            )
-            alt_pams_for, alt_pams_rev = find_spec_pams(
-                cas_obj, alt_seq, orient=cas_obj.primeness
-            )
+    try:
+        reader = pd.read_csv(
+            bcl_query.stdout,
+            sep="\t",
+            header=None,
+            usecols=[0, 1, 2, 3],
+            dtype={0: str},
+            chunksize=chunksize,
+        )
+        buffered = []
+        buffered_window = None
+        for chunk in reader:
+            chunk.columns = ["chrom", "pos", "ref", "translated_genotype"]
+            windows = (chunk["pos"].values - 1) // window_size
+            for window in np.unique(windows):
+                if buffered_window is not None and window != buffered_window:
+                    yield window_bounds(buffered_window), pd.concat(buffered)
+                    buffered = []
+                buffered_window = window
+                buffered.append(chunk[windows == window])
+        if buffered:
+            yield window_bounds(buffered_window), pd.concat(buffered)
+    except pd.io.common.EmptyDataError:
+        pass
+    finally:
+        bcl_query.stdout.close()
+        bcl_query.wait()
 
-            made_pams_for = list(set(alt_pams_for).difference(set(ref_pams_for)))
-            made_pams_rev = list(set(alt_pams_rev).difference(set(ref_pams_rev)))
 
-            for pam in made_pams_for:
-                chrom = chrom.replace("chr", "")
-                pam_site = var - 11 + pam
-                ref_allele = ref
-                alt_allele = alt
-                grna_ref_seq, grna_alt_seq = get_alt_seq(
-                    chrom,
-                    pam_site,
-                    var,
-                    ref_allele,
-                    alt_allele,
-                    guide_length,
-                    ref_genome,
-                    var_type="makes_pam",
-                )
+def read_checkpoint(checkpoint_fname):
+    """
+    Read the windows completed by an earlier --genome run. Returns the set of completed
+    (chrom, window_start), the output file size after the last completed window, and
+    the next free guide id.
+    """
+    done = set()
+    out_bytes, next_id = 0, 0
+    if os.path.exists(checkpoint_fname):
+        for line in open(checkpoint_fname):
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 6:  # partially written line from an interrupted run
+                continue
+            chrom, win_start, win_end, n_guides, out_bytes, next_id = fields
+            done.add((chrom, int(win_start)))
+        out_bytes, next_id = int(out_bytes), int(next_id)
+    return done, out_bytes, next_id
 
-                chrom = norm_chr(chrom, chrstart)
-                grna_dicts.append(
-                    dict(
-                        zip(
-                            [
-                                "chrom",
-                                "start",
-                                "stop",
-                                "ref",
-                                "alt",
-                                "variant_position_in_guide",
-                                "gRNA_ref",
-                                "gRNA_alt",
-                                "variant_position",
-                                "strand",
-                                "cas_type",
-                            ],
-                            [
-                                str(chrom),
-                                (pam_site - guide_length),
-                                (pam_site),
-                                row["ref"],
-                                row["alt"],
-                                (pam_site + pam_length - var),
-                                grna_ref_seq,
-                                grna_alt_seq,
-                                var,
-                                "positive",
-                                cas,
-                            ],
-                        )
-                    )
-                )
 
-            for pam in made_pams_rev:
-                chrom = chrom.replace("chr", "")
-                pam_site = var - 11 + pam
-                ref_allele = ref
-                alt_allele = alt
-                grna_ref_seq, grna_alt_seq = get_alt_seq(
+def genome_guides(args):
+    """
+    Design allele-specific guides for every heterozygous variant in the genome. Each
+    chromosome is walked in windows of --window_size bp; each window's guides are appended
+    to the output and recorded in a checkpoint file, so an interrupted run resumes after
+    the last completed window.
+    """
+    bcf = args["<bcf>"]
+    window_size = int(args["--window_size"])
+    chrstart = get_vcf_chrstart(bcf)
+    pam_index = get_pam_index(args["<pams_dir>"])
+    ref_genome = load_ref_genome(args["<ref_fasta>"])
+
+    out_fname = args["<out>"] + ".tsv"
+    checkpoint_fname = args["<out>"] + ".checkpoint"
+    done, out_bytes, next_id = read_checkpoint(checkpoint_fname)
+    if done:
+        logging.info(f"Resuming after {len(done)} completed windows.")
+        # discard anything written after the last completed window
+        with open(out_fname, "a+") as f:
+            f.truncate(out_bytes)
+    else:
+        open(out_fname, "w").close()
+        open(checkpoint_fname, "w").close()
+
+    for chrom in list_bcf_chroms(bcf):
+        logging.info(f"Designing allele-specific guides on {chrom}.")
+        for (win_start, win_end), gens in iter_het_windows(bcf, chrom, window_size):
+            with PROFILER.locus(f"{chrom}:{win_start}-{win_end}"):
+                if (chrom, win_start) in done:
+                    continue
+                gens = het_alts(gens)
+                var_annots = load_var_annots(
+                    args["<annots_file>"], chrom, win_start, win_end
+                ).merge(gens[["pos", "ref", "alt"]], on=["pos", "ref", "alt"])
+                out = design_allele_spec_guides(
+                    var_annots,
                     chrom,
-                    pam_site,
-                    var,
-                    ref_allele,
-                    alt_allele,
-                    guide_length,
+                    chrstart,
+                    1,
+                    np.iinfo(np.int64).max,
+                    GUIDE_LENGTHS,
+                    pam_index,
                     ref_genome,
-                    strand="negative",
-                    var_type="makes_pam",
+                    args,
                 )
-
-                chrom = norm_chr(chrom, chrstart)
-                grna_dicts.append(
-                    dict(
-                        zip(
-                            [
-                                "chrom",
-                                "start",
-                                "stop",
-                                "ref",
-                                "alt",
-                                "variant_position_in_guide",
-                                "gRNA_ref",
-                                "gRNA_alt",
-                                "variant_position",
-                                "strand",
-                                "cas_type",
-                            ],
-                            [
-                                str(chrom),
-                                (pam_site),
-                                (pam_site + guide_length),
-                                ref_allele,
-                                alt_allele,
-                                (var - pam_site + pam_length - 1),
-                                grna_ref_seq,
-                                grna_alt_seq,
-                                var,
-                                "negative",
-                                cas,
-                            ],
-                        )
+                if not out.empty:
+                    out = add_guide_info(out, args, chrstart, win_start, win_end)
+                    out = out.query("variant_position_in_guide > -1")
+                    out = filter_out_N_in_PAM(out, CAS_LIST)
+                if not out.empty:
+                    out = filter_seed_occurrences(out, args)
+                    out = add_crispor_scores(out, args)
+                if not out.empty:
+                    out.index = np.arange(next_id, next_id + out.shape[0])
+                    out = format_guides(out, args)
+                    with PROFILER.stage("write_output"), open(out_fname, "a") as f:
+                        out.to_csv(f, sep="\t", index=False, header=(out_bytes == 0))
+                    next_id += out.shape[0]
+                    out_bytes = os.path.getsize(out_fname)
+                # record the window only once its guides are safely on disk
+                with open(checkpoint_fname, "a") as f:
+                    f.write(
+                        f"{chrom}\t{win_start}\t{win_end}\t{out.shape[0]}\t{out_bytes}\t{next_id}\n"
                     )
+                    f.flush()
+                    os.fsync(f.fileno())
+                logging.info(
+                    f"{chrom}:{win_start}-{win_end} done, {gens.shape[0]} het variants, "
+                    f"{out.shape[0]} guides, {next_id} guides total."
                 )
 
-    grna_df = pd.DataFrame(grna_dicts)
-    if grna_df.empty:
-        logging.info('No sgRNAs meet the criteria for this locus, exiting.')
-        exit()
 
-    # add specificity scores if specified
-    if args["--crispor"]:
-        out = get_crispor_scores(grna_df, args["<out>"], args["--crispor"])
-    else:
-        out = grna_df
-    # get rsID and AF info if provided
-    if args["<gene_vars>"]:
-        gene_vars = pd.read_hdf(args["<gene_vars>"])
-        gene_vars["chrom"] = [
-            norm_chr(chrom, chrstart) for chrom in gene_vars["chrom"].tolist()
+@PROFILER.profiled("bcftools")
+def get_cohort_hets(bcf, chrom, start, stop):
+    """
+    Get heterozygous genotypes for every sample in the BCF/VCF over chrom:start-stop.
+    Returns the unique het variants (chrom, pos, ref, alt) across the cohort, and a
+    long-format table of (sample, pos, ref, alt) with one row per het genotype.
+    """
+    samples = (
+        subprocess.Popen(f"bcftools query -l {bcf}", shell=True, stdout=subprocess.PIPE)
+        .communicate()[0]
+        .decode("utf-8")
+        .split()
+    )
+    # keeps sites where at least one sample is heterozygous
+    bcl_query = subprocess.Popen(
+        f'bcftools view -g het -r {chrom}:{start}-{stop} {bcf} -Ou | bcftools query -f"%CHROM\t%POS\t%REF\t%ALT[\t%GT]\n"',
+        shell=True,
+        stdout=subprocess.PIPE,
+    )
+    try:
+        gens = pd.read_csv(
+            StringIO(bcl_query.communicate()[0].decode("utf-8")),
+            sep="\t",
+            header=None,
+            names=["chrom", "pos", "ref", "alts"] + samples,
+            dtype=str,
+        )
+    except pd.io.common.EmptyDataError:
+        gens = pd.DataFrame()
+    if gens.empty:
+        return pd.DataFrame(columns=["chrom", "pos", "ref", "alt"]), pd.DataFrame(
+            columns=["sample", "pos", "ref", "alt"]
+        )
+
+    gens["pos"] = gens["pos"].astype(int)
+    alleles = gens["ref"] + "," + gens["alts"]
+    alleles = alleles.str.split(",")
+    sample_hets = []
+    for sample in samples:
+        gts = gens[sample].str.split("/|\|", n=1, expand=True)
+        if gts.shape[1] < 2:  # haploid calls are never heterozygous
+            continue
+        is_het = (gts[0] != gts[1]) & (gts[0] != ".") & (gts[1] != ".")
+        if not is_het.any():
+            continue
+        # the alternate allele is whichever allele is not the reference, as for a single genome
+        alt_idx = np.where(gts[0][is_het] != "0", gts[0][is_het], gts[1][is_het])
+        hets = gens.loc[is_het, ["pos", "ref"]]
+        hets["alt"] = [
+            site_alleles[int(idx)]
+            for site_alleles, idx in zip(alleles[is_het].tolist(), alt_idx)
         ]
-        gene_vars = gene_vars.rename(index=str, columns={"pos": "variant_position"})
-        out = out.merge(
-            gene_vars, how="left", on=["chrom", "variant_position", "ref", "alt"]
+        hets["sample"] = sample
+        sample_hets.append(hets)
+    if not sample_hets:
+        return pd.DataFrame(columns=["chrom", "pos", "ref", "alt"]), pd.DataFrame(
+            columns=["sample", "pos", "ref", "alt"]
         )
+    sample_hets = pd.concat(sample_hets, ignore_index=True)
+    variants = sample_hets[["pos", "ref", "alt"]].drop_duplicates()
+    variants.insert(0, "chrom", chrom)
+    return variants, sample_hets[["sample", "pos", "ref", "alt"]]
 
-    out = out.drop_duplicates()
-    return out
+
+def cohort_guides(args):
+    """
+    Design allele-specific guides for every sample in the BCF/VCF. Candidate guides are
+    designed once per unique heterozygous variant in the cohort, then each
+    sample's guides are selected by joining against that sample's het genotypes.
+    Saves one output file per sample, <out>_<sample>.tsv.
+    """
+    bcf = args["<bcf>"]
+    chrstart = get_vcf_chrstart(bcf)
+    pam_index = get_pam_index(args["<pams_dir>"])
+    ref_genome = load_ref_genome(args["<ref_fasta>"])
+
+    # regions to evaluate, as (chrom, start, stop, name)
+    if args["--bed"]:
+        regions = pd.read_csv(
+            args["<locus>"],
+            sep="\t",
+            header=None,
+            names=["chrom", "start", "stop", "name"],
+        )
+        regions = list(regions.itertuples(index=False, name=None))
+    else:
+        regions = [parse_locus(args["<locus>"]) + (None,)]
+
+    sample_guides = []
+    for chrom, start, stop, name in regions:
+        with PROFILER.locus(name or f"{chrom}:{start}-{stop}"):
+            chrom = norm_chr(chrom, chrstart)
+            variants, sample_hets = get_cohort_hets(bcf, chrom, start, stop)
+            logging.info(
+                f"{chrom}:{start}-{stop}: {variants.shape[0]} unique heterozygous variants "
+                f"across {sample_hets['sample'].nunique()} samples."
+            )
+            if variants.empty:
+                continue
+            var_annots = load_var_annots(args["<annots_file>"], chrom, start, stop).merge(
+                variants[["pos", "ref", "alt"]], on=["pos", "ref", "alt"]
+            )
+            guides = design_allele_spec_guides(
+                var_annots,
+                chrom,
+                chrstart,
+                start,
+                stop,
+                GUIDE_LENGTHS,
+                pam_index,
+                ref_genome,
+                args,
+            )
+            if guides.empty:
+                continue
+            guides = add_guide_info(guides, args, chrstart)
+            guides = guides.query("variant_position_in_guide > -1")
+            guides = filter_out_N_in_PAM(guides, CAS_LIST)
+            if name is not None:
+                guides["locus"] = name
+
+            # hand each sample the guides for its own heterozygous variants
+            sample_hets = sample_hets.rename(columns={"pos": "variant_position"})
+            per_sample = sample_hets.merge(
+                guides, on=["variant_position", "ref", "alt"], how="inner"
+            )
+            if not per_sample.empty:
+                sample_guides.append(per_sample)
+
+    if not sample_guides:
+        logging.info("No allele-specific sgRNAs for any sample, exiting.")
+        exit()
+    sample_guides = pd.concat(sample_guides, ignore_index=True)
+
+    # guides shared between samples and loci are scored once
+    sample_guides = filter_seed_occurrences(sample_guides, args)
+    sample_guides = add_crispor_scores(sample_guides, args)
+
+    n_samples = 0
+    for sample, out in sample_guides.groupby("sample", sort=False):
+        out = out.drop(columns="sample").reset_index(drop=True)
+        out = format_guides(out, args)
+        save_guides([out], f"{args['<out>']}_{sample}", args)
+        n_samples += 1
+    logging.info(f"Saved guides for {n_samples} samples.")
 
 
 def norm_chr(chrom_str, vcf_chrom):
@@ -953,6 +1287,14 @@ def parse_locus(locus):
     return chrom, start, stop
 
 
+def cas_guide_lengths():
+    """
+    List every (Cas, guide length) pair being designed, in CAS_LIST order.
+    """
+    return [(cas, length) for cas in CAS_LIST for length in GUIDE_LENGTHS[cas]]
+
+
+@PROFILER.profiled("design_guides")
 def simple_guide_design(args, locus="ignore"):
     """
     For the case when the individual has no variants in the locus, simply design guides based on reference sequence.
@@ -965,25 +1307,24 @@ def simple_guide_design(args, locus="ignore"):
         chrom, start, stop = parse_locus(locus)
 
     # get location of annotated PAMs in reference genome
-    pams_dir = args["<pams_dir>"]
-
-    for cas in CAS_LIST:
-        # get cas info
-        cas_obj = cas_object.get_cas_enzyme(cas)
-
-        guide_length = int(args["<guide_length>"])
-        ref_genome = Fasta(args["<ref_fasta>"], as_raw=True)
+    pam_index = get_pam_index(args["<pams_dir>"])
+    chrom = chrom.replace('chr','')
 
-        # get PAM locations for this variety of Cas
-        chrom = chrom.replace('chr','')
-        pam_for_pos = np.load(
-            os.path.join(pams_dir, f"chr{chrom}_{cas}_pam_sites_for.npy")
-        ).tolist()
-        pam_for_pos = list(filter(lambda x: x >= start and x <= stop, pam_for_pos))
-        pam_rev_pos = np.load(
-            os.path.join(pams_dir, f"chr{chrom}_{cas}_pam_sites_rev.npy")
-        ).tolist()
-        pam_rev_pos = list(filter(lambda x: x >= start and x <= stop, pam_rev_pos))
+    out_list = []
+    for cas, guide_length in cas_guide_lengths():
+        # get PAM locations for this variety of Cas, with their guides if there is a prebuilt library
+        if guide_length <= seq_pack.MAX_PACKED_LEN and get_ref_guide_library(
+            args["<pams_dir>"], guide_length
+        ).available(chrom, cas):
+            library = get_ref_guide_library(args["<pams_dir>"], guide_length)
+            pam_for_pos, grnas_for = library.in_range(chrom, cas, "for", start, stop)
+            pam_rev_pos, grnas_rev = library.in_range(chrom, cas, "rev", start, stop)
+            pam_for_pos, pam_rev_pos = pam_for_pos.tolist(), pam_rev_pos.tolist()
+            ref_grnas = grnas_for + grnas_rev
+        else:
+            pam_for_pos = pam_index.in_range(chrom, cas, "for", start, stop).tolist()
+            pam_rev_pos = pam_index.in_range(chrom, cas, "rev", start, stop).tolist()
+            ref_grnas = None
 
         # put together data for outputted dataframe
 
@@ -1007,15 +1348,29 @@ def simple_guide_design(args, locus="ignore"):
         guides_out["stop"] = pos_stops + neg_stops
         guides_out["ref"] = np.nan
         guides_out["alt"] = np.nan
-        guides_out["gRNA_ref"] = guides_out.apply(
-            lambda row: simple_grnas(row, ref_genome, guide_length, chrom), axis=1
-        )
-        guides_out["gRNA_alt"] = "C" * 20
+        if ref_grnas is not None:
+            guides_out["gRNA_ref"] = ref_grnas
+        elif not guides_out.empty:
+            ref_genome = load_ref_genome(args["<ref_fasta>"])
+            if isinstance(ref_genome, PackedGenome):
+                seq_bytes = ref_genome.fetch_many(
+                    "chr" + str(chrom), guides_out["start"].values, guide_length
+                )
+                guides_out["gRNA_ref"] = seq_pack.decode_guides(seq_bytes)
+            else:
+                guides_out["gRNA_ref"] = guides_out.apply(
+                    lambda row: simple_grnas(row, ref_genome, guide_length, chrom), axis=1
+                )
+        else:
+            guides_out["gRNA_ref"] = []
+        guides_out["gRNA_alt"] = "C" * guide_length
         guides_out["cas_type"] = cas
+        guides_out["guide_length"] = guide_length
         guides_out["chrom"] = chrom
         guides_out['variant_position_in_guide'] = np.nan
         guides_out['variant_position'] = np.nan
-        return guides_out
+        out_list.append(guides_out)
+    return pd.concat(out_list, ignore_index=True)
 
 
 def simple_grnas(row, ref_genome, guide_length, chrom):
@@ -1035,6 +1390,7 @@ def simple_grnas(row, ref_genome, guide_length, chrom):
     return ref_seq.upper()
 
 
+@PROFILER.profiled("design_guides")
 def get_guides(args, locus="ignore"):
     """
     Outputs dataframe with individual-specific (not allele-specific) guides.
@@ -1047,9 +1403,10 @@ def get_guides(args, locus="ignore"):
         chrom, start, stop = parse_locus(locus)
 
     # load variant annotations
-    var_annots = pd.read_hdf(
-        args["<annots_file>"], where="chrom == chrom and pos >= start and pos <= stop"
-    )
+    with PROFILER.stage("read_hdf"):
+        var_annots = pd.read_hdf(
+            args["<annots_file>"], where="chrom == chrom and pos >= start and pos <= stop"
+        )
     # load genotypes
     bcf = args["<bcf>"]
     # eliminates rows with missing genotypes
@@ -1066,14 +1423,15 @@ def get_guides(args, locus="ignore"):
         "gt",
         "genotype",
     ]
-    bcl_view = subprocess.Popen(bcl_v, shell=True, stdout=subprocess.PIPE)
-    gens = pd.read_csv(
-        StringIO(bcl_view.communicate()[0].decode("utf-8")),
-        sep="\t",
-        header=None,
-        names=col_names,
-        usecols=["chrom", "pos", "ref", "alt", "genotype"],
-    )
+    with PROFILER.stage("bcftools"):
+        bcl_view = subprocess.Popen(bcl_v, shell=True, stdout=subprocess.PIPE)
+        gens = pd.read_csv(
+            StringIO(bcl_view.communicate()[0].decode("utf-8")),
+            sep="\t",
+            header=None,
+            names=col_names,
+            usecols=["chrom", "pos", "ref", "alt", "genotype"],
+        )
 
     # remove big indels
     gens, var_annots = verify_hdf_files(
@@ -1093,19 +1451,18 @@ def get_guides(args, locus="ignore"):
             out = out[["chrom","start","stop","ref","alt",
 			"variant_position_in_guide",
 			"gRNAs","variant_position","strand",
-			"cas_type"]]
+			"cas_type","guide_length"]]
         else:
             out = simple_guide_design(args, locus)
             out['gRNAs'] = out[['gRNA_ref']]
             out = out[["chrom","start","stop","ref","alt",
 			"variant_position_in_guide",
 			"gRNAs","variant_position","strand",
-			"cas_type"]]
-        # add specificity scores if specified
+			"cas_type","guide_length"]]
+        # specificity scores are added for the whole run in main
         if args["--crispor"]:
             out['gRNA_alt'] = out['gRNAs']
             out['gRNA_ref'] = out['gRNAs']
-            out = get_crispor_scores(out, args["<out>"], args["--crispor"])
         return out
 
     # determine which variants are het and which aren't
@@ -1141,30 +1498,24 @@ def get_guides(args, locus="ignore"):
     variants_positions = []
     strands = []
     pam_pos = []
+    guide_lengths = []
 
     # get some relevant variables
-    pams_dir = args["<pams_dir>"]
-    guide_length = int(args["<guide_length>"])
-    ref_genome = Fasta(args["<ref_fasta>"], as_raw=True)
+    pam_index = get_pam_index(args["<pams_dir>"])
+    ref_genome = load_ref_genome(args["<ref_fasta>"])
 
-    # get sgRNAs for each Cas variety
-    for cas in CAS_LIST:
+    # get sgRNAs for each Cas variety and guide length
+    for cas, guide_length in cas_guide_lengths():
+        n_guides_before = len(cas_types)
         # load Cas data
         cas_obj = cas_object.get_cas_enzyme(cas)
-        guide_length = int(args["<guide_length>"])
 
         # get annotated PAMs on + strand in reference genome
         chrom = chrom.replace('chr','')
-        pam_for_pos = np.load(
-            os.path.join(pams_dir, f"chr{chrom}_{cas}_pam_sites_for.npy")
-        ).tolist()
-        pam_for_pos = list(filter(lambda x: x >= start and x <= stop, pam_for_pos))
+        pam_for_pos = pam_index.in_range(chrom, cas, "for", start, stop).tolist()
 
         # get annotated PAMs on - strand in reference genome
-        pam_rev_pos = np.load(
-            os.path.join(pams_dir, f"chr{chrom}_{cas}_pam_sites_rev.npy")
-        ).tolist()
-        pam_rev_pos = list(filter(lambda x: x >= start and x <= stop, pam_rev_pos))
+        pam_rev_pos = pam_index.in_range(chrom, cas, "rev", start, stop).tolist()
         logging.info(f"Currently evaluating {cas}.")
 
         # get length of PAM
@@ -1347,10 +1698,10 @@ def get_guides(args, locus="ignore"):
                         make_rev_comp(grna_ref_seq),
                         make_rev_comp(grna_alt_seq),
                     )
-                start = pam_site + 1
-                starts.append(start)
-                stop = pam_site + guide_length + 1
-                stops.append(stop)
+                guide_start = pam_site + 1
+                starts.append(guide_start)
+                guide_stop = pam_site + guide_length + 1
+                stops.append(guide_stop)
                 refs.append(ref_allele)
                 alts.append(alt_allele)
                 grnas.append(grna_alt_seq.upper())
@@ -1431,6 +1782,8 @@ def get_guides(args, locus="ignore"):
                 cas_types.append(cas)
                 variants_positions.append(np.nan)
 
+        guide_lengths.extend([guide_length] * (len(cas_types) - n_guides_before))
+
     # get output DF
     out = pd.DataFrame(
         {
@@ -1444,6 +1797,7 @@ def get_guides(args, locus="ignore"):
             "variant_position": variants_positions,
             "strand": strands,
             "cas_type": cas_types,
+            "guide_length": guide_lengths,
         }
     )
     # out['variant_position'] = out['variant_position'].astype(int)
@@ -1451,15 +1805,15 @@ def get_guides(args, locus="ignore"):
     out['alt'] = out['alt'].astype(object)
     # out["gRNA_alt"] = ["C" * 20] * out.shape[0]
 
-    # add specificity scores if specified
+    # specificity scores are added for the whole run in main
     if args["--crispor"]:
         out['gRNA_alt'] = out['gRNAs']
         out['gRNA_ref'] = out['gRNAs']
-        out = get_crispor_scores(out, args["<out>"], args["--crispor"])
 
     # get rsID and AF info if provided
     if args["<gene_vars>"]:
-        gene_vars = pd.read_hdf(args["<gene_vars>"])
+        with PROFILER.stage("read_hdf"):
+            gene_vars = pd.read_hdf(args["<gene_vars>"])
         gene_vars['chrom'] = gene_vars['chrom'].apply(norm_chr, args=(chrom.startswith('chr'),))
         gene_vars["variant_position"] = gene_vars["pos"]
         out = out.merge(
@@ -1472,111 +1826,270 @@ def get_guides(args, locus="ignore"):
 
 
 def multilocus_guides(args):
+    """
+    Yields the guides of each locus in the BED file given as <locus>.
+    """
     # if the user initiated the analysis correctly, load the regions to be analyzed
     regions = pd.read_csv(
         args["<locus>"], sep="\t", header=None, names=["chrom", "start", "stop", "name"]
     )
 
-    # set this up to catch sgRNA dataframe outputs
-    out_list = []
-
     # initiates multi-locus personalized guide design
     if args["--hom"]:
         logging.info("Finding personalized (non-allele-specific) guides.")
         # figure out annotation of VCF/BCF chromosome (i.e. starts with 'chr' or not)
-        vcf_chrom = str(
-            subprocess.Popen(
-                f'bcftools view -H {args["<bcf>"]} | cut -f1 | head -1',
-                shell=True,
-                stdout=subprocess.PIPE,
-            ).communicate()[0].decode('utf-8')
-        )
-
-        # See if chrom contains chr
-        if vcf_chrom.startswith("chr"):
-            chrstart = True
-        else:
-            chrstart = False
+        chrstart = get_vcf_chrstart(args["<bcf>"])
 
         # correct the notation in the inputted file to match the VCF/BCF chromosome notation
         regions["chrom"] = [
             norm_chr(chrom, chrstart) for chrom in regions["chrom"].tolist()
         ]
         for index, row in regions.iterrows():
-            chrom = row["chrom"]
-            start = row["start"]
-            stop = row["stop"]
-            guides_df = get_guides(args, f"{chrom}:{start}-{stop}")
-            guides_df["locus"] = row["name"]
-            out_list.append(guides_df)
+            with PROFILER.locus(row["name"]):
+                chrom = row["chrom"]
+                start = row["start"]
+                stop = row["stop"]
+                guides_df = get_guides(args, f"{chrom}:{start}-{stop}")
+                guides_df["locus"] = row["name"]
+            yield guides_df
     # initiates design of reference guides for multi-locus process
     elif args["--ref_guides"]:
         logging.info("Finding reference guides.")
         for index, row in regions.iterrows():
-            chrom = row["chrom"]
-            start = row["start"]
-            stop = row["stop"]
-            out = simple_guide_design(args, f"{chrom}:{start}-{stop}")
-            out["locus"] = row["name"]
-            if args["--crispor"]:
-                # out['gRNA_alt'] = out['gRNAs']
-                # out['gRNA_ref'] = out['gRNAs']
-                out = get_crispor_scores(out, args["<out>"], args["--crispor"])
-            out_list.append(out)
+            with PROFILER.locus(row["name"]):
+                chrom = row["chrom"]
+                start = row["start"]
+                stop = row["stop"]
+                out = simple_guide_design(args, f"{chrom}:{start}-{stop}")
+                out["locus"] = row["name"]
+            yield out
     # initiates design of allele-specific guides for multi-locus process
     else:
         logging.info("Finding allele-specific guides.")
         # figure out annotation of VCF/BCF chromosome (i.e. starts with 'chr' or not)
-        vcf_chrom = str(
-            subprocess.Popen(
-                f'bcftools view -H {args["<bcf>"]} | cut -f1 | head -1',
-                shell=True,
-                stdout=subprocess.PIPE,
-            ).communicate()[0].decode('utf-8').strip()
-        )
-
-        # See if chrom contains chr
-        chrstart = vcf_chrom.startswith("chr")
+        chrstart = get_vcf_chrstart(args["<bcf>"])
 
         # correct the notation in the inputted file to match the VCF/BCF chromosome notation
         regions["chrom"] = [
             norm_chr(chrom, chrstart) for chrom in regions["chrom"].tolist()
         ]
         for index, row in regions.iterrows():
-            logging.info(row['name'])
-            chrom = row["chrom"]
-            start = row["start"]
-            stop = row["stop"]
-            guides_df = get_allele_spec_guides(
-                args, locus=f"{chrom}:{start}-{stop}"
-            )
+            with PROFILER.locus(row["name"]):
+                logging.info(row['name'])
+                chrom = row["chrom"]
+                start = row["start"]
+                stop = row["stop"]
+                if args["--catalog"]:
+                    guides_df = catalog_guides(args, locus=f"{chrom}:{start}-{stop}")
+                else:
+                    guides_df = get_allele_spec_guides(
+                        args, locus=f"{chrom}:{start}-{stop}"
+                    )
+                if guides_df is not None:
+                    guides_df["locus"] = row["name"]
             if guides_df is not None:
-                guides_df["locus"] = row["name"]
-                out_list.append(guides_df)
-            else:
-                continue
-    # assembles full output dataframe for all loci evaluated
-    out = pd.concat(out_list)
-    # out = pd.concat(list(filter(None,out_list)))
+                yield guides_df
+
+
+def chunk_guides(frames, chunk_guides=OUTPUT_CHUNK_GUIDES):
+    """
+    Concatenates the guide tables of consecutive loci into chunks of at least chunk_guides
+    guides (the last one may be smaller), so output is filtered, scored and written a
+    chunk at a time.
+    """
+    chunk = []
+    n_guides = 0
+    for df in frames:
+        chunk.append(df)
+        n_guides += df.shape[0]
+        if n_guides >= chunk_guides:
+            yield pd.concat(chunk)
+            chunk = []
+            n_guides = 0
+    if chunk:
+        yield pd.concat(chunk)
+
+
+@lru_cache(maxsize=None)
+def get_seed_index(seed_index_file):
+    return SeedIndex(seed_index_file)
+
+
+def ref_oriented_guides(out, args):
+    """
+    Whether each guide is for a '-' strand PAM but given in reference orientation: all of them
+    with -c or for reference and non-allele-specific guides (only the few --hom guides for made
+    PAMs are reverse complemented, and cannot be told apart), and allele-specific guides for
+    PAMs made by the variant, recognised by their reference guide being a placeholder.
+    """
+    negative = (out["strand"] == "negative").values
+    if args["-c"] or args.get("--ref_guides") or args.get("--hom"):
+        return negative
+    if "gRNA_ref" not in out.columns:
+        return np.zeros(out.shape[0], dtype=bool)
+    makes_pam = out["gRNA_ref"].astype(str).map(is_placeholder_guide).values
+    return negative & makes_pam
+
+
+@PROFILER.profiled("seed_filter")
+def filter_seed_occurrences(out, args):
+    """
+    Drop guides whose PAM-proximal seed occurs more than --max_seed_occ times in the reference
+    genome, according to the --seed_index. Rows are dropped if any of their guides is too repetitive.
+    """
+    if not args.get("--seed_index") or out.empty:
+        return out
+    seed_index = get_seed_index(args["--seed_index"])
+    max_occ = int(args["--max_seed_occ"])
+
+    # the seed is at the 3' end of guides with a 3' PAM; guides for '-' strand PAMs that are
+    # given in reference orientation have their seed at the other end
+    cas_enzymes = cas_object.get_cas_enzymes(out["cas_type"].unique())
+    pam_3prime = out["cas_type"].map(
+        {cas: cas_obj.primeness == "3'" for cas, cas_obj in cas_enzymes.items()}
+    ).values
+    pam_3prime = pam_3prime != ref_oriented_guides(out, args)
+
+    too_repetitive = np.zeros(out.shape[0], dtype=bool)
+    for col in ("gRNA_ref", "gRNA_alt", "gRNAs"):
+        if col not in out.columns:
+            continue
+        guides = out[col].astype(str)
+        seeds = np.where(
+            pam_3prime, guides.str[-seed_index.k :], guides.str[: seed_index.k]
+        )
+        seed_counts = seed_index.seed_counts(seeds)
+        seed_counts[guides.map(is_placeholder_guide).values] = 0
+        too_repetitive |= seed_counts > max_occ
+    logging.info(
+        f"Dropping {too_repetitive.sum()} guides with a seed occurring more than {max_occ} times."
+    )
+    return out[~too_repetitive]
+
+
+@PROFILER.profiled("crispor")
+def add_crispor_scores(out, args):
+    """
+    Add CRISPOR scores to a run's guides (all of them, or a chunk of a multi-locus run) if
+    requested, in a single scoring batch.
+    """
+    if not args["--crispor"]:
+        return out
+    return get_crispor_scores(
+        out,
+        args["<out>"],
+        args["--crispor"],
+        open_score_cache(args),
+        int(args["--crispor_jobs"]),
+    )
+
+
+@PROFILER.profiled("format")
+def format_guides(out, args):
+    """
+    Assign each sgRNA its identifier and apply the -r and -d output options.
+    """
+    # assign unique identifier to each sgRNA
+    out["id"] = out.index.astype(str)
+    out["guide_id"] = out["cas_type"] + "_" + out["id"]
 
+    for col in [col for col in ["gRNA_ref", "gRNA_alt"] if col in out.columns]:
+        # dummy guides are all C or all G of the guide's length
+        if args["-d"]:
+            dummy = out[col].map(is_placeholder_guide) & (
+                out[col].str.len() == out["guide_length"]
+            )
+            out.loc[dummy, col] = [
+                "-" * length for length in out.loc[dummy, "guide_length"]
+            ]
+        # convert to RNA
+        if args["-r"]:
+            out[col] = out[col].str.replace("T", "U")
     return out
 
 
+def finish_guides(chunks, args):
+    """
+    Drops guides with repetitive seeds from each chunk of guides, then scores and formats it.
+    """
+    for out in chunks:
+        out = filter_seed_occurrences(out, args)
+        if not out.empty:
+            out = add_crispor_scores(out, args)
+        yield format_guides(out, args)
+
+
+def save_guides(chunks, prefix, args):
+    """
+    Write guide tables, one after another, to prefix in the format chosen with --out_format.
+    """
+    with TableWriter(
+        prefix,
+        args["--out_format"],
+        args,
+        os.path.basename(__file__),
+        __version__,
+        "gen_sgRNAs",
+    ) as writer:
+        for out in chunks:
+            with PROFILER.stage("write_output"):
+                writer.write(out)
+
+
 def main(args):
 
     # make sure user has a supported version of bcftools available
     check_bcftools()
 
     # assemble list of Cas enzymes that will be evaluated
-    global CAS_LIST
+    global CAS_LIST, GUIDE_LENGTHS
     CAS_LIST = args["<cas_types>"].split(",")
 
+    # guide lengths are given in the order of cas_types, so parse them before validation reorders CAS_LIST
+    try:
+        GUIDE_LENGTHS = cas_object.get_guide_lengths(CAS_LIST, args["<guide_length>"])
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
+
     CAS_LIST, not_in_both = cas_object.validate_cas_list(CAS_LIST)
 
     for c in not_in_both:
         logging.info(f"{c} not in CAS_LIST.txt, skipping.")
     logging.info(args)
 
+    if args["--catalog"]:
+        try:
+            check_catalog(args["--catalog"], args)
+        except ValueError as e:
+            logging.error(f"Error: {e} Exiting.")
+            exit(1)
+
+    if args["--crispor"] and int(args["--crispor_jobs"]) < 1:
+        logging.error("Error: --crispor_jobs must be at least 1. Exiting.")
+        exit(1)
+
+    if not args["--genome"]:
+        try:
+            check_out_format(args["--out_format"])
+        except ValueError as e:
+            logging.error(f"Error: {e} Exiting.")
+            exit(1)
+
+    # genome-wide allele-specific guide design writes its output window by window
+    if args["--genome"]:
+        logging.info("Finding allele-specific guides genome-wide.")
+        genome_guides(args)
+        logging.info("Done.")
+        return
+
+    # cohort mode writes one output file per sample
+    if args["--cohort"]:
+        logging.info("Finding allele-specific guides for every sample.")
+        cohort_guides(args)
+        logging.info("Done.")
+        return
+
     # determine whether running as multi-locus
     if args["--bed"]:
         logging.info("Running as multi-locus, assumes BED file given.")
@@ -1586,37 +2099,30 @@ def main(args):
             )
             exit(1)
         else:
-            out = multilocus_guides(args)
+            chunks = chunk_guides(multilocus_guides(args))
             if not args["--ref_guides"]:
-                out = filter_out_N_in_PAM(out, CAS_LIST)
+                chunks = (filter_out_N_in_PAM(out, CAS_LIST) for out in chunks)
 
     # initiates personalized guide design for single locus
     elif args["--hom"]:
         logging.info("Finding non-allele-specific guides.")
         out = get_guides(args)
-        out = filter_out_N_in_PAM(out, CAS_LIST)
+        chunks = [filter_out_N_in_PAM(out, CAS_LIST)]
     # initiates allele-specific, personalized guide design for single locus
     else:
         logging.info("Finding allele-specific guides.")
-        out = get_allele_spec_guides(args).query('variant_position_in_guide > -1')
-        out = filter_out_N_in_PAM(out, CAS_LIST)
-
-    # assign unique identifier to each sgRNA
-    out["id"] = out.index.astype(str)
-    out["guide_id"] = out["cas_type"] + "_" + out["id"]
-
-    # convert to RNA
-    if args["-r"]:
-        out["gRNA_ref"] = out["gRNA_ref"].map(lambda x: x.replace("T", "U"))
-        out["gRNA_alt"] = out["gRNA_alt"].map(lambda x: x.replace("T", "U"))
-
-    if args["-d"]:
-        replace_dummy = {"C" * 20: "-" * 20, "G" * 20: "-" * 20}
-        out["gRNA_ref"] = out["gRNA_ref"].replace(replace_dummy)
-        out["gRNA_alt"] = out["gRNA_alt"].replace(replace_dummy)
-
-    # saves output
-    out.to_csv(args["<out>"] + ".tsv", sep="\t", index=False)
+        if args["--catalog"]:
+            out = catalog_guides(args)
+        else:
+            out = get_allele_spec_guides(args)
+        if out is None:
+            logging.info("No allele-specific sgRNAs for this locus, exiting.")
+            exit()
+        out = out.query('variant_position_in_guide > -1')
+        chunks = [filter_out_N_in_PAM(out, CAS_LIST)]
+
+    # saves output as each chunk of guides is done
+    save_guides(finish_guides(chunks, args), args["<out>"], args)
     logging.info("Done.")
 
 
@@ -1635,4 +2141,15 @@ if __name__ == "__main__":
             level=logging.ERROR,
             format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
         )
-    main(arguments)
+    if arguments["--profile"]:
+        PROFILER.enable(cprofile=arguments["--cprofile"])
+    # stages of a single-locus run are attributed to that locus, multi-locus runs set their own
+    single_locus = None
+    if arguments["<locus>"] and not arguments["--bed"]:
+        single_locus = arguments["<locus>"]
+    try:
+        with PROFILER.locus(single_locus):
+            main(arguments)
+    finally:
+        if arguments["--profile"]:
+            PROFILER.write(arguments["<out>"], os.path.basename(__file__), __version__, arguments)
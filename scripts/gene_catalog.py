@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+gene_catalog.py compiles a gene annotations file (gene_gene_dat_wsize) into a binary gene
+catalog for ExcisionFinder. Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+The catalog is a directory of .npy arrays: one record per gene (chromosome, transcript and
+coding start and end, exon count), the exon starts and ends of all genes as flat int32 arrays
+with each record's offset into them, the gene symbols, and an open-addressing hash table from
+symbol to record. Genes listed more than once are left out, and named in catalog.json so
+that looking them up fails with the same error as with <gene_dat>. The arrays are
+memory-mapped when read, so opening a catalog takes a few milliseconds whatever its size,
+lookups only touch the pages they need, and processes reading the same catalog share its
+pages. ExcisionFinder.py accepts a catalog wherever it takes <gene_dat>.
+
+Usage:
+    gene_catalog.py [-v] <gene_dat> <out>
+
+Arguments:
+    gene_dat            Gene annotations file (gene_gene_dat_wsize) filepath.
+    out                 Output directory for the catalog.
+Options:
+    -h --help           Show this screen and exit.
+    -v                  Run in verbose mode.
+"""
+from datetime import datetime
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from docopt import docopt
+
+__version__ = "0.0.1"
+
+GENE_DAT_COLUMNS = [
+    "name",
+    "chrom",
+    "txStart",
+    "txEnd",
+    "cdsStart",
+    "cdsEnd",
+    "exonCount",
+    "exonStarts",
+    "exonEnds",
+    "size",
+]
+
+RECORD_FIELDS = ["txStart", "txEnd", "cdsStart", "cdsEnd", "exonCount"]
+
+RECORD_DTYPE = np.dtype(
+    [("chrom", np.int32)]
+    + [(field, np.int32) for field in RECORD_FIELDS]
+    + [("exon_offset", np.int64)]
+)
+
+CATALOG_ARRAYS = ["records", "symbols", "chroms", "exon_starts", "exon_ends", "hash_index"]
+
+# written last, marks a directory as a complete catalog
+CATALOG_INFO = "catalog.json"
+CATALOG_FORMAT = 1
+
+FNV_OFFSET = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+HASH_MASK = (1 << 64) - 1
+
+POSITION_MAX = np.iinfo(np.int32).max
+
+
+def read_gene_dat(gene_dat_path):
+    """
+    Read a gene annotations file, indexed by gene symbol.
+    """
+    return pd.read_csv(gene_dat_path, sep="\t", header=0, names=GENE_DAT_COLUMNS)
+
+
+def parse_positions(positions):
+    """
+    Positions in a comma-separated (and comma-terminated) list, e.g. exonStarts.
+    """
+    return [int(pos) for pos in str(positions).split(",")[:-1]]
+
+
+def symbol_hash(symbol):
+    """
+    64-bit FNV-1a hash of a gene symbol's UTF-8 bytes.
+    """
+    h = FNV_OFFSET
+    for byte in symbol.encode("utf-8"):
+        h = ((h ^ byte) * FNV_PRIME) & HASH_MASK
+    return h
+
+
+def build_hash_index(symbols):
+    """
+    Open-addressing (linear probing) table of record indices, -1 where empty, of a power of
+    two size at least twice the number of symbols.
+    """
+    size = 1
+    while size < 2 * max(len(symbols), 1):
+        size *= 2
+    table = np.full(size, -1, dtype=np.int32)
+    for i, symbol in enumerate(symbols):
+        slot = symbol_hash(symbol) & (size - 1)
+        while table[slot] != -1:
+            slot = (slot + 1) & (size - 1)
+        table[slot] = i
+    return table
+
+
+def is_gene_catalog(path):
+    return os.path.isfile(os.path.join(path, CATALOG_INFO))
+
+
+def build_catalog(gene_dat, out, source=None):
+    """
+    Write a gene catalog of gene annotations (as read by read_gene_dat) to directory out.
+    Genes listed more than once are left out, and recorded as such so that looking them up
+    fails like it does in gene annotations. Raises ValueError for malformed exons or positions
+    beyond int32.
+    """
+    symbols = pd.Index([str(symbol) for symbol in gene_dat.index])
+    counts = symbols.value_counts()
+    duplicated = {symbol: int(n) for symbol, n in counts[counts > 1].sort_index().items()}
+    if duplicated:
+        logging.error(
+            f"{len(duplicated)} genes are listed more than once, leaving them out of the catalog: "
+            f"{', '.join(list(duplicated)[:10])}."
+        )
+        unique = ~symbols.isin(list(duplicated))
+        gene_dat = gene_dat[unique]
+        symbols = symbols[unique]
+    symbols = list(symbols)
+
+    chroms, chrom_codes = np.unique(gene_dat["chrom"].astype(str).values, return_inverse=True)
+    records = np.zeros(len(symbols), dtype=RECORD_DTYPE)
+    records["chrom"] = chrom_codes
+    for field in RECORD_FIELDS:
+        values = gene_dat[field].values.astype(np.int64)
+        if len(values) and (values.min() < 0 or values.max() > POSITION_MAX):
+            raise ValueError(f"{field} values must be 0-{POSITION_MAX}.")
+        records[field] = values
+
+    exon_starts = []
+    exon_ends = []
+    offset = 0
+    for i, (symbol, starts, ends) in enumerate(
+        zip(symbols, gene_dat["exonStarts"].values, gene_dat["exonEnds"].values)
+    ):
+        starts = parse_positions(starts)
+        ends = parse_positions(ends)
+        if len(starts) != len(ends):
+            raise ValueError(f"{symbol} has {len(starts)} exon starts but {len(ends)} exon ends.")
+        records["exon_offset"][i] = offset
+        exon_starts.extend(starts)
+        exon_ends.extend(ends)
+        offset += len(starts)
+    exon_starts = np.array(exon_starts, dtype=np.int64)
+    exon_ends = np.array(exon_ends, dtype=np.int64)
+    for exons in (exon_starts, exon_ends):
+        if len(exons) and (exons.min() < 0 or exons.max() > POSITION_MAX):
+            raise ValueError(f"Exon positions must be 0-{POSITION_MAX}.")
+
+    arrays = {
+        "records": records,
+        "symbols": np.array([symbol.encode("utf-8") for symbol in symbols], dtype=bytes),
+        "chroms": np.array([chrom.encode("utf-8") for chrom in chroms], dtype=bytes),
+        "exon_starts": exon_starts.astype(np.int32),
+        "exon_ends": exon_ends.astype(np.int32),
+        "hash_index": build_hash_index(symbols),
+    }
+    os.makedirs(out, exist_ok=True)
+    if is_gene_catalog(out):
+        os.remove(os.path.join(out, CATALOG_INFO))
+    for name in CATALOG_ARRAYS:
+        np.save(os.path.join(out, f"{name}.npy"), arrays[name])
+    with open(os.path.join(out, CATALOG_INFO), "w") as f:
+        json.dump(
+            {
+                "format": CATALOG_FORMAT,
+                "n_genes": len(symbols),
+                "duplicated": duplicated,
+                "source": source,
+                "time": str(datetime.now()).split(".")[0],
+                "script": os.path.basename(__file__),
+                "version": __version__,
+            },
+            f,
+            indent=2,
+        )
+
+
+class GeneCatalog(object):
+    """
+    Memory-mapped gene catalog made by gene_catalog.py. Pickles as its path, so worker
+    processes reopen (and share the pages of) the same files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, CATALOG_INFO)) as f:
+            info = json.load(f)
+        if info.get("format") != CATALOG_FORMAT:
+            raise ValueError(f"{path} is not a gene catalog of format {CATALOG_FORMAT}.")
+        for name in CATALOG_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.chrom_names = [chrom.decode("utf-8") for chrom in self.chroms]
+        # genes listed more than once in the gene annotations, with how often
+        self.duplicated = info.get("duplicated", {})
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, symbol):
+        return self.index(symbol) >= 0
+
+    def index(self, symbol):
+        """
+        Record index of a gene symbol, -1 if it is not in the catalog.
+        """
+        encoded = str(symbol).encode("utf-8")
+        mask = len(self.hash_index) - 1
+        slot = symbol_hash(str(symbol)) & mask
+        while True:
+            i = int(self.hash_index[slot])
+            if i == -1:
+                return -1
+            if self.symbols[i] == encoded:
+                return i
+            slot = (slot + 1) & mask
+
+    def record(self, symbol):
+        """
+        Annotations of a gene, as a dict of chrom, txStart, txEnd, cdsStart, cdsEnd, exonCount,
+        and exonStarts and exonEnds (int32 numpy arrays). Raises ValueError if the gene is not
+        in the catalog, or was listed more than once in the gene annotations.
+        """
+        i = self.index(symbol)
+        if i < 0:
+            n_times = self.duplicated.get(str(symbol))
+            if n_times:
+                raise ValueError(f"{symbol} is listed {n_times} times in gene annotations, not once.")
+            raise ValueError(f"{symbol} is not in gene catalog {self.path}.")
+        rec = self.records[i]
+        offset = int(rec["exon_offset"])
+        if i + 1 < len(self.records):
+            n_listed = int(self.records[i + 1]["exon_offset"]) - offset
+        else:
+            n_listed = len(self.exon_starts) - offset
+        record = {field: int(rec[field]) for field in RECORD_FIELDS}
+        record["chrom"] = self.chrom_names[int(rec["chrom"])]
+        record["exonStarts"] = np.asarray(self.exon_starts[offset : offset + n_listed])
+        record["exonEnds"] = np.asarray(self.exon_ends[offset : offset + n_listed])
+        return record
+
+
+def main(args):
+    try:
+        build_catalog(
+            read_gene_dat(args["<gene_dat>"]), args["<out>"], source=args["<gene_dat>"]
+        )
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
+    logging.info("Done.")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__, version=__version__)
+    if arguments["-v"]:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.ERROR,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    main(arguments)
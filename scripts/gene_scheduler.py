@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+gene_scheduler.py schedules and records the genes of a batch ExcisionFinder run.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Genes are split into chunks of neighbouring genes, which share annotation reads, and the
+chunks are handed to the worker processes largest first, so that long genes do not hold up
+the end of the run. Each finished gene is recorded as one JSON line in a manifest, written
+and synced before the next one, together with the number of rows of each output table at
+that point. After a crash, the run resumes from the last complete line: finished genes are
+skipped and output rows written after it are dropped.
+"""
+from datetime import datetime
+import json
+import os
+import time
+
+import pandas as pd
+
+# genes per scheduled chunk
+CHUNK_GENES = 20
+
+# gene statuses, in the order they are checked; all but "evaluated" have a <out><status>.txt list
+STATUSES = ["evaluated", "no_coding_exons", "not_enough_hets", "no_targetable_inds"]
+
+STATUS_COLUMNS = ["gene", "status", "n_inds", "n_targetable", "seconds", "time"]
+
+
+def gene_size(gene):
+    """
+    Cost estimate of evaluating a gene: its length including the window.
+    """
+    return gene.end - gene.start
+
+
+def schedule_chunks(genes, chunk_genes=CHUNK_GENES, max_span=None):
+    """
+    Split genes sorted by position into chunks of at most chunk_genes (None: any number of)
+    neighbouring genes on one chromosome, largest chunk (by total gene size) first.
+    :param genes: Genes, sorted by chromosome and position, list.
+    :param max_span: if given, genes starting more than max_span bp after the first gene of a
+        chunk start a new chunk, int.
+    :return: chunks, lists of Genes.
+    """
+    chunks = []
+    for gene in genes:
+        if (
+            chunks
+            and (chunk_genes is None or len(chunks[-1]) < chunk_genes)
+            and (max_span is None or gene.start - chunks[-1][0].start <= max_span)
+            and str(chunks[-1][-1].chrom) == str(gene.chrom)
+        ):
+            chunks[-1].append(gene)
+        else:
+            chunks.append([gene])
+    chunks.sort(key=lambda chunk: sum(gene_size(gene) for gene in chunk), reverse=True)
+    return chunks
+
+
+class Manifest(object):
+    """
+    JSON lines manifest of the finished genes of a batch run, at <out>manifest.jsonl.
+    """
+
+    def __init__(self, out_prefix, resume=False):
+        self.fname = f"{out_prefix}manifest.jsonl"
+        self.records = {}
+        self.last = None
+        if resume and os.path.exists(self.fname):
+            self._load()
+        else:
+            open(self.fname, "w").close()
+
+    def _load(self):
+        good_size = 0
+        with open(self.fname) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # line cut off by a crash
+                    break
+                if not line.endswith("\n"):
+                    break
+                good_size += len(line.encode())
+                self.records[record["gene"]] = record
+                self.last = record
+        # drop whatever follows the last complete record
+        with open(self.fname, "r+") as f:
+            f.truncate(good_size)
+
+    def done(self, gene):
+        return gene in self.records
+
+    def rows(self, table):
+        """
+        Rows of an output table written by the last finished gene.
+        """
+        if self.last is None:
+            return 0
+        return self.last["rows"].get(table, 0)
+
+    def record(self, gene, status, n_inds, n_targetable, seconds, rows):
+        """
+        Append a finished gene and sync it to disk.
+        :param rows: rows of each output table after writing the gene, dict.
+        """
+        record = {
+            "gene": gene,
+            "status": status,
+            "n_inds": int(n_inds),
+            "n_targetable": int(n_targetable),
+            "seconds": round(seconds, 3),
+            "time": str(datetime.now()).split(".")[0],
+            "rows": rows,
+        }
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[gene] = record
+        self.last = record
+
+    def status_table(self):
+        """
+        Status of every finished gene, DataFrame.
+        """
+        return pd.DataFrame(
+            [[record[col] for col in STATUS_COLUMNS] for record in self.records.values()],
+            columns=STATUS_COLUMNS,
+        )
+
+    def write_status(self, out_prefix):
+        """
+        Write <out>status.tsv, and list the genes of each status in <out><status>.txt
+        (genes_evaluated.txt for evaluated genes).
+        """
+        status = self.status_table()
+        status.to_csv(f"{out_prefix}status.tsv", sep="\t", index=False)
+        for name in STATUSES:
+            list_name = "genes_evaluated" if name == "evaluated" else name
+            with open(f"{out_prefix}{list_name}.txt", "w") as f:
+                f.writelines(
+                    f"{gene}\n" for gene in status.loc[status["status"] == name, "gene"]
+                )
+
+
+class Progress(object):
+    """
+    Throughput and ETA of a batch run, by gene count and by total gene size.
+    """
+
+    def __init__(self, n_genes, total_size):
+        self.n_genes = n_genes
+        self.total_size = total_size
+        self.genes_done = 0
+        self.size_done = 0
+        self.start = time.perf_counter()
+
+    def update(self, n_genes, size):
+        self.genes_done += n_genes
+        self.size_done += size
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.genes_done / elapsed if elapsed > 0 else 0.0
+        if self.size_done:
+            eta = elapsed * (self.total_size - self.size_done) / self.size_done
+            eta = f"{eta / 60:.1f} min"
+        else:
+            eta = "unknown"
+        return (
+            f"{self.genes_done} of {self.n_genes} genes done "
+            f"({rate * 60:.1f} genes/min), ETA {eta}."
+        )
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+packed_genome.py converts a reference genome FASTA into 2-bit packed, memory-mapped arrays
+and reads them back, as part of ExcisionFinder. Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Each chromosome is saved in <out_dir> as <chrom>_2bit.npy, four bases per byte (A=0, C=1,
+G=2, T=3, first base in the most significant bits), and <chrom>_nmask.npy, one bit per base
+that is set where the base was not A, C, G or T. chroms.tsv lists the chromosomes and their
+lengths. Soft-masking is not kept, sequences are read back upper case.
+
+The arrays are memory-mapped, so a fetch only decodes the bases it asks for and processes
+on one machine share the page-cached genome. open_reference() returns a PackedGenome for a
+packed genome directory and a pyfaidx Fasta otherwise; both can be sliced as
+ref_genome[chrom][start:end] to get a string.
+
+Usage:
+    packed_genome.py [-v] <ref_fasta> <out_dir> [--chroms=<c>]
+
+Arguments:
+    ref_fasta           Fasta file for reference genome used, e.g. hg38.
+    out_dir             Directory to save the packed genome in.
+Options:
+    -h --help           Show this screen and exit.
+    -v                  Run in verbose mode.
+    --chroms=<c>        Comma-separated chromosomes to pack (default: all in ref_fasta).
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from docopt import docopt
+from pyfaidx import Fasta
+
+from seq_pack import BASES, CODE_LOOKUP
+
+__version__ = "0.0.1"
+
+CHROMS_FILE = "chroms.tsv"
+
+# bases packed at a time, a multiple of 8 so chunks start on whole bytes of both arrays
+PACK_CHUNK = 8 * 1000000
+
+
+def is_packed_genome(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, CHROMS_FILE))
+
+
+def open_reference(path):
+    """
+    Opens a reference genome, either a directory made by packed_genome.py or a FASTA file.
+    """
+    if is_packed_genome(path):
+        return PackedGenome(path)
+    return Fasta(path, as_raw=True)
+
+
+def fetch_array(ref_genome, chrom, start=0, end=None):
+    """
+    Sequence of ref_genome[chrom][start:end] as an upper case uint8 array of ASCII bases,
+    for either kind of reference opened by open_reference.
+    """
+    if isinstance(ref_genome, PackedGenome):
+        return ref_genome.fetch(chrom, start, end)
+    return np.frombuffer(
+        ref_genome[chrom][start:end].upper().encode("ascii"), dtype=np.uint8
+    )
+
+
+def pack_seq(seq_bytes):
+    """
+    Packs a uint8 array of ASCII bases into 2-bit codes (4 per byte) and an N mask (8 per byte).
+    """
+    codes = CODE_LOOKUP[seq_bytes]
+    is_n = codes == 4
+    codes[is_n] = 0
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[: len(codes)] = codes
+    padded = padded.reshape(-1, 4)
+    packed = (padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]
+    return packed.astype(np.uint8), np.packbits(is_n)
+
+
+def pack_genome(ref_genome, chroms, out_dir):
+    """
+    Saves the chromosomes of a pyfaidx Fasta as a packed genome in out_dir.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    lengths = []
+    for chrom in chroms:
+        logging.info(f"Packing {chrom}.")
+        length = len(ref_genome[chrom])
+        packed = np.lib.format.open_memmap(
+            os.path.join(out_dir, f"{chrom}_2bit.npy"),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(-(-length // 4),),
+        )
+        nmask = np.lib.format.open_memmap(
+            os.path.join(out_dir, f"{chrom}_nmask.npy"),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(-(-length // 8),),
+        )
+        for start in range(0, length, PACK_CHUNK):
+            seq = ref_genome[chrom][start : start + PACK_CHUNK]
+            chunk_packed, chunk_nmask = pack_seq(
+                np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+            )
+            packed[start // 4 : start // 4 + len(chunk_packed)] = chunk_packed
+            nmask[start // 8 : start // 8 + len(chunk_nmask)] = chunk_nmask
+        packed.flush()
+        nmask.flush()
+        lengths.append((chrom, length))
+    pd.DataFrame(lengths, columns=["chrom", "length"]).to_csv(
+        os.path.join(out_dir, CHROMS_FILE), sep="\t", index=False
+    )
+
+
+class PackedChrom(object):
+    """
+    One chromosome of a PackedGenome, sliced like a pyfaidx record to get a string.
+    """
+
+    def __init__(self, genome, chrom):
+        self.genome = genome
+        self.chrom = chrom
+
+    def __len__(self):
+        return self.genome.lengths[self.chrom]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            key = slice(key, key + 1 if key != -1 else None)
+        return self.genome.fetch(self.chrom, key.start, key.stop).tobytes().decode("ascii")
+
+    def __str__(self):
+        return self[:]
+
+
+class PackedGenome(object):
+    """
+    Memory-mapped reference genome saved by packed_genome.py.
+    """
+
+    def __init__(self, genome_dir):
+        self.genome_dir = genome_dir
+        chroms = pd.read_csv(os.path.join(genome_dir, CHROMS_FILE), sep="\t")
+        self.lengths = dict(zip(chroms["chrom"].astype(str), chroms["length"]))
+        self._arrays = {}
+
+    def keys(self):
+        return list(self.lengths.keys())
+
+    def __contains__(self, chrom):
+        return chrom in self.lengths
+
+    def __getitem__(self, chrom):
+        if chrom not in self.lengths:
+            raise KeyError(f"{chrom} not in {self.genome_dir}")
+        return PackedChrom(self, chrom)
+
+    def arrays(self, chrom):
+        """
+        Returns the memory-mapped packed bases and N mask of a chromosome.
+        """
+        if chrom not in self._arrays:
+            self._arrays[chrom] = (
+                np.load(os.path.join(self.genome_dir, f"{chrom}_2bit.npy"), mmap_mode="r"),
+                np.load(os.path.join(self.genome_dir, f"{chrom}_nmask.npy"), mmap_mode="r"),
+            )
+        return self._arrays[chrom]
+
+    def fetch(self, chrom, start=None, end=None):
+        """
+        Bases start to end (0-based, end exclusive, Python slice rules) of a chromosome as a
+        uint8 array of upper case ASCII bases.
+        """
+        start, end, _ = slice(start, end).indices(self.lengths[chrom])
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+        packed, nmask = self.arrays(chrom)
+        first_byte = start // 4
+        codes = np.unpackbits(
+            np.asarray(packed[first_byte : (end + 3) // 4])[:, None], axis=1
+        ).reshape(-1, 4, 2)
+        codes = (codes[:, :, 0] << 1) | codes[:, :, 1]
+        seq_bytes = BASES[codes.ravel()[start - 4 * first_byte : end - 4 * first_byte]]
+        is_n = np.unpackbits(np.asarray(nmask[start // 8 : (end + 7) // 8]))
+        seq_bytes[is_n[start % 8 : start % 8 + end - start].astype(bool)] = ord("N")
+        return seq_bytes
+
+    def fetch_many(self, chrom, starts, length):
+        """
+        Bases starts[i] to starts[i] + length of a chromosome, for an array of starts, as an
+        (n intervals x length) uint8 array. Positions off either end of the chromosome are N.
+        """
+        packed, nmask = self.arrays(chrom)
+        idx = np.asarray(starts, dtype=np.int64)[:, None] + np.arange(length)
+        in_chrom = (idx >= 0) & (idx < self.lengths[chrom])
+        idx = np.where(in_chrom, idx, 0)
+        codes = (packed[idx >> 2] >> (6 - 2 * (idx & 3)).astype(np.uint8)) & 3
+        is_n = (nmask[idx >> 3] >> (7 - (idx & 7)).astype(np.uint8)) & 1
+        seq_bytes = BASES[codes]
+        seq_bytes[(is_n == 1) | ~in_chrom] = ord("N")
+        return seq_bytes
+
+
+def main(args):
+    ref_genome = Fasta(args["<ref_fasta>"], as_raw=True)
+    if args["--chroms"]:
+        chroms = args["--chroms"].split(",")
+    else:
+        chroms = list(ref_genome.keys())
+    pack_genome(ref_genome, chroms, args["<out_dir>"])
+    logging.info("Done.")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__, version=__version__)
+    if arguments["-v"]:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.ERROR,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    main(arguments)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pam_index.py gives range access to the PAM positions pre-computed by pam_pos_genome.py
+as part of ExcisionFinder. Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+The per-chromosome .npy files are memory-mapped rather than loaded, so several loci
+(or several processes) can query the same chromosome without copying it into a Python
+list. Positions are kept sorted so that a locus is a binary search plus an array slice.
+"""
+import os
+import numpy as np
+
+
+def pam_fname(pams_dir, chrom, cas, strand):
+    """
+    Returns the path of the PAM positions file for a chromosome, Cas and strand ('for' or 'rev').
+    """
+    chrom = "chr" + str(chrom).replace("chr", "")
+    return os.path.join(pams_dir, f"{chrom}_{cas}_pam_sites_{strand}.npy")
+
+
+class PamIndex(object):
+    """
+    Holds memory-mapped, position-sorted PAM sites for every (chromosome, Cas, strand)
+    requested so far. Older PAM files were written from unsorted sets; those are sorted
+    once in memory when first opened.
+    """
+
+    def __init__(self, pams_dir):
+        self.pams_dir = pams_dir
+        self._sites = {}
+
+    def sites(self, chrom, cas, strand):
+        """
+        Returns all sorted PAM positions for a chromosome, Cas and strand ('for' or 'rev').
+        """
+        fname = pam_fname(self.pams_dir, chrom, cas, strand)
+        if fname not in self._sites:
+            sites = np.load(fname, mmap_mode="r")
+            if sites.size > 1 and not np.all(sites[1:] >= sites[:-1]):
+                sites = np.sort(sites)
+            self._sites[fname] = sites
+        return self._sites[fname]
+
+    def in_range(self, chrom, cas, strand, start, stop):
+        """
+        Returns PAM positions p with start <= p <= stop, as a (read-only) array view.
+        """
+        sites = self.sites(chrom, cas, strand)
+        lo = np.searchsorted(sites, start, side="left")
+        hi = np.searchsorted(sites, stop, side="right")
+        return sites[lo:hi]
+
+    def bounds(self, chrom, cas, strand, start, stop):
+        """
+        Returns the (lo, hi) slice of the sorted PAM array covering start <= p <= stop.
+        """
+        sites = self.sites(chrom, cas, strand)
+        return (
+            int(np.searchsorted(sites, start, side="left")),
+            int(np.searchsorted(sites, stop, side="right")),
+        )
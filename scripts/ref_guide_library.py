@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ref_guide_library.py builds and reads per-chromosome libraries of reference genome sgRNAs
+as part of ExcisionFinder. Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+For every PAM site found by pam_pos_genome.py, the library stores the reference guide next
+to it, 2-bit packed by seq_pack.py, in the same order as the sorted PAM sites in pam_index.py.
+The guides for a locus are then a slice of the library at the PAM index bounds of the locus.
+
+Usage:
+    ref_guide_library.py [-v] <pams_dir> <ref_fasta> <cas_types> <guide_length> [--chroms=<c>]
+
+Arguments:
+    pams_dir            Directory where pam locations in the reference genome are located.
+                        Libraries are saved here, next to the PAM files.
+    ref_fasta           Fasta file for the reference genome the PAMs were found in, e.g. hg38,
+                        or the same genome packed by packed_genome.py.
+    cas_types           Cas types to build libraries for, comma-separated (e.g. SpCas9,SaCas9).
+    guide_length        Guide length, at most 32 bp.
+Options:
+    -h --help           Show this screen and exit.
+    -v                  Run in verbose mode.
+    --chroms=<c>        Comma-separated chromosomes to build libraries for (default: all with PAM files).
+"""
+import glob
+import logging
+import os
+
+import numpy as np
+from docopt import docopt
+import seq_pack
+from packed_genome import fetch_array, open_reference
+from pam_index import PamIndex
+
+__version__ = "0.0.1"
+
+# number of guides fetched from the chromosome sequence at a time
+BUILD_CHUNK = 1000000
+
+
+def library_fname(pams_dir, chrom, cas, guide_length, strand):
+    """
+    Returns the path of the reference guide library for a chromosome, Cas, guide length and strand.
+    """
+    chrom = "chr" + str(chrom).replace("chr", "")
+    return os.path.join(
+        pams_dir, f"{chrom}_{cas}_{guide_length}bp_ref_guides_{strand}.npy"
+    )
+
+
+def guide_starts(sites, guide_length, strand):
+    """
+    0-based start of the reference guide for each PAM site, matching simple_grnas in gen_sgRNAs.py.
+    """
+    if strand == "for":
+        return sites - guide_length - 1
+    return sites
+
+
+def build_library(chrom_seq, sites, guide_length, strand):
+    """
+    Pack the reference guide for every PAM site. chrom_seq is the chromosome as a uint8 array
+    of ASCII bases; guides running off either end of the chromosome are filled with N.
+    """
+    library = np.zeros(len(sites), dtype=seq_pack.PACKED_DTYPE)
+    offsets = np.arange(guide_length)
+    for chunk_start in range(0, len(sites), BUILD_CHUNK):
+        chunk = np.asarray(
+            sites[chunk_start : chunk_start + BUILD_CHUNK], dtype=np.int64
+        )
+        idx = guide_starts(chunk, guide_length, strand)[:, None] + offsets
+        in_chrom = (idx >= 0) & (idx < chrom_seq.shape[0])
+        seq_bytes = np.full(idx.shape, ord("N"), dtype=np.uint8)
+        seq_bytes[in_chrom] = chrom_seq[idx[in_chrom]]
+        library[chunk_start : chunk_start + len(chunk)] = seq_pack.pack_array(seq_bytes)
+    return library
+
+
+class RefGuideLibrary(object):
+    """
+    Memory-mapped reference guide libraries, read alongside the PAM sites in a PamIndex.
+    """
+
+    def __init__(self, pam_index, guide_length):
+        seq_pack.check_length(guide_length)
+        self.pam_index = pam_index
+        self.guide_length = guide_length
+        self._guides = {}
+
+    def available(self, chrom, cas):
+        """
+        Whether libraries for both strands exist for this chromosome and Cas.
+        """
+        return all(
+            os.path.exists(
+                library_fname(
+                    self.pam_index.pams_dir, chrom, cas, self.guide_length, strand
+                )
+            )
+            for strand in ("for", "rev")
+        )
+
+    def guides(self, chrom, cas, strand):
+        """
+        Returns the packed library for a chromosome, Cas and strand.
+        """
+        fname = library_fname(
+            self.pam_index.pams_dir, chrom, cas, self.guide_length, strand
+        )
+        if fname not in self._guides:
+            guides = np.load(fname, mmap_mode="r")
+            if len(guides) != len(self.pam_index.sites(chrom, cas, strand)):
+                raise ValueError(
+                    f"{fname} does not match the PAM sites in {self.pam_index.pams_dir}, rebuild it."
+                )
+            self._guides[fname] = guides
+        return self._guides[fname]
+
+    def in_range(self, chrom, cas, strand, start, stop):
+        """
+        Returns the PAM sites with start <= p <= stop and their decoded reference guides.
+        """
+        lo, hi = self.pam_index.bounds(chrom, cas, strand, start, stop)
+        sites = self.pam_index.sites(chrom, cas, strand)[lo:hi]
+        guides = self.guides(chrom, cas, strand)[lo:hi]
+        return sites, seq_pack.unpack_seqs(guides, self.guide_length)
+
+
+def main(args):
+    pams_dir = args["<pams_dir>"]
+    guide_length = int(args["<guide_length>"])
+    seq_pack.check_length(guide_length)
+    ref_genome = open_reference(args["<ref_fasta>"])
+    pam_index = PamIndex(pams_dir)
+
+    for cas in args["<cas_types>"].split(","):
+        if args["--chroms"]:
+            chroms = args["--chroms"].split(",")
+        else:
+            chroms = [
+                os.path.basename(f).split("_")[0]
+                for f in sorted(
+                    glob.glob(os.path.join(pams_dir, f"*_{cas}_pam_sites_for.npy"))
+                )
+            ]
+        for chrom in chroms:
+            chrom = "chr" + str(chrom).replace("chr", "")
+            logging.info(f"Building {cas} reference guide library for {chrom}.")
+            chrom_seq = fetch_array(ref_genome, chrom)
+            for strand in ("for", "rev"):
+                library = build_library(
+                    chrom_seq, pam_index.sites(chrom, cas, strand), guide_length, strand
+                )
+                np.save(
+                    library_fname(pams_dir, chrom, cas, guide_length, strand), library
+                )
+    logging.info("Done.")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__, version=__version__)
+    if arguments["-v"]:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.ERROR,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    main(arguments)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+score_cache.py keeps guide specificity scores on disk between runs as part of ExcisionFinder.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Scores are stored in an sqlite database under a hash of everything they depend on (see
+crispor_scoring.score_key), so the same guide is only aligned once across reruns, samples
+and overlapping loci. When the cache grows past its size limit, the least recently used
+scores are dropped.
+"""
+import math
+import sqlite3
+import time
+
+# maximum number of keys per sqlite query
+QUERY_CHUNK = 500
+
+
+def to_db(value):
+    """
+    sqlite has no NaN, so missing scores are stored as NULL.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def from_db(value):
+    return float("nan") if value is None else value
+
+
+class ScoreCache(object):
+    """
+    Persistent (MIT score, CFD score, off-target count) cache, keyed by hex digest.
+    Counts hits and misses of lookups for reporting.
+    """
+
+    def __init__(self, db_fname, max_entries=1000000):
+        self.db_fname = db_fname
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(db_fname, timeout=60)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, mit REAL, cfd REAL, "
+            "offtargets INTEGER, last_used REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+        )
+        self.db.commit()
+
+    def get_many(self, keys):
+        """
+        Returns a dict of key -> (mit, cfd, offtargets) for the keys in the cache, and marks
+        them as used.
+        """
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[i : i + QUERY_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            for key, mit, cfd, offtargets in self.db.execute(
+                f"SELECT key, mit, cfd, offtargets FROM scores WHERE key IN ({marks})",
+                chunk,
+            ):
+                found[key] = (from_db(mit), from_db(cfd), offtargets)
+            self.db.execute(
+                f"UPDATE scores SET last_used = ? WHERE key IN ({marks})",
+                [time.time()] + chunk,
+            )
+        self.db.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        """
+        Adds (key, mit, cfd, offtargets) entries, then evicts down to max_entries.
+        """
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)",
+            [
+                (key, to_db(mit), to_db(cfd), int(offtargets), now)
+                for key, mit, cfd, offtargets in entries
+            ],
+        )
+        self.evict()
+
+    def evict(self):
+        """
+        Drops the least recently used entries beyond max_entries.
+        """
+        self.db.execute(
+            "DELETE FROM scores WHERE key IN "
+            "(SELECT key FROM scores ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.db.commit()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        return (
+            f"Score cache {self.db_fname}: {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate():.1%} hit rate)."
+        )
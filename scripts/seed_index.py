@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+seed_index.py builds and reads a k-mer count index of a reference genome as part of
+ExcisionFinder. Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+The index holds, for every k-mer, how often it occurs in the reference genome on either
+strand, as a uint32 array of length 4^k indexed by the 2-bit code of the k-mer (A=0, C=1,
+G=2, T=3, first base in the most significant bits). It is memory-mapped when read, so
+looking up the PAM-proximal seeds of a batch of guides only touches the pages it needs.
+k-mers containing a base other than A, C, G or T are not counted.
+
+Usage:
+    seed_index.py [-v] <ref_fasta> <out> [--k=<K>] [--chroms=<c>]
+
+Arguments:
+    ref_fasta           Fasta file for reference genome used, e.g. hg38, or a genome packed by packed_genome.py.
+    out                 Output index file, saved as a .npy array.
+Options:
+    -h --help           Show this screen and exit.
+    -v                  Run in verbose mode.
+    --k=<K>             Seed length, at most 14 bp [default: 12].
+    --chroms=<c>        Comma-separated chromosomes to count (default: all in ref_fasta).
+"""
+import logging
+
+import numpy as np
+from docopt import docopt
+
+from packed_genome import fetch_array, open_reference
+from seq_pack import CODE_LOOKUP
+
+__version__ = "0.0.1"
+
+MAX_K = 14
+
+# bases of the chromosome counted at a time
+COUNT_CHUNK = 10000000
+
+
+def check_k(k):
+    """
+    Raise ValueError if an index of k-mers of this length is not supported.
+    """
+    if not 0 < k <= MAX_K:
+        raise ValueError(f"Seed length must be 1-{MAX_K} bp, not {k} bp.")
+
+
+def kmer_codes(seq_bytes, k):
+    """
+    2-bit codes of every k-mer in a uint8 array of ASCII bases, and whether each k-mer is all ACGT.
+    """
+    codes = CODE_LOOKUP[seq_bytes]
+    n_kmers = max(len(codes) - k + 1, 0)
+    kmers = np.zeros(n_kmers, dtype=np.uint32)
+    valid = np.ones(n_kmers, dtype=bool)
+    for j in range(k):
+        window = codes[j : j + n_kmers]
+        kmers = (kmers << np.uint32(2)) | (window & 3).astype(np.uint32)
+        valid &= window != 4
+    return kmers, valid
+
+
+def rev_comp_codes(k):
+    """
+    For every k-mer code, the code of its reverse complement.
+    """
+    codes = np.arange(4 ** k, dtype=np.uint32)
+    rc = np.zeros(4 ** k, dtype=np.uint32)
+    for _ in range(k):
+        rc = (rc << np.uint32(2)) | (np.uint32(3) - (codes & np.uint32(3)))
+        codes >>= np.uint32(2)
+    return rc
+
+
+def count_kmers(ref_genome, chroms, k):
+    """
+    Counts every k-mer on both strands of the given chromosomes.
+    """
+    counts = np.zeros(4 ** k, dtype=np.uint64)
+    for chrom in chroms:
+        logging.info(f"Counting {k}-mers in {chrom}.")
+        chrom_len = len(ref_genome[chrom])
+        # chunks overlap by k - 1 bases so that no k-mer is missed
+        for start in range(0, chrom_len, COUNT_CHUNK):
+            kmers, valid = kmer_codes(
+                fetch_array(ref_genome, chrom, start, start + COUNT_CHUNK + k - 1), k
+            )
+            found, n = np.unique(kmers[valid], return_counts=True)
+            counts[found] += n.astype(np.uint64)
+    # a k-mer on the reverse strand is its reverse complement on the forward strand
+    counts += counts[rev_comp_codes(k)]
+    return np.minimum(counts, np.iinfo(np.uint32).max).astype(np.uint32)
+
+
+class SeedIndex(object):
+    """
+    Memory-mapped k-mer count index made by seed_index.py.
+    """
+
+    def __init__(self, fname):
+        self.counts = np.load(fname, mmap_mode="r")
+        self.k = int(round(np.log(len(self.counts)) / np.log(4)))
+        if 4 ** self.k != len(self.counts):
+            raise ValueError(f"{fname} is not a seed index.")
+
+    def seed_counts(self, seeds):
+        """
+        Occurrences of each seed in the reference genome. Seeds that are not k bp of
+        A, C, G and T are given a count of 0.
+        """
+        seeds = [str(seed).upper() for seed in seeds]
+        occurrences = np.zeros(len(seeds), dtype=np.int64)
+        is_kmer = np.array([len(seed) == self.k for seed in seeds], dtype=bool)
+        if not is_kmer.any():
+            return occurrences
+        seed_bytes = np.frombuffer(
+            "".join(seed for seed, keep in zip(seeds, is_kmer) if keep).encode("ascii"),
+            dtype=np.uint8,
+        ).reshape(-1, self.k)
+        codes = CODE_LOOKUP[seed_bytes]
+        valid = (codes != 4).all(axis=1)
+        kmers = np.zeros(len(codes), dtype=np.int64)
+        for j in range(self.k):
+            kmers = (kmers << 2) | (codes[:, j] & 3)
+        found = np.zeros(len(codes), dtype=np.int64)
+        found[valid] = self.counts[kmers[valid]]
+        occurrences[is_kmer] = found
+        return occurrences
+
+
+def main(args):
+    k = int(args["--k"])
+    try:
+        check_k(k)
+    except ValueError as e:
+        logging.error(f"Error: {e} Exiting.")
+        exit(1)
+    ref_genome = open_reference(args["<ref_fasta>"])
+    if args["--chroms"]:
+        chroms = args["--chroms"].split(",")
+    else:
+        chroms = list(ref_genome.keys())
+    np.save(args["<out>"], count_kmers(ref_genome, chroms, k))
+    logging.info("Done.")
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__, version=__version__)
+    if arguments["-v"]:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.ERROR,
+            format="[%(asctime)s %(name)s:%(levelname)s ]%(message)s",
+        )
+    main(arguments)
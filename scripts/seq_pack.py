@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+seq_pack.py packs fixed-length DNA sequences into 2-bit codes as part of ExcisionFinder.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Each sequence of up to 32 bp is stored as one uint64 holding 2 bits per base (A=0, C=1,
+G=2, T=3, first base in the most significant bits), plus a uint64 mask with one bit per
+base that is set where the base was not A, C, G or T (decoded as N).
+
+Sequences fetched in bulk as fixed-width (n sequences x width) uint8 arrays of ASCII bases,
+padded at the end with 0 bytes, are decoded to strings with decode_guides.
+"""
+import numpy as np
+
+MAX_PACKED_LEN = 32
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+# byte -> 2-bit code, 4 for anything that is not A, C, G or T (either case)
+CODE_LOOKUP = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    CODE_LOOKUP[base] = code
+    CODE_LOOKUP[base + 32] = code
+
+PACKED_DTYPE = np.dtype([("code", np.uint64), ("nmask", np.uint64)])
+
+
+def check_length(length):
+    """
+    Raise ValueError if sequences of this length cannot be packed into a uint64.
+    """
+    if not 0 < length <= MAX_PACKED_LEN:
+        raise ValueError(
+            f"Can only pack sequences of 1-{MAX_PACKED_LEN} bp, not {length} bp."
+        )
+
+
+def pack_array(seq_bytes):
+    """
+    Pack an (n sequences x length) uint8 array of ASCII bases. Returns a structured array
+    of PACKED_DTYPE with one (code, nmask) record per sequence.
+    """
+    n, length = seq_bytes.shape
+    check_length(length)
+    codes = CODE_LOOKUP[seq_bytes]
+    is_n = codes == 4
+    codes[is_n] = 0
+    packed = np.zeros(n, dtype=PACKED_DTYPE)
+    code = np.zeros(n, dtype=np.uint64)
+    nmask = np.zeros(n, dtype=np.uint64)
+    for i in range(length):
+        shift = np.uint64(length - 1 - i)
+        code |= codes[:, i].astype(np.uint64) << (np.uint64(2) * shift)
+        nmask |= is_n[:, i].astype(np.uint64) << shift
+    packed["code"] = code
+    packed["nmask"] = nmask
+    return packed
+
+
+def pack_seqs(seqs, length):
+    """
+    Pack a list of sequences, each exactly length bp long.
+    """
+    seq_bytes = np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)
+    return pack_array(seq_bytes.reshape(len(seqs), length))
+
+
+def unpack_array(packed, length):
+    """
+    Decode packed sequences back into an (n sequences x length) uint8 array of ASCII bases.
+    """
+    check_length(length)
+    code = np.asarray(packed["code"], dtype=np.uint64)
+    nmask = np.asarray(packed["nmask"], dtype=np.uint64)
+    seq_bytes = np.empty((code.shape[0], length), dtype=np.uint8)
+    for i in range(length):
+        shift = np.uint64(length - 1 - i)
+        seq_bytes[:, i] = BASES[((code >> (np.uint64(2) * shift)) & np.uint64(3)).astype(np.intp)]
+        seq_bytes[((nmask >> shift) & np.uint64(1)).astype(bool), i] = ord("N")
+    return seq_bytes
+
+
+def unpack_seqs(packed, length):
+    """
+    Decode packed sequences into a list of strings.
+    """
+    seq_bytes = np.ascontiguousarray(unpack_array(packed, length))
+    return [s.decode("ascii") for s in seq_bytes.view(f"S{length}").ravel()]
+
+
+def decode_guides(seq_bytes):
+    """
+    Decode a fixed-width uint8 array of ASCII bases (0-padded) into a list of strings.
+    """
+    n, width = seq_bytes.shape
+    if width == 0:
+        return [""] * n
+    seq_strs = np.ascontiguousarray(seq_bytes).view(f"S{width}").ravel()
+    return [s.decode("ascii") for s in seq_strs]
+
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+stage_profiler.py times the named stages of a run (bcftools, HDF5 reads, PAM loading, guide
+design, CRISPOR, ...) as part of ExcisionFinder.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+For each stage it records the number of calls, wall time, CPU time (this process and the
+child processes it waited for, e.g. bcftools and bwa) and the peak RSS reached, both over the
+whole run and per locus. Times are exclusive: a stage called inside another one is not counted
+again in the outer stage. Profiling is off unless enabled, in which case stages cost a few
+system calls each.
+"""
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime
+from functools import wraps
+import inspect
+import json
+import os
+import resource
+import time
+
+RUSAGE_KB = 1024.0  # ru_maxrss is in kilobytes on Linux
+
+
+def cpu_time():
+    """
+    CPU seconds used by this process and its finished child processes.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and of its largest child process, in MB.
+    """
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RUSAGE_KB,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / RUSAGE_KB,
+    )
+
+
+def new_record():
+    return {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0, "peak_child_rss_mb": 0.0}
+
+
+class StageProfiler(object):
+    """
+    Accumulates per-stage timings, overall and for the current locus.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.loci = {}
+        self.current_locus = None
+        self._stack = []
+        self._cprofile = None
+        self._start_wall = None
+        self._start_cpu = None
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        self._start_wall = time.perf_counter()
+        self._start_cpu = cpu_time()
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextmanager
+    def locus(self, name):
+        """
+        Attribute the stages run inside this block to a locus (if name is not None).
+        """
+        previous = self.current_locus
+        if name is not None:
+            self.current_locus = str(name)
+        try:
+            yield
+        finally:
+            self.current_locus = previous
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code inside this block as one call of a stage.
+        """
+        if not self.enabled:
+            yield
+            return
+        # [time spent in nested stages: wall, cpu]
+        frame = [0.0, 0.0]
+        self._stack.append(frame)
+        start_wall, start_cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = cpu_time() - start_cpu
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            self._record(name, wall - frame[0], cpu - frame[1])
+
+    def _record(self, name, wall, cpu):
+        rss, child_rss = peak_rss_mb()
+        records = [self.stages.setdefault(name, new_record())]
+        if self.current_locus is not None:
+            records.append(
+                self.loci.setdefault(self.current_locus, {}).setdefault(name, new_record())
+            )
+        for record in records:
+            record["calls"] += 1
+            record["wall_s"] += wall
+            record["cpu_s"] += cpu
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], rss)
+            record["peak_child_rss_mb"] = max(record["peak_child_rss_mb"], child_rss)
+
+    def _locus_context(self, per_locus):
+        return self.locus(None) if per_locus else self.no_locus()
+
+    @contextmanager
+    def no_locus(self):
+        """
+        Attribute the stages run inside this block to no locus, only to the whole run.
+        """
+        previous = self.current_locus
+        self.current_locus = None
+        try:
+            yield
+        finally:
+            self.current_locus = previous
+
+    def profiled(self, name, per_locus=True):
+        """
+        Decorator timing every call of a function as a stage. For generator functions, the
+        time spent producing each item is counted. Stages that are not per_locus are only
+        recorded for the whole run, e.g. generators read ahead of the locus they feed.
+        """
+
+        def decorator(func):
+            if inspect.isgeneratorfunction(func):
+
+                @wraps(func)
+                def gen_wrapper(*args, **kwargs):
+                    items = func(*args, **kwargs)
+                    try:
+                        while True:
+                            with self._locus_context(per_locus), self.stage(name):
+                                try:
+                                    item = next(items)
+                                except StopIteration:
+                                    return
+                            yield item
+                    finally:
+                        items.close()
+
+                return gen_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self._locus_context(per_locus), self.stage(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def report(self, script_name=None, version=None, args=None):
+        rss, child_rss = peak_rss_mb()
+        return {
+            "time": str(datetime.now()).split(".")[0],
+            "script": script_name,
+            "version": version,
+            "arguments": args,
+            "total": {
+                "wall_s": time.perf_counter() - self._start_wall,
+                "cpu_s": cpu_time() - self._start_cpu,
+                "peak_rss_mb": rss,
+                "peak_child_rss_mb": child_rss,
+            },
+            "stages": self.stages,
+            "loci": self.loci,
+        }
+
+    def write(self, prefix, script_name=None, version=None, args=None):
+        """
+        Write the report to <prefix>_profile.json, and the cProfile stats, if collected, to
+        <prefix>_profile.prof (readable with pstats or snakeviz).
+        """
+        with open(f"{prefix}_profile.json", "w") as f:
+            json.dump(self.report(script_name, version, args), f, indent=2, default=str)
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(f"{prefix}_profile.prof")
+
+
+# profiler shared by the modules of a run, enabled by --profile
+PROFILER = StageProfiler()
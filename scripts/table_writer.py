@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+table_writer.py writes guide and guide pair tables in chunks as part of ExcisionFinder.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Tables are written as TSV (the default), Parquet or HDF5. Parquet files are written one
+compressed row group at a time, with typed columns and the run's metadata (script, version,
+time and arguments, as add_metadata stores them for HDF5) in the file's key-value metadata.
+Readers can then filter on e.g. cas_type or locus without loading the whole table:
+    pd.read_parquet(fname, filters=[("cas_type", "==", "SpCas9")])
+HDF5 tables are appended to key "all" with queryable data columns, and get add_metadata.
+Parquet output requires pyarrow.
+"""
+from datetime import datetime
+import json
+import os
+import sys
+
+import pandas as pd
+
+metadata_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "preprocessing"
+)
+sys.path.append(metadata_path)
+from get_metadata import add_metadata
+
+OUT_FORMATS = {"tsv": ".tsv", "parquet": ".parquet", "hdf": ".h5"}
+
+# rows per Parquet row group / HDF5 append
+ROW_GROUP_SIZE = 500000
+
+# string columns in HDF5 tables are fixed width: twice the longest string of the first chunk
+# written, at least HDF_MIN_ITEMSIZE, and widened by rewriting the table if a later chunk
+# holds longer strings
+HDF_MIN_ITEMSIZE = 64
+
+# columns readers commonly filter on, made queryable in HDF5 output
+DATA_COLUMNS = ["chrom", "cas_type", "guide_length", "locus", "variant_position", "gene"]
+
+
+def check_out_format(out_format):
+    """
+    Raise ValueError for unsupported output formats.
+    """
+    if out_format not in OUT_FORMATS:
+        raise ValueError(
+            f"Output format must be one of {', '.join(OUT_FORMATS)}, not {out_format}."
+        )
+
+
+def read_table(fname):
+    """
+    Reads a table written by TableWriter, in whichever format its extension says.
+    """
+    if fname.endswith(".parquet"):
+        return pd.read_parquet(fname)
+    if fname.endswith(".h5") or fname.endswith(".hdf5"):
+        return pd.read_hdf(fname, "all")
+    return pd.read_csv(fname, sep="\t")
+
+
+def string_widths(df):
+    """
+    Length of the longest string in each string column of df.
+    """
+    return {
+        col: int(df[col].astype(str).str.len().max())
+        for col in df.columns
+        if df[col].dtype.kind in "OSU"
+    }
+
+
+class TableWriter(object):
+    """
+    Writes a table to <prefix>.tsv, <prefix>.parquet or <prefix>.h5, one chunk at a time.
+    Use as a context manager, or call close() after the last write. An existing file is
+    replaced, unless resume_rows is given, in which case it is cut to its first resume_rows
+    rows and appended to.
+    """
+
+    def __init__(
+        self, prefix, out_format, args, script_name, version, filetype, resume_rows=None
+    ):
+        check_out_format(out_format)
+        self.out_format = out_format
+        self.fname = prefix + OUT_FORMATS[out_format]
+        self.args = args
+        self.script_name = script_name
+        self.version = version
+        self.filetype = filetype
+        self.n_rows = 0
+        self._parquet = None
+        self._schema = None
+        self._min_itemsize = None
+        self._columns = None
+        if resume_rows:
+            self._truncate(resume_rows)
+            self.n_rows = resume_rows
+        elif os.path.exists(self.fname):
+            os.remove(self.fname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _truncate(self, n_rows):
+        if not os.path.exists(self.fname):
+            raise ValueError(f"Cannot resume writing {self.fname}, it does not exist.")
+        if self.out_format == "parquet":
+            raise ValueError("Parquet tables cannot be resumed, use tsv or hdf.")
+        if self.out_format == "tsv":
+            with open(self.fname, "rb+") as f:
+                # header line, then n_rows rows
+                for _ in range(n_rows + 1):
+                    if not f.readline():
+                        raise ValueError(f"{self.fname} has fewer than {n_rows} rows.")
+                f.truncate(f.tell())
+        else:
+            with pd.HDFStore(self.fname) as store:
+                nrows = store.get_storer("all").nrows
+                if nrows < n_rows:
+                    raise ValueError(f"{self.fname} has fewer than {n_rows} rows.")
+                if nrows > n_rows:
+                    store.remove("all", start=n_rows)
+            # string column widths are those of the existing table
+            self._min_itemsize = {}
+
+    def metadata(self):
+        return {
+            "time": str(datetime.now()).split(".")[0],
+            "script": self.script_name,
+            "version": self.version,
+            "filetype": self.filetype,
+            "arguments": self.args,
+        }
+
+    def write(self, df):
+        """
+        Appends the rows of df, split into row groups of at most ROW_GROUP_SIZE rows, in the
+        column order of the first chunk written.
+        """
+        if self._columns is None:
+            self._columns = list(df.columns)
+        elif list(df.columns) != self._columns:
+            df = df.reindex(columns=self._columns)
+        if df.empty:
+            if self.out_format != "hdf":
+                self._write(df)
+            return
+        for start in range(0, df.shape[0], ROW_GROUP_SIZE):
+            self._write(df.iloc[start : start + ROW_GROUP_SIZE])
+
+    def _write(self, df):
+        if self.out_format == "tsv":
+            with open(self.fname, "a") as f:
+                df.to_csv(f, sep="\t", index=False, header=(f.tell() == 0))
+        elif self.out_format == "parquet":
+            self._write_parquet(df)
+        else:
+            self._write_hdf(df)
+        self.n_rows += df.shape[0]
+
+    def _write_parquet(self, df):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow).")
+
+        if self._parquet is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            # columns that are all missing in the first chunk hold strings in later ones
+            schema = pa.schema(
+                [
+                    pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                    for field in schema
+                ]
+            ).with_metadata(
+                {b"excisionfinder": json.dumps(self.metadata(), default=str).encode()}
+            )
+            self._schema = schema
+            self._parquet = pq.ParquetWriter(self.fname, schema, compression="zstd")
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._parquet.write_table(table)
+
+    def _write_hdf(self, df):
+        if self._min_itemsize is None:
+            self._min_itemsize = {
+                col: max(HDF_MIN_ITEMSIZE, 2 * width) for col, width in string_widths(df).items()
+            }
+        try:
+            self._append_hdf(df)
+        except ValueError as e:
+            # raised before any row is appended when a string is longer than its column
+            if "min_itemsize" not in str(e):
+                raise
+            self._widen_hdf(df)
+
+    def _widen_hdf(self, df):
+        """
+        Rewrites the table written so far with string columns wide enough for df, then appends df.
+        """
+        written = pd.read_hdf(self.fname, "all").iloc[: self.n_rows]
+        os.remove(self.fname)
+        widths = string_widths(pd.concat([written, df]))
+        self._min_itemsize = {
+            col: max(HDF_MIN_ITEMSIZE, 2 * width) for col, width in widths.items()
+        }
+        for start in range(0, written.shape[0], ROW_GROUP_SIZE):
+            self._append_hdf(written.iloc[start : start + ROW_GROUP_SIZE])
+        self._append_hdf(df)
+
+    def _append_hdf(self, df):
+        df.to_hdf(
+            self.fname,
+            "all",
+            mode="a",
+            append=True,
+            format="table",
+            data_columns=[col for col in DATA_COLUMNS if col in df.columns],
+            min_itemsize=self._min_itemsize,
+            complib="blosc",
+        )
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        if self.out_format == "hdf" and os.path.exists(self.fname):
+            add_metadata(
+                self.fname, self.args, self.script_name, self.version, self.filetype
+            )
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+targetability.py evaluates which individuals carry targetable pairs of heterozygous variants
+as part of ExcisionFinder.
+Written in Python v 3.6.1.
+Kathleen Keough et al 2018.
+
+Heterozygosity is held as a (variant positions x samples) boolean matrix and candidate pairs
+as two arrays of row indices into it, so "sample is het at both variants of a pair" is one
+gather-and-AND over all samples and pairs. Per-Cas restrictions are boolean masks over the
+variant positions, applied to the pairs the same way.
+
+Phased genotypes are parsed into int8 alleles, from which a haplotype code per sample and
+variant is derived, so the make/break/near PAM rules (including whether both sites are on the
+same haplotype) are evaluated for all (pair, sample) cells at once. The flags of all Cas can
+also be packed into one bitmask per variant, bit k for the k-th Cas, so that every Cas is
+evaluated in the same pass over the cells with bitwise operations.
+"""
+import numpy as np
+import pandas as pd
+
+# maximum number of (pair, sample) entries evaluated at once
+MAX_CELLS = 1 << 26
+
+ALLELE_MAX = np.iinfo(np.int8).max
+
+# haplotype codes
+NOT_HET = 0
+HAP1 = 1
+HAP2 = 2
+OTHER = 3
+
+# rules making a pair of allele-specific sites targetable, in the order they are checked
+PAIR_RULES = [
+    "both_near_pam",
+    "near_and_make_or_break",
+    "both_make_same_hap",
+    "both_break_same_hap",
+    "make_and_break_other_hap",
+    "break_and_make_other_hap",
+]
+NO_RULE = len(PAIR_RULES)
+
+# per-Cas annotation columns, <prefix>_<cas>, read by variant_flags
+FLAG_PREFIXES = ("makes", "breaks", "var_near")
+
+
+def parse_genotypes(gens, samples):
+    """
+    Parse genotypes (e.g. 0|1) into int8 allele codes.
+    :param gens: genotypes with a pos column and one column of genotypes per sample, DataFrame.
+    :param samples: sample columns of gens, list.
+    :return: first allele, second allele, both (records x samples) int8 numpy arrays with -1 for
+        missing alleles and haploid calls; whether each genotype is phased, bool numpy array.
+    """
+    shape = (gens.shape[0], len(samples))
+    allele1 = np.full(shape, -1, dtype=np.int8)
+    allele2 = np.full(shape, -1, dtype=np.int8)
+    phased = np.zeros(shape, dtype=bool)
+    for j, sample in enumerate(samples):
+        gt = gens[sample].astype(str).str.split(":", n=1).str[0]
+        alleles = gt.str.split(r"/|\|", n=1, expand=True, regex=True)
+        if alleles.shape[1] < 2:  # haploid calls are never heterozygous
+            continue
+        diploid = alleles[1].notna().values
+        for allele, codes in ((alleles[0], allele1), (alleles[1], allele2)):
+            codes[diploid, j] = (
+                pd.to_numeric(allele[diploid], errors="coerce")
+                .fillna(-1)
+                .clip(-1, ALLELE_MAX)
+                .values
+            )
+        phased[:, j] = gt.str.contains("|", regex=False).values
+    return allele1, allele2, phased
+
+
+def haplotype_codes(allele1, allele2, phased):
+    """
+    Code which haplotype carries the alternate allele of each genotype: HAP1 for e.g. 1|0, HAP2
+    for 0|1, NOT_HET for 0|0 and 1|1. Any other genotype (unphased, missing, two alternate
+    alleles, ...) gets a code of its own, so only identical genotypes compare as the same haplotype.
+    """
+    alt1 = (allele1 >= 1) & (allele1 <= 3)
+    alt2 = (allele2 >= 1) & (allele2 <= 3)
+    other = OTHER + ((allele1.astype(np.int32) + 1) * 256 + allele2 + 1) * 2 + phased
+    return np.select(
+        [
+            phased & (allele1 == 0) & alt2,
+            phased & alt1 & (allele2 == 0),
+            phased & (allele1 == allele2) & (allele1 >= 0) & (allele1 <= 1),
+        ],
+        [HAP2, HAP1, NOT_HET],
+        default=other,
+    ).astype(np.int32)
+
+
+def genotype_matrices(gens, samples):
+    """
+    Heterozygosity and haplotype codes of each sample at each variant position.
+    :param gens: genotypes with a pos column and one column of genotypes (e.g. 0|1) per sample, DataFrame.
+    :param samples: sample columns of gens, list.
+    :return: sorted unique positions, numpy array; het status, (positions x samples) bool numpy array;
+        haplotype codes (see haplotype_codes), (positions x samples) int32 numpy array. Positions
+        with several records (e.g. split multi-allelic sites) are het if any record is, and take
+        the haplotype of their first record.
+    """
+    allele1, allele2, phased = parse_genotypes(gens, samples)
+    return merge_records(gens["pos"].values, allele1, allele2, phased)
+
+
+def merge_records(pos, allele1, allele2, phased):
+    """
+    Heterozygosity and haplotype codes at each position of parsed genotype records, as
+    genotype_matrices.
+    :param pos: position of each record, numpy array.
+    :param allele1, allele2, phased: genotypes of each record, from parse_genotypes.
+    :return: sorted unique positions, het status and haplotype codes, see genotype_matrices.
+    """
+    positions, first_rows, rows = np.unique(
+        np.asarray(pos, dtype=np.int64), return_index=True, return_inverse=True
+    )
+    record_het = allele1 != allele2
+    het = np.zeros((len(positions), allele1.shape[1]), dtype=bool)
+    np.logical_or.at(het, rows, record_het)
+    hap = haplotype_codes(allele1, allele2, phased)[first_rows]
+    return positions, het, hap
+
+
+def variant_flags(annots, positions, cas_list):
+    """
+    Whether each variant position makes, breaks or is near a PAM for each Cas, looked up once
+    per gene.
+    :param annots: variant annotations with pos and makes_<cas>, breaks_<cas> and var_near_<cas>
+        columns, DataFrame.
+    :param positions: sorted unique variant positions, numpy array.
+    :param cas_list: Cas types, list.
+    :return: dict of cas -> (makes, breaks, near) bool numpy arrays aligned with positions.
+        Positions with several annotation records get a flag if any record has it.
+    """
+    cols = [f"{prefix}_{cas}" for cas in cas_list for prefix in FLAG_PREFIXES]
+    missing = [col for col in cols if col not in annots.columns]
+    if missing:
+        raise ValueError(f"Annotations have no {', '.join(missing)} column(s).")
+    flags = annots[cols].fillna(False).astype(bool)
+    flags["pos"] = annots["pos"].values
+    flags = flags.groupby("pos").any().reindex(positions, fill_value=False)
+    return {
+        cas: tuple(flags[f"{prefix}_{cas}"].to_numpy(dtype=bool) for prefix in FLAG_PREFIXES)
+        for cas in cas_list
+    }
+
+
+def bit_dtype(n_bits):
+    """
+    Smallest unsigned integer dtype holding n_bits bits.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_bits <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"At most 64 Cas types can be evaluated at once, not {n_bits}.")
+
+
+def flag_bits(cas_flags, cas_list):
+    """
+    Pack the PAM flags of several Cas into bitmasks, bit k standing for cas_list[k].
+    :param cas_flags: dict of cas -> (makes, breaks, near) bool numpy arrays, from variant_flags.
+    :param cas_list: Cas types, at most 64, list.
+    :return: makes, breaks and near bitmasks aligned with positions, numpy arrays of bit_dtype.
+    """
+    dtype = bit_dtype(len(cas_list))
+    n_positions = len(cas_flags[cas_list[0]][0]) if cas_list else 0
+    bits = tuple(np.zeros(n_positions, dtype=dtype) for _ in FLAG_PREFIXES)
+    for k, cas in enumerate(cas_list):
+        for packed, flag in zip(bits, cas_flags[cas]):
+            packed |= flag.astype(dtype) << dtype(k)
+    return bits
+
+
+def unpack_bits(bits, n_bits):
+    """
+    The first n_bits bits of each bitmask, as a (bitmasks x n_bits) bool numpy array.
+    """
+    return ((bits[:, None] >> np.arange(n_bits, dtype=bits.dtype)) & 1).astype(bool)
+
+
+class PairTargetability(object):
+    """
+    Candidate variant pairs of a gene and the samples het at both variants of each pair.
+    """
+
+    def __init__(self, positions, het, var1, var2, hap=None):
+        """
+        :param positions: sorted unique variant positions, numpy array.
+        :param het: (positions x samples) het status, bool numpy array.
+        :param var1: position of the first variant of each pair, numpy array.
+        :param var2: position of the second variant of each pair, numpy array.
+        :param hap: (positions x samples) haplotype codes from genotype_matrices, needed for
+            evaluate_rules.
+        """
+        self.positions = positions
+        self.het = het
+        self.hap = hap
+        self.idx1 = np.searchsorted(positions, var1)
+        self.idx2 = np.searchsorted(positions, var2)
+        if not (
+            np.array_equal(positions[self.idx1], var1)
+            and np.array_equal(positions[self.idx2], var2)
+        ):
+            raise ValueError("Variant pairs include positions without genotypes.")
+
+    @property
+    def n_pairs(self):
+        return len(self.idx1)
+
+    def pair_mask(self, is_targ):
+        """
+        Which pairs have both variants targetable, given whether each position is (e.g. by a
+        Cas), as a bool numpy array aligned with positions.
+        """
+        return is_targ[self.idx1] & is_targ[self.idx2]
+
+    def samples_with_pair(self, pair_mask=None):
+        """
+        Which samples are het at both variants of at least one pair (of those in pair_mask).
+        """
+        idx1, idx2 = self.idx1, self.idx2
+        if pair_mask is not None:
+            idx1, idx2 = idx1[pair_mask], idx2[pair_mask]
+        n_samples = self.het.shape[1]
+        has_pair = np.zeros(n_samples, dtype=bool)
+        chunk = max(MAX_CELLS // max(n_samples, 1), 1)
+        for start in range(0, len(idx1), chunk):
+            has_pair |= (
+                self.het[idx1[start : start + chunk]] & self.het[idx2[start : start + chunk]]
+            ).any(axis=0)
+        return has_pair
+
+    def sample_pairs(self, sample_idx, pair_mask=None):
+        """
+        Which pairs (of those in pair_mask) a sample is het at both variants of.
+        """
+        het = self.het[:, sample_idx]
+        both_het = het[self.idx1] & het[self.idx2]
+        if pair_mask is not None:
+            both_het &= pair_mask
+        return both_het
+
+    def evaluate_rules(self, pair_mask, makes, breaks, near, strict, cells=False):
+        """
+        Check, for every sample and pair it is het at both variants of, whether the two
+        allele-specific sites can be cut on the same chromosome:
+            both_near_pam             both variants are near a PAM (relaxed only)
+            near_and_make_or_break    one is near a PAM, the other makes or breaks one (relaxed only)
+            both_make_same_hap        both make a PAM, on the same haplotype
+            both_break_same_hap       both break a PAM, on the same haplotype
+            make_and_break_other_hap  variant 1 makes and variant 2 breaks a PAM, on different haplotypes
+            break_and_make_other_hap  variant 1 breaks and variant 2 makes a PAM, on different haplotypes
+        :param pair_mask: pairs to consider, bool numpy array.
+        :param makes: whether each position makes a PAM, bool numpy array (likewise breaks, near).
+        :param strict: only use the make/break rules, bool.
+        :param cells: also return the (pair, sample, rule) of each targetable pair of each sample.
+        :return: whether each sample has a targetable pair, bool numpy array; if cells, the pair
+            indices, sample indices and first matching rule (index into PAIR_RULES) of every
+            targetable (pair, sample), numpy arrays.
+        """
+        pair_ids = np.flatnonzero(pair_mask)
+        idx1, idx2 = self.idx1[pair_ids], self.idx2[pair_ids]
+        make1, make2 = makes[idx1], makes[idx2]
+        break1, break2 = breaks[idx1], breaks[idx2]
+        near1, near2 = near[idx1], near[idx2]
+        # rules that depend only on the pair, and on the pair and haplotypes
+        pair_rules = [near1 & near2, (near1 & (make2 | break2)) | (near2 & (make1 | break1))]
+        first_hap_rule = 2
+        if strict:
+            pair_rules = [np.zeros(len(pair_ids), dtype=bool)] * 2
+
+        n_samples = self.het.shape[1]
+        has_targ = np.zeros(n_samples, dtype=bool)
+        found = []
+        chunk = max(MAX_CELLS // max(n_samples, 1), 1)
+        for start in range(0, len(pair_ids), chunk):
+            part = slice(start, start + chunk)
+            both_het = self.het[idx1[part]] & self.het[idx2[part]]
+            same_hap = self.hap[idx1[part]] == self.hap[idx2[part]]
+            hap_rules = [
+                (make1[part] & make2[part])[:, None] & same_hap,
+                (break1[part] & break2[part])[:, None] & same_hap,
+                (make1[part] & break2[part])[:, None] & ~same_hap,
+                (break1[part] & make2[part])[:, None] & ~same_hap,
+            ]
+            rule = np.full(both_het.shape, NO_RULE, dtype=np.int8)
+            # later rules first, so each cell ends up with the first rule it matches
+            for i, matches in reversed(list(enumerate(hap_rules, first_hap_rule))):
+                rule[matches] = i
+            for i, matches in reversed(list(enumerate(pair_rules))):
+                rule[matches[part]] = i
+            rule[~both_het] = NO_RULE
+            targetable = rule < NO_RULE
+            has_targ |= targetable.any(axis=0)
+            if cells:
+                rows, samples = np.nonzero(targetable)
+                found.append((pair_ids[part][rows], samples, rule[rows, samples]))
+        if not cells:
+            return has_targ
+        if not found:
+            empty = np.zeros(0, dtype=np.int64)
+            return has_targ, empty, empty, np.zeros(0, dtype=np.int8)
+        return (has_targ,) + tuple(np.concatenate(parts) for parts in zip(*found))
+
+    def evaluate_bits(self, makes, breaks, near, strict, phased=True):
+        """
+        Check which samples have a targetable pair for several Cas at once, with their flags
+        packed into bitmasks (see flag_bits). A pair counts for a Cas if both variants make,
+        break or (unless strict) are near one of its PAMs, and, if phased, it meets one of the
+        rules of evaluate_rules for that Cas. Unphased, any such pair the sample is het at both
+        variants of counts, as with samples_with_pair.
+        :param makes: PAM-making bitmask of each position, numpy array (likewise breaks, near).
+        :param strict: only use the make/break rules, bool.
+        :param phased: check the rules, including whether sites are on the same haplotype, bool.
+        :return: bitmask of the Cas each sample has a targetable pair for, numpy array.
+        """
+        dtype = makes.dtype
+        idx1, idx2 = self.idx1, self.idx2
+        make1, make2 = makes[idx1], makes[idx2]
+        break1, break2 = breaks[idx1], breaks[idx2]
+        near1, near2 = near[idx1], near[idx2]
+        if strict:
+            pair_bits = (make1 | break1) & (make2 | break2)
+        else:
+            pair_bits = (make1 | break1 | near1) & (make2 | break2 | near2)
+        if phased:
+            # Cas for which the pair is targetable on the same and on different haplotypes
+            same_bits = ((make1 & make2) | (break1 & break2)) & pair_bits
+            other_bits = ((make1 & break2) | (break1 & make2)) & pair_bits
+            if not strict:
+                near_bits = (near1 & near2) | (near1 & (make2 | break2)) | (near2 & (make1 | break1))
+                near_bits &= pair_bits
+                same_bits |= near_bits
+                other_bits |= near_bits
+            pair_ids = np.flatnonzero(same_bits | other_bits)
+            same_bits, other_bits = same_bits[pair_ids], other_bits[pair_ids]
+        else:
+            pair_ids = np.flatnonzero(pair_bits)
+            pair_bits = pair_bits[pair_ids]
+        idx1, idx2 = idx1[pair_ids], idx2[pair_ids]
+
+        n_samples = self.het.shape[1]
+        has_targ = np.zeros(n_samples, dtype=dtype)
+        chunk = max(MAX_CELLS // (max(n_samples, 1) * dtype.itemsize), 1)
+        for start in range(0, len(pair_ids), chunk):
+            part = slice(start, start + chunk)
+            both_het = self.het[idx1[part]] & self.het[idx2[part]]
+            if phased:
+                same_hap = self.hap[idx1[part]] == self.hap[idx2[part]]
+                cell_bits = np.where(
+                    same_hap, same_bits[part][:, None], other_bits[part][:, None]
+                )
+            else:
+                cell_bits = np.broadcast_to(pair_bits[part][:, None], both_het.shape)
+            has_targ |= np.bitwise_or.reduce(np.where(both_het, cell_bits, dtype.type(0)), axis=0)
+        return has_targ
+
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+import crispor_scoring
+from crispor_scoring import (
+    calc_cfd_score,
+    calc_hit_score,
+    calc_mit_guide_score,
+    genome_identity,
+    score_guides,
+    score_key,
+    score_offtargets,
+)
+from score_cache import ScoreCache
+
+GUIDE = "ACGTACGTACGTACGTACGT"
+
+
+def test_hit_scores_follow_crispor():
+    assert calc_hit_score(GUIDE, GUIDE) == 100
+    # one mismatch in the last position, weight 0.583
+    assert np.isclose(calc_hit_score(GUIDE, GUIDE[:-1] + "A"), 41.7)
+    # two adjacent mismatches: weights 0.685 and 0.583, mean distance 1, 2 mismatches
+    expected = (1 - 0.685) * (1 - 0.583) / ((18 / 19) * 4 + 1) / 4 * 100
+    assert np.isclose(calc_hit_score(GUIDE, GUIDE[:-2] + "TA"), expected)
+    # 21 bp guides are scored on their last 20 bp
+    assert calc_hit_score("T" + GUIDE, "A" + GUIDE) == 100
+    assert calc_mit_guide_score(0) == 100
+    assert calc_cfd_score(GUIDE, GUIDE + "AGG") == 1.0
+    assert calc_cfd_score(GUIDE, GUIDE[:-1] + "N" + "AGG") is None
+
+
+def test_score_offtargets_skips_the_on_target():
+    hits = [
+        (0, GUIDE + "TGG", 1),
+        (1, GUIDE[:-1] + "A" + "TGG", 1),
+        # off-targets next to an alternative PAM count for a fifth
+        (1, GUIDE[:-1] + "A" + "TAG", 1),
+    ]
+    mit, cfd, n_offtargets = score_offtargets(GUIDE, hits, "NGG")
+    assert mit == round(100 / (100 + 41.7 * 1.2) * 100)
+    assert n_offtargets == 2
+    assert 0 < cfd <= 100
+    # too repetitive guides score 0
+    too_many = [(1, GUIDE + "TGG", crispor_scoring.MAXOCC + 1)]
+    assert score_offtargets(GUIDE, too_many, "NGG") == (0, 0, 0)
+
+
+def test_score_guides_aligns_each_guide_once(tmp_path, monkeypatch):
+    genome_fa = tmp_path / "gen" / "gen.fa"
+    genome_fa.parent.mkdir()
+    genome_fa.write_text(">chr1\nACGT\n")
+    aligned = []
+
+    def find_offtargets(guides, genomes_dir, genome, pam, jobs=1):
+        aligned.extend(guide for _, guide in guides)
+        hits = {
+            idx: [(0, guide + "TGG", 1), (1, guide[:-1] + "A" + "TGG", 1)]
+            for idx, guide in guides
+        }
+        return hits, []
+
+    monkeypatch.setattr(crispor_scoring, "find_offtargets", find_offtargets)
+    cache = ScoreCache(str(tmp_path / "scores.db"))
+    guides = [GUIDE, "TTTTACGTACGTACGTACGT", "ACGN" * 5, "ACGT"]
+    first = score_guides(guides, str(tmp_path), "gen", cache=cache)
+    second = score_guides(guides, str(tmp_path), "gen", cache=cache)
+    assert aligned == guides[:2]
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+    # guides that can't be aligned are not scored
+    assert np.isnan(first[0][2:]).all()
+    assert cache.hits == 2 and cache.misses == 2
+
+    # keys change with the genome file
+    genome_id = genome_identity(str(genome_fa))
+    os.utime(genome_fa, (0, 0))
+    assert genome_identity(str(genome_fa)) != genome_id
+    assert score_key(GUIDE, "NGG", genome_id) != score_key(GUIDE, "NGA", genome_id)
@@ -0,0 +1,186 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ExcisionFinder as ef
+
+SAMPLES = [f"S{i}" for i in range(8)]
+CAS_LIST = ["all", "SpCas9", "SaCas9"]
+GENE_DAT_COLUMNS = [
+    "name",
+    "chrom",
+    "txStart",
+    "txEnd",
+    "cdsStart",
+    "cdsEnd",
+    "exonCount",
+    "exonStarts",
+    "exonEnds",
+    "size",
+]
+
+
+class FakeGenotypes(ef.GenotypeSource):
+    """
+    Genotypes held in memory, returned like bcftools view -r: every record overlapping a region.
+    """
+
+    def __init__(self, gens):
+        self.gens = gens
+        self.chrstart = True
+        self.samples = SAMPLES
+        self.bcf = None
+
+    def region(self, chrom, start, end):
+        gens = self.gens
+        rec_end = gens["pos"] + gens["ref"].str.len() - 1
+        return gens[(gens["chrom"] == chrom) & (rec_end >= start) & (gens["pos"] <= end)]
+
+
+class FakeAnnotationStore(ef.AnnotationStore):
+    def __init__(self, annots):
+        self.all = annots
+        self.chrstart = True
+        self.span = None
+        self.annots = None
+        self.positions = None
+
+    def load(self, chrom, start, end):
+        annots = self.all[(self.all["pos"] >= start) & (self.all["pos"] <= end)]
+        self.annots = annots.sort_values("pos", kind="mergesort")
+        self.positions = self.annots["pos"].values
+        self.span = (chrom, start, end)
+
+
+def random_chromosome(rng, n_vars=600, length=200000):
+    pos = np.sort(rng.choice(np.arange(1, length), n_vars, replace=False))
+    gens = pd.DataFrame(
+        {
+            "chrom": "chr1",
+            "pos": pos,
+            # mostly SNVs, with deletions long enough to overlap the start of a gene
+            "ref": ["A" * n for n in rng.choice([1, 1, 1, 2, 40, 800], n_vars)],
+            "alt": "G",
+        }
+    )
+    for sample in SAMPLES:
+        gens[sample] = rng.choice(["0|0", "0|1", "1|0", "1|1"], n_vars, p=[0.5, 0.2, 0.2, 0.1])
+    annots = gens[["chrom", "pos"]].copy()
+    for cas in CAS_LIST[1:]:
+        for prefix in ("makes", "breaks", "var_near"):
+            annots[f"{prefix}_{cas}"] = rng.random(n_vars) < 0.3
+    return gens, annots
+
+
+def random_genes(rng, n_genes=25, length=200000):
+    rows = []
+    for i in range(n_genes):
+        start = int(rng.integers(1, length - 30000))
+        size = int(rng.integers(500, 30000))
+        rows.append(
+            [
+                f"G{i}",
+                "chr1",
+                start,
+                start + size,
+                start,
+                start + size,
+                2,
+                f"{start + 100},{start + size // 2},",
+                f"{start + 300},{start + size // 2 + 200},",
+                0,
+            ]
+        )
+    gene_dat = pd.DataFrame(rows, columns=GENE_DAT_COLUMNS).set_index("name")
+    genes = [ef.Gene(name, gene_dat, 0) for name in gene_dat.index]
+    return sorted(genes, key=lambda gene: (gene.start, gene.end))
+
+
+def evaluate(gene, annots_store, genotypes, sweep=None):
+    args = {"-s": False, "--not_phased": False, "--exhaustive": True}
+    try:
+        final_targ, exh_df, var1s, var2s = ef.evaluate_gene(
+            gene, annots_store, genotypes, 5000, CAS_LIST, args, sweep=sweep
+        )
+    except ef.GeneSkipped as e:
+        return e.skip_list
+    return final_targ, exh_df, var1s.tolist(), var2s.tolist()
+
+
+@pytest.mark.parametrize("span", [1000000, 20000, 3000])
+def test_sweep_matches_per_gene_including_overlapping_deletions(span, monkeypatch):
+    rng = np.random.default_rng(span)
+    gens, annots = random_chromosome(rng)
+    genes = random_genes(rng)
+    genotypes = FakeGenotypes(gens)
+    monkeypatch.setattr(ef, "SWEEP_SPAN", span)
+    sweep = ef.SweepBuffer(FakeAnnotationStore(annots), genotypes, 5000, CAS_LIST)
+    for gene in genes:
+        expected = evaluate(gene, FakeAnnotationStore(annots), genotypes)
+        got = evaluate(gene, sweep.annots_store, genotypes, sweep=sweep)
+        if isinstance(expected, str):
+            assert got == expected
+            continue
+        for want, have in zip(expected, got):
+            if isinstance(want, pd.DataFrame):
+                pd.testing.assert_frame_equal(
+                    want.reset_index(drop=True), have.reset_index(drop=True)
+                )
+            else:
+                assert want == have
+
+
+def next_exon(variant_position, coding_exon_starts):
+    greater_than_var = [x for x in coding_exon_starts if x > variant_position]
+    if not greater_than_var:
+        return False
+    return min(greater_than_var)
+
+
+def targ_pair(variant1, variant2, coding_positions, coding_exon_starts):
+    """
+    Per-pair check of the original implementation, except that a pair outside the exons with no
+    exon after it is not targetable (next_exon returned False, which compared as position 0).
+    """
+    low_var, high_var = sorted([variant1, variant2])
+    if low_var in coding_positions or high_var in coding_positions:
+        return True
+    following = next_exon(low_var, coding_exon_starts)
+    if following is False:
+        return False
+    return bool(high_var >= following)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_targ_pairs_matches_per_pair_check(seed):
+    rng = np.random.default_rng(seed)
+    n_exons = int(rng.integers(0, 6))
+    exon_starts = np.sort(rng.choice(np.arange(100, 2000), n_exons, replace=False))
+    # exons may overlap each other
+    exon_ends = exon_starts + rng.integers(0, 300, n_exons)
+    coding_positions = {
+        pos for start, stop in zip(exon_starts, exon_ends) for pos in range(start, stop + 1)
+    }
+    variant1 = rng.integers(1, 2500, 500)
+    variant2 = rng.integers(1, 2500, 500)
+    expected = [
+        targ_pair(v1, v2, coding_positions, exon_starts) for v1, v2 in zip(variant1, variant2)
+    ]
+    np.testing.assert_array_equal(
+        ef.targ_pairs(variant1, variant2, exon_starts, exon_ends), expected
+    )
+
+
+@pytest.mark.parametrize("max_dist", [0, 1, 50, 5000])
+def test_variant_pairs_within_matches_combinations(max_dist):
+    rng = np.random.default_rng(max_dist)
+    variants = rng.choice(np.arange(1, 3000), 200, replace=False)
+    expected = [
+        (low, high)
+        for low, high in itertools.combinations(sorted(variants), 2)
+        if high - low <= max_dist
+    ]
+    var1, var2 = ef.variant_pairs_within(variants, max_dist)
+    assert list(zip(var1, var2)) == expected
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("Bio")
+import gen_sgRNAs
+from seq_pack import CODE_LOOKUP
+
+
+def kmer_code(kmer):
+    code = 0
+    for base in kmer.encode("ascii"):
+        code = (code << 2) | int(CODE_LOOKUP[base])
+    return code
+
+
+@pytest.fixture
+def seed_index(tmp_path):
+    # 4-mer index where only AAAA is repetitive
+    counts = np.zeros(4 ** 4, dtype=np.uint32)
+    counts[kmer_code("AAAA")] = 1000
+    fname = str(tmp_path / "seeds.npy")
+    np.save(fname, counts)
+    return fname
+
+
+def seed_args(seed_index, c=False):
+    return {"--seed_index": seed_index, "--max_seed_occ": "10", "-c": c}
+
+
+def test_seed_of_negative_made_pam_guide_is_at_5prime_end(seed_index):
+    # made PAM guides are never reverse complemented, so an SpCas9 guide for a '-' strand
+    # PAM has its seed at the start
+    guide = "AAAA" + "CGTC" * 4
+    out = pd.DataFrame(
+        {
+            "cas_type": ["SpCas9", "SpCas9"],
+            "strand": ["negative", "negative"],
+            "gRNA_ref": ["G" * 20, guide],
+            "gRNA_alt": [guide, guide],
+        }
+    )
+    kept = gen_sgRNAs.filter_seed_occurrences(out, seed_args(seed_index))
+    # the near PAM guide is reverse complemented, with its seed at the end
+    assert kept.index.tolist() == [1]
+
+
+def test_seed_end_with_c(seed_index):
+    guide = "CGTC" * 4 + "AAAA"
+    out = pd.DataFrame(
+        {
+            "cas_type": ["SpCas9", "SpCas9"],
+            "strand": ["positive", "negative"],
+            "gRNA_ref": [guide, guide],
+            "gRNA_alt": [guide, guide],
+        }
+    )
+    kept = gen_sgRNAs.filter_seed_occurrences(out, seed_args(seed_index, c=True))
+    assert kept.index.tolist() == [1]
+
+
+def test_chunk_guides_keeps_every_locus_in_order():
+    frames = [pd.DataFrame({"locus": [name] * n}) for name, n in zip("abcd", [2, 0, 3, 1])]
+    chunks = list(gen_sgRNAs.chunk_guides(frames, chunk_guides=2))
+    assert [chunk["locus"].tolist() for chunk in chunks] == [
+        ["a", "a"],
+        ["c", "c", "c"],
+        ["d"],
+    ]
+
+
+def test_format_guides_masks_placeholders_of_every_length():
+    out = pd.DataFrame(
+        {
+            "cas_type": ["SpCas9"] * 4,
+            "guide_length": [20, 22, 22, 20],
+            "gRNA_ref": ["G" * 20, "ACGT" * 5 + "TT", "C" * 22, "G" * 21],
+            "gRNA_alt": ["ACGT" * 5, "G" * 22, "ACGT" * 5 + "AC", "ACGT" * 5],
+        }
+    )
+    out = gen_sgRNAs.format_guides(out, {"-d": True, "-r": True})
+    assert out["gRNA_ref"].tolist() == ["-" * 20, "ACGU" * 5 + "UU", "-" * 22, "G" * 21]
+    assert out["gRNA_alt"].tolist() == ["ACGU" * 5, "-" * 22, "ACGU" * 5 + "AC", "ACGU" * 5]
+    assert out["guide_id"].tolist() == ["SpCas9_0", "SpCas9_1", "SpCas9_2", "SpCas9_3"]
+
+
+def test_rev_comp_guides():
+    assert gen_sgRNAs.rev_comp_guides(["ACGTT", "GGN", ""]) == ["AACGT", "NCC", ""]
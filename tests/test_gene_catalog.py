@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import ExcisionFinder as ef
+from gene_catalog import GENE_DAT_COLUMNS, GeneCatalog, build_catalog, read_gene_dat
+
+
+def write_gene_dat(path, rng, n_genes=200):
+    lines = ["symbol\t" + "\t".join(GENE_DAT_COLUMNS)]
+    for i in range(n_genes):
+        # a few symbols are listed more than once, e.g. on different chromosomes
+        symbol = f"G{i + 100}" if i < 10 else f"G{i}"
+        n_exons = int(rng.integers(0, 6))
+        tx_start = int(rng.integers(0, 10 ** 8))
+        starts = np.sort(rng.integers(tx_start, tx_start + 50000, n_exons))
+        ends = starts + rng.integers(1, 500, n_exons)
+        tx_end = int(ends.max()) if n_exons else tx_start + 10
+        fields = [
+            f"NM_{i}",
+            f"chr{rng.integers(1, 23)}",
+            tx_start,
+            tx_end,
+            int(starts.min()) if n_exons else tx_end,
+            tx_end,
+            n_exons,
+            "".join(f"{pos}," for pos in starts),
+            "".join(f"{pos}," for pos in ends),
+            tx_end - tx_start,
+        ]
+        lines.append("\t".join([symbol] + [str(field) for field in fields]))
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_catalog_records_match_gene_dat(tmp_path):
+    write_gene_dat(tmp_path / "gene_dat.tsv", np.random.default_rng(0))
+    gene_dat = read_gene_dat(str(tmp_path / "gene_dat.tsv"))
+    build_catalog(gene_dat, str(tmp_path / "catalog"))
+    catalog = GeneCatalog(str(tmp_path / "catalog"))
+
+    counts = gene_dat.index.value_counts()
+    assert (counts > 1).sum() == 10
+    assert len(catalog) == (counts == 1).sum()
+    for symbol, n_times in counts.items():
+        if n_times > 1:
+            # genes listed more than once fail on their own, with the same error
+            with pytest.raises(ValueError) as from_dat:
+                ef.gene_dat_record(gene_dat, symbol)
+            with pytest.raises(ValueError) as from_catalog:
+                catalog.record(symbol)
+            assert str(from_catalog.value) == str(from_dat.value)
+            continue
+        expected = ef.gene_dat_record(gene_dat, symbol)
+        record = catalog.record(symbol)
+        assert sorted(record) == sorted(expected)
+        for field, value in expected.items():
+            assert np.array_equal(record[field], value), (symbol, field)
+    with pytest.raises(ValueError):
+        catalog.record("not_a_gene")
@@ -0,0 +1,38 @@
+from collections import namedtuple
+
+from gene_scheduler import Manifest, schedule_chunks
+
+FakeGene = namedtuple("FakeGene", ["name", "chrom", "start", "end"])
+
+
+def test_sweep_segments_split_chromosomes_by_span():
+    genes = [FakeGene(f"a{i}", "chr1", i * 1000, i * 1000 + 500) for i in range(10)]
+    genes += [FakeGene("b0", "chr2", 0, 100)]
+    chunks = schedule_chunks(genes, None, max_span=2500)
+    assert sorted([gene.name for gene in chunk] for chunk in chunks) == [
+        ["a0", "a1", "a2"],
+        ["a3", "a4", "a5"],
+        ["a6", "a7", "a8"],
+        ["a9"],
+        ["b0"],
+    ]
+    # largest chunk first
+    sizes = [sum(gene.end - gene.start for gene in chunk) for chunk in chunks]
+    assert sizes == sorted(sizes, reverse=True)
+
+
+def test_manifest_resume_drops_partial_record(tmp_path):
+    prefix = str(tmp_path / "run_")
+    manifest = Manifest(prefix)
+    manifest.record("A", "evaluated", 10, 4, 1.0, {"targ": 1})
+    manifest.record("B", "not_enough_hets", 0, 0, 0.5, {"targ": 1})
+    with open(manifest.fname, "a") as f:
+        f.write('{"gene": "C", "status": "eval')
+
+    resumed = Manifest(prefix, resume=True)
+    assert resumed.done("A") and resumed.done("B") and not resumed.done("C")
+    assert resumed.rows("targ") == 1
+    resumed.record("C", "evaluated", 5, 5, 2.0, {"targ": 6})
+    assert list(Manifest(prefix, resume=True).status_table()["gene"]) == ["A", "B", "C"]
+    # without resume the manifest starts over
+    assert not Manifest(prefix).done("A")
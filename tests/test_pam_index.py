@@ -0,0 +1,16 @@
+import numpy as np
+
+from pam_index import PamIndex, pam_fname
+
+
+def test_ranges_match_a_scan_of_unsorted_sites(tmp_path):
+    rng = np.random.default_rng(0)
+    sites = rng.choice(np.arange(10000), 500, replace=False)
+    np.save(pam_fname(str(tmp_path), "1", "SpCas9", "for"), sites)
+    index = PamIndex(str(tmp_path))
+    assert np.array_equal(index.sites("chr1", "SpCas9", "for"), np.sort(sites))
+    for start, stop in np.sort(rng.integers(0, 10000, (50, 2)), axis=1):
+        expected = np.sort(sites[(sites >= start) & (sites <= stop)])
+        assert np.array_equal(index.in_range("chr1", "SpCas9", "for", start, stop), expected)
+        lo, hi = index.bounds("1", "SpCas9", "for", start, stop)
+        assert hi - lo == len(expected)
@@ -0,0 +1,24 @@
+import math
+
+from score_cache import ScoreCache
+
+
+def test_scores_round_trip_with_missing_values(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.db"))
+    cache.put_many([("a", 90.0, float("nan"), 3), ("b", 50.0, 60.0, 7)])
+    found = cache.get_many(["a", "b", "c"])
+    assert found["b"] == (50.0, 60.0, 7)
+    assert found["a"][0] == 90.0 and math.isnan(found["a"][1]) and found["a"][2] == 3
+    assert "c" not in found
+    assert (cache.hits, cache.misses) == (2, 1)
+    # scores persist across instances
+    assert ScoreCache(str(tmp_path / "scores.db")).get_many(["b"]) == {"b": (50.0, 60.0, 7)}
+
+
+def test_least_recently_used_scores_are_evicted(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.db"), max_entries=2)
+    cache.put_many([("a", 1.0, 1.0, 1)])
+    cache.put_many([("b", 2.0, 2.0, 2)])
+    cache.get_many(["a"])
+    cache.put_many([("c", 3.0, 3.0, 3)])
+    assert sorted(cache.get_many(["a", "b", "c"])) == ["a", "c"]
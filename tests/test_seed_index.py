@@ -0,0 +1,45 @@
+import itertools
+
+import numpy as np
+
+from seed_index import SeedIndex, count_kmers, kmer_codes, rev_comp_codes
+
+BASES = "ACGT"
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+def test_counts_match_a_scan_of_both_strands(tmp_path, monkeypatch):
+    monkeypatch.setattr("seed_index.COUNT_CHUNK", 7)
+    rng = np.random.default_rng(0)
+    ref_genome = {
+        "chr1": "".join(rng.choice(list("ACGTacgN"), 200)),
+        "chr2": "".join(rng.choice(list("ACGT"), 50)),
+    }
+    k = 3
+    counts = count_kmers(ref_genome, ["chr1", "chr2"], k)
+    expected = {"".join(kmer): 0 for kmer in itertools.product(BASES, repeat=k)}
+    for seq in ref_genome.values():
+        seq = seq.upper()
+        for strand in (seq, seq.translate(COMPLEMENT)[::-1]):
+            for i in range(len(strand) - k + 1):
+                if strand[i : i + k] in expected:
+                    expected[strand[i : i + k]] += 1
+    np.save(tmp_path / "seeds.npy", counts)
+    index = SeedIndex(str(tmp_path / "seeds.npy"))
+    assert index.k == k
+    seeds = list(expected)
+    assert list(index.seed_counts(seeds)) == [expected[seed] for seed in seeds]
+    # seeds of the wrong length or with other bases are not counted
+    assert list(index.seed_counts(["acg", "ACN", "ACGT"])) == [expected["ACG"], 0, 0]
+
+
+def test_reverse_complement_codes():
+    k = 4
+    kmers = ["".join(kmer) for kmer in itertools.product(BASES, repeat=k)]
+    codes, valid = kmer_codes(np.frombuffer("".join(kmers).encode("ascii"), dtype=np.uint8), k)
+    codes = codes[::k]
+    assert valid.all()
+    assert list(codes) == list(range(4 ** k))
+    rc = rev_comp_codes(k)
+    expected = [kmer.translate(COMPLEMENT)[::-1] for kmer in kmers]
+    assert [kmers[rc[code]] for code in codes] == expected
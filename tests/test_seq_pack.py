@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import seq_pack
+
+
+def random_seqs(rng, n, length, bases="ACGTN"):
+    return ["".join(rng.choice(list(bases), length)) for _ in range(n)]
+
+
+@pytest.mark.parametrize("length", [1, 12, 20, 23, 32])
+def test_pack_round_trip(length):
+    rng = np.random.default_rng(length)
+    seqs = random_seqs(rng, 200, length)
+    assert seq_pack.unpack_seqs(seq_pack.pack_seqs(seqs, length), length) == seqs
+
+
+def test_pack_is_case_insensitive_and_other_bases_become_n():
+    packed = seq_pack.pack_seqs(["acgtRY"], 6)
+    assert seq_pack.unpack_seqs(packed, 6) == ["ACGTNN"]
+
+
+def test_pack_code_order():
+    # first base in the most significant bits
+    packed = seq_pack.pack_seqs(["CA", "AT"], 2)
+    assert packed["code"].tolist() == [0b0100, 0b0011]
+    assert packed["nmask"].tolist() == [0, 0]
+
+
+@pytest.mark.parametrize("length", [0, 33])
+def test_unsupported_lengths(length):
+    with pytest.raises(ValueError):
+        seq_pack.check_length(length)
+
+
+def test_decode_guides_of_mixed_lengths():
+    seqs = ["ACGT", "", "GGGGGGGGGGGGGGGGGGGGGG", "TTN"]
+    width = max(len(seq) for seq in seqs)
+    seq_bytes = np.zeros((len(seqs), width), dtype=np.uint8)
+    for i, seq in enumerate(seqs):
+        seq_bytes[i, : len(seq)] = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+    assert seq_pack.decode_guides(seq_bytes) == seqs
+    assert seq_pack.decode_guides(np.zeros((2, 0), dtype=np.uint8)) == ["", ""]
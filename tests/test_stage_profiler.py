@@ -0,0 +1,41 @@
+import time
+
+from stage_profiler import StageProfiler
+
+
+def test_generator_reads_are_not_charged_to_the_consuming_locus():
+    profiler = StageProfiler()
+    profiler.enable()
+
+    @profiler.profiled("read_windows", per_locus=False)
+    def windows():
+        for window in ("w1", "w2"):
+            time.sleep(0.01)
+            yield window
+
+    @profiler.profiled("design")
+    def design():
+        time.sleep(0.001)
+
+    with profiler.locus("run"):
+        for window in windows():
+            with profiler.locus(window):
+                design()
+
+    assert profiler.stages["read_windows"]["calls"] == 3
+    assert profiler.stages["design"]["calls"] == 2
+    assert set(profiler.loci) == {"w1", "w2"}
+    for stages in profiler.loci.values():
+        assert set(stages) == {"design"}
+
+
+def test_nested_stages_are_exclusive():
+    profiler = StageProfiler()
+    profiler.enable()
+    with profiler.locus("a"):
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                time.sleep(0.02)
+    assert profiler.stages["inner"]["wall_s"] >= 0.02
+    assert profiler.stages["outer"]["wall_s"] < 0.02
+    assert profiler.loci["a"]["inner"]["calls"] == 1
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from table_writer import TableWriter, read_table
+
+
+def write_chunks(prefix, out_format, chunks, resume_rows=None):
+    with TableWriter(
+        prefix, out_format, {}, "test", "0.0.1", "test", resume_rows=resume_rows
+    ) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.fname
+
+
+def test_tsv_chunks_in_first_column_order(tmp_path):
+    chunks = [
+        pd.DataFrame({"gene": ["A", "B"], "n": [1, 2]}),
+        pd.DataFrame({"n": [3], "gene": ["C"]}),
+    ]
+    fname = write_chunks(str(tmp_path / "out"), "tsv", chunks)
+    pd.testing.assert_frame_equal(
+        read_table(fname), pd.DataFrame({"gene": ["A", "B", "C"], "n": [1, 2, 3]})
+    )
+
+
+def test_tsv_resume_drops_rows_after_resume_point(tmp_path):
+    prefix = str(tmp_path / "out")
+    write_chunks(prefix, "tsv", [pd.DataFrame({"n": [1, 2, 3]})])
+    fname = write_chunks(prefix, "tsv", [pd.DataFrame({"n": [4]})], resume_rows=2)
+    assert read_table(fname)["n"].tolist() == [1, 2, 4]
+
+
+def test_hdf_append_longer_strings(tmp_path):
+    pytest.importorskip("tables")
+    chunks = [
+        pd.DataFrame({"gene": ["A"], "gRNAs": ["ACGT"]}),
+        pd.DataFrame({"gene": ["B"], "gRNAs": [",".join(["ACGT" * 5] * 50)]}),
+    ]
+    fname = write_chunks(str(tmp_path / "out"), "hdf", chunks)
+    pd.testing.assert_frame_equal(
+        read_table(fname).reset_index(drop=True), pd.concat(chunks, ignore_index=True)
+    )
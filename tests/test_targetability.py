@@ -0,0 +1,122 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cas_object import get_cas_list
+from targetability import (
+    NO_RULE,
+    PairTargetability,
+    flag_bits,
+    genotype_matrices,
+    unpack_bits,
+)
+
+GENOTYPES = ["0|0", "0|1", "1|0", "1|1", "0/1", "1/0", "./.", ".|1", "1|2", "2|0", "0", "0|1:35"]
+
+
+def random_targetability(rng, n_records=40, n_samples=12, max_dist=100, length=2000):
+    """
+    Random genotypes (phased, unphased, missing, multi-allelic, haploid), including several
+    records at one position, and every pair of positions at most max_dist apart.
+    """
+    samples = [f"S{j}" for j in range(n_samples)]
+    gens = pd.DataFrame({"pos": np.sort(rng.integers(1, length, n_records))})
+    for sample in samples:
+        gens[sample] = rng.choice(GENOTYPES, n_records)
+    positions, het, hap = genotype_matrices(gens, samples)
+    pairs = [
+        (low, high)
+        for low, high in itertools.combinations(positions, 2)
+        if high - low <= max_dist
+    ]
+    var1 = np.array([low for low, _ in pairs], dtype=np.int64)
+    var2 = np.array([high for _, high in pairs], dtype=np.int64)
+    return positions, PairTargetability(positions, het, var1, var2, hap)
+
+
+def random_flags(rng, n_positions, cas_list, p=0.1):
+    """
+    Sparse makes/breaks/near flags, so that not every sample is targetable by every Cas.
+    """
+    return {
+        cas: tuple(rng.random(n_positions) < p for _ in range(3)) for cas in cas_list
+    }
+
+
+def reference_rule(make, brk, near, same_hap, strict):
+    """
+    First rule of evaluate_rules met by a pair of variants, one variant at a time.
+    """
+    if not strict:
+        if near[0] and near[1]:
+            return 0
+        if (near[0] and (make[1] or brk[1])) or (near[1] and (make[0] or brk[0])):
+            return 1
+    if make[0] and make[1] and same_hap:
+        return 2
+    if brk[0] and brk[1] and same_hap:
+        return 3
+    if make[0] and brk[1] and not same_hap:
+        return 4
+    if brk[0] and make[1] and not same_hap:
+        return 5
+    return NO_RULE
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("strict", [False, True])
+@pytest.mark.parametrize("phased", [True, False])
+def test_evaluate_bits_matches_each_cas(seed, strict, phased):
+    rng = np.random.default_rng(seed)
+    cas_list = get_cas_list()
+    positions, pair_targ = random_targetability(rng)
+    cas_flags = random_flags(rng, len(positions), cas_list)
+    has_targ = unpack_bits(
+        pair_targ.evaluate_bits(*flag_bits(cas_flags, cas_list), strict, phased=phased),
+        len(cas_list),
+    )
+    for k, cas in enumerate(cas_list):
+        makes, breaks, near = cas_flags[cas]
+        if strict:
+            pair_mask = pair_targ.pair_mask(makes | breaks)
+        else:
+            pair_mask = pair_targ.pair_mask(makes | breaks | near)
+        if phased:
+            expected = pair_targ.evaluate_rules(pair_mask, makes, breaks, near, strict)
+        else:
+            expected = pair_targ.samples_with_pair(pair_mask)
+        np.testing.assert_array_equal(has_targ[:, k], expected, err_msg=cas)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("strict", [False, True])
+def test_evaluate_rules_cells_match_reference(seed, strict):
+    rng = np.random.default_rng(seed)
+    positions, pair_targ = random_targetability(rng)
+    makes, breaks, near = random_flags(rng, len(positions), ["cas"])["cas"]
+    pair_mask = rng.random(pair_targ.n_pairs) < 0.8
+    has_targ, pair_ids, sample_ids, rules = pair_targ.evaluate_rules(
+        pair_mask, makes, breaks, near, strict, cells=True
+    )
+    expected = []
+    for pair in np.flatnonzero(pair_mask):
+        i, j = pair_targ.idx1[pair], pair_targ.idx2[pair]
+        for sample in range(pair_targ.het.shape[1]):
+            if not (pair_targ.het[i, sample] and pair_targ.het[j, sample]):
+                continue
+            rule = reference_rule(
+                (makes[i], makes[j]),
+                (breaks[i], breaks[j]),
+                (near[i], near[j]),
+                pair_targ.hap[i, sample] == pair_targ.hap[j, sample],
+                strict,
+            )
+            if rule < NO_RULE:
+                expected.append((pair, sample, rule))
+    assert sorted(zip(pair_ids, sample_ids, rules)) == expected
+    np.testing.assert_array_equal(
+        np.flatnonzero(has_targ), sorted({sample for _, sample, _ in expected})
+    )
+